@@ -0,0 +1,450 @@
+import contextlib
+import os
+import struct
+import typing
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5 import QtCore, QtGui, QtWidgets, QtSvg
+from PyQt5.QtCore import Qt
+
+from UI import image_loader, scene_snapshot
+from UI.tracing import tracer, traced
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class ExportError(Exception):
+    pass
+
+
+# what exports render: the live scene on the GUI thread, a snapshot renderer anywhere
+Scene = typing.Union[QtWidgets.QGraphicsScene, scene_snapshot.SnapshotRenderer]
+
+
+class ExportOptions(typing.NamedTuple):
+    width: int  # output size in pixels
+    height: int
+    dpi: int = 96
+    tile_size: int = 512  # tile height, tiles span the full output width up to MAX_TILE_WIDTH
+    source_rect: typing.Optional[QtCore.QRectF] = None  # scene area to export, whole scene when None
+
+
+MAX_TILE_WIDTH = 8192
+MAX_STITCHED_PIXELS = 64 * 1024 * 1024  # formats without a streaming writer are built as one image in memory
+STREAMED_FORMATS = (".png", ".bmp")
+ORIGINAL_BAND_MEMORY = 256 * 1024 * 1024  # rows of a proxied original decoded at once
+
+
+def scene_export_rect(scene: Scene) -> QtCore.QRectF:
+    """
+    :return: the scene rect grown to every item, so nothing drawn outside of the canvas gets cut off
+    """
+    return scene.sceneRect().united(scene.itemsBoundingRect())
+
+
+class TiledSceneRenderer:
+    """
+    Renders a scene area into QImage tiles, so memory is bounded by the tile size and not by the output size.
+
+    Tiles are wide strips rather than squares: antialiased strokes are stroked in full for every tile they touch,
+    so the fewer tiles a long line crosses the cheaper the export.
+    """
+
+    def __init__(self, scene: Scene, options: ExportOptions, background=Qt.white):
+        self.scene = scene
+        self.options = options
+        self.source_rect = options.source_rect or scene_export_rect(scene)
+        self.background = QtGui.QColor(background)
+        self._scale_x = self.source_rect.width() / options.width
+        self._scale_y = self.source_rect.height() / options.height
+
+    def tile_rows(self) -> typing.Iterator[typing.List[QtCore.QRect]]:
+        """
+        :return: rows of tile rects in output pixel coordinates
+        """
+        tile_size = self.options.tile_size
+        for y in range(0, self.options.height, tile_size):
+            yield [QtCore.QRect(x, y, min(MAX_TILE_WIDTH, self.options.width - x),
+                                min(tile_size, self.options.height - y))
+                   for x in range(0, self.options.width, MAX_TILE_WIDTH)]
+
+    def tile_count(self) -> int:
+        return -(-self.options.width // MAX_TILE_WIDTH) * -(-self.options.height // self.options.tile_size)
+
+    def source_for(self, target: QtCore.QRect) -> QtCore.QRectF:
+        return QtCore.QRectF(self.source_rect.x() + target.x() * self._scale_x,
+                             self.source_rect.y() + target.y() * self._scale_y,
+                             target.width() * self._scale_x, target.height() * self._scale_y)
+
+    def render_tile(self, target: QtCore.QRect, image_format=QtGui.QImage.Format_RGB888) -> QtGui.QImage:
+        image = QtGui.QImage(target.size(), QtGui.QImage.Format_ARGB32_Premultiplied)
+        image.fill(self.background)
+        source = self.source_for(target)
+        if self.scene.items(source, Qt.IntersectsItemBoundingRect):  # empty tiles are background only
+            with tracer.span("render_tile", x=target.x(), y=target.y()):
+                painter = QtGui.QPainter(image)
+                painter.setRenderHints(QtGui.QPainter.Antialiasing | QtGui.QPainter.SmoothPixmapTransform)
+                self.scene.render(painter, QtCore.QRectF(image.rect()), source, Qt.IgnoreAspectRatio)
+                painter.end()
+        return image.convertToFormat(image_format)
+
+
+class PngStreamWriter:
+    """
+    Minimal streaming PNG encoder (8 bit RGB), rows are compressed and written as they come in.
+    """
+    row_format = QtGui.QImage.Format_RGB888
+
+    def __init__(self, file: typing.BinaryIO, width: int, height: int, dpi: int = 96, compression: int = 6):
+        self._file = file
+        self._compressor = zlib.compressobj(compression)
+        file.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        dots_per_meter = int(round(dpi / 0.0254))
+        self._chunk(b"pHYs", struct.pack(">IIB", dots_per_meter, dots_per_meter, 1))
+
+    def _chunk(self, tag: bytes, data: bytes):
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(tag)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag)) & 0xffffffff))
+
+    @traced("png_write_rows")
+    def write_rows(self, rows: typing.Iterable[bytes]):
+        compressed = []
+        for row in rows:
+            compressed.append(self._compressor.compress(b"\x00"))  # every png scanline starts with its filter type
+            compressed.append(self._compressor.compress(row))
+        data = b"".join(compressed)
+        if data:
+            self._chunk(b"IDAT", data)
+
+    def close(self):
+        self._chunk(b"IDAT", self._compressor.flush())
+        self._chunk(b"IEND", b"")
+
+
+class BmpStreamWriter:
+    """
+    Minimal streaming BMP encoder (24 bit), rows are written as they come in. bmp stores the bottom row first, so
+    every band of rows is written reversed at its place from the end of the file.
+    """
+    row_format = QtGui.QImage.Format_BGR888
+
+    def __init__(self, file: typing.BinaryIO, width: int, height: int, dpi: int = 96):
+        self._file = file
+        self._height = height
+        self._row = 0
+        self._padding = b"\x00" * (-width * 3 % 4)  # bmp rows are padded to 4 bytes
+        self._row_size = width * 3 + len(self._padding)
+        image_size = self._row_size * height
+        dots_per_meter = int(round(dpi / 0.0254))
+        file.write(struct.pack("<2sIHHI", b"BM", 54 + image_size, 0, 0, 54))
+        file.write(struct.pack("<IiiHHIIiiII", 40, width, height, 1, 24, 0, image_size, dots_per_meter,
+                               dots_per_meter, 0, 0))
+
+    @traced("bmp_write_rows")
+    def write_rows(self, rows: typing.Sequence[bytes]):
+        self._row += len(rows)
+        self._file.seek(54 + (self._height - self._row) * self._row_size)
+        self._file.write(b"".join(bytes(row) + self._padding for row in reversed(rows)))
+
+    def close(self):
+        pass
+
+
+class StitchedImageWriter:
+    """
+    Collects the rows of formats without a streaming encoder (jpg, ...) in one image and writes it with
+    QImageWriter on close, `check_size` limits it to `MAX_STITCHED_PIXELS`.
+    """
+    row_format = QtGui.QImage.Format_RGB888
+
+    def __init__(self, file_name: str, width: int, height: int, dpi: int = 96):
+        self._file_name = file_name
+        self._image = QtGui.QImage(width, height, QtGui.QImage.Format_RGB888)
+        if self._image.isNull():
+            raise ExportError(f"Not enough memory for a {width}x{height} image")
+        dots_per_meter = int(round(dpi / 0.0254))
+        self._image.setDotsPerMeterX(dots_per_meter)
+        self._image.setDotsPerMeterY(dots_per_meter)
+        bits = self._image.bits()
+        bits.setsize(self._image.sizeInBytes())
+        self._data = memoryview(bits)
+        self._stride = self._image.bytesPerLine()
+        self._row = 0
+
+    def write_rows(self, rows: typing.Iterable[bytes]):
+        for row in rows:
+            start = self._row * self._stride
+            self._data[start:start + len(row)] = row
+            self._row += 1
+
+    def close(self):
+        self._data.release()
+        writer = QtGui.QImageWriter(self._file_name)
+        if not writer.write(self._image):
+            raise OSError(writer.errorString())
+
+
+def check_size(file_name: str, width: int, height: int):
+    """
+    :raises ExportError: when an image of that size can not be written to the format of `file_name` with bounded
+        memory
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension not in STREAMED_FORMATS and width * height > MAX_STITCHED_PIXELS:
+        raise ExportError(f"{extension.lstrip('.').upper() or 'This format'} exports are limited to "
+                          f"{MAX_STITCHED_PIXELS // (1024 * 1024)} megapixels, use PNG or BMP for "
+                          f"{width}x{height} px")
+    if extension == ".bmp" and 54 + (width * 3 + -width * 3 % 4) * height > 0xffffffff:
+        raise ExportError("BMP files are limited to 4 GB, use PNG for larger images")
+
+
+@contextlib.contextmanager
+def _row_writer(file_name: str, width: int, height: int, dpi: int):
+    """
+    writer of the file format (by extension), fed with `row_format` rows top to bottom, closed on success. the
+    file is removed when the export fails or is cancelled
+    :raises ExportError: when `check_size` refuses the output size
+    """
+    check_size(file_name, width, height)  # before the file is touched
+    extension = os.path.splitext(file_name)[1].lower()
+    file = open(file_name, "wb") if extension in STREAMED_FORMATS else None
+    written = file is not None  # stitched formats only write on close
+    try:
+        if extension == ".png":
+            writer = PngStreamWriter(file, width, height, dpi)
+        elif extension == ".bmp":
+            writer = BmpStreamWriter(file, width, height, dpi)
+        else:
+            writer = StitchedImageWriter(file_name, width, height, dpi)
+        yield writer
+        written = True
+        writer.close()
+    except BaseException:
+        if file is not None:
+            file.close()
+        if written and os.path.exists(file_name):
+            os.remove(file_name)
+        raise
+    finally:
+        if file is not None:
+            file.close()
+
+
+def _image_rows(image: QtGui.QImage, bytes_per_row: int) -> typing.List[memoryview]:
+    data = memoryview(image.constBits().asstring(image.sizeInBytes()))
+    stride = image.bytesPerLine()
+    return [data[y * stride:y * stride + bytes_per_row] for y in range(image.height())]
+
+
+def export_scene_image(scene: Scene, file_name: str, options: ExportOptions,
+                       progress: typing.Callable[[int, int], None] = None,
+                       is_cancelled: typing.Callable[[], bool] = None) -> bool:
+    """
+    render the scene tile by tile into an image file
+
+    The file is written band by band as the rows of tiles are rendered (PNG and BMP are encoded while the next band
+    renders), other formats are stitched into one image and handed to QImageWriter, which `check_size` limits.
+    :param progress: called with (tiles done, tiles total)
+    :param is_cancelled: polled between tiles, the export stops (and the file is removed) once it returns True
+    :return: True on success, False when cancelled
+    :raises ExportError: when the output is too large for its format
+    """
+    renderer = TiledSceneRenderer(scene, options)
+    total = renderer.tile_count()
+    done = 0
+
+    def tile_finished():
+        nonlocal done
+        done += 1
+        if is_cancelled and is_cancelled():
+            raise ExportCancelled()
+        if progress:
+            progress(done, total)
+
+    try:
+        with _row_writer(file_name, options.width, options.height, options.dpi) as writer, \
+                ThreadPoolExecutor(max_workers=1) as encoder:
+            pending = None
+            for row in renderer.tile_rows():
+                tiles = []
+                for target in row:
+                    tiles.append(_image_rows(renderer.render_tile(target, writer.row_format), target.width() * 3))
+                    tile_finished()
+                band = [b"".join(parts) for parts in zip(*tiles)]
+                if pending:
+                    pending.result()  # at most one band waits in the encoder
+                pending = encoder.submit(writer.write_rows, band)
+            if pending:
+                pending.result()
+        return True
+    except ExportCancelled:
+        return False
+
+
+# ------ proxy editing ------
+def _original_band_rows(source: str, size: QtCore.QSize, band_memory: int) -> int:
+    """
+    :return: rows per band, all rows when the format can not decode parts of the image
+    """
+    band_rows = max(1, band_memory // max(1, 4 * size.width()))
+    reader = QtGui.QImageReader(source)
+    if (band_rows < size.height() and reader.supportsOption(QtGui.QImageIOHandler.ClipRect)
+            and reader.transformation() == QtGui.QImageIOHandler.TransformationNone):
+        return band_rows
+    return size.height()
+
+
+def _original_bands(source: str, size: QtCore.QSize,
+                    band_rows: int) -> typing.Iterator[typing.Tuple[int, QtGui.QImage]]:
+    """
+    decode the original in bands of full rows
+    :return: (top row, band) pairs
+    """
+    width, height = size.width(), size.height()
+    for top in range(0, height, band_rows):
+        reader = QtGui.QImageReader(source)  # a reader decodes only once
+        reader.setAutoTransform(True)
+        if band_rows < height:
+            reader.setClipRect(QtCore.QRect(0, top, width, min(band_rows, height - top)))
+        with tracer.span("decode_original_band", top=top):
+            band = reader.read()
+        if band.isNull():
+            raise image_loader.ImageLoadError(f"could not decode {source}: {reader.errorString()}")
+        yield top, band.convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+
+
+def export_onto_original(scene: Scene, base, file_name: str,
+                         progress: typing.Callable[[int, int], None] = None,
+                         is_cancelled: typing.Callable[[], bool] = None,
+                         band_memory: int = ORIGINAL_BAND_MEMORY) -> bool:
+    """
+    render the scene onto the full resolution original of a proxy image, in the pixel grid of the original
+
+    The original is decoded band by band, every band gets the scene items drawn over it through the mapping
+    from scene coordinates to original pixels (inverse of the proxy item transform), so memory is bounded by the
+    band size and not by the original. PNG and BMP files are streamed, other formats are stitched into one image,
+    which `check_size` limits.
+    :param scene: the document without the proxy image
+    :param base: `scene_snapshot.ItemRecord` of the proxy image, with source file and full size
+    :return: True on success, False when cancelled
+    :raises ExportError: when the output is too large for its format
+    """
+    size = base.size.toSize()
+    scene_to_item, invertible = base.transform.inverted()
+    if not invertible:
+        return False
+    offset = base.offset or QtCore.QPointF()
+    pixel_from_scene = scene_to_item * QtGui.QTransform.fromTranslate(-offset.x(), -offset.y())
+    band_rows = _original_band_rows(base.source, size, band_memory)
+    total = -(-size.height() // band_rows)
+    try:
+        with contextlib.ExitStack() as stack:
+            writer = pending = None
+            encoder = stack.enter_context(ThreadPoolExecutor(max_workers=1))
+            for done, (top, band) in enumerate(_original_bands(base.source, size, band_rows), 1):
+                if is_cancelled and is_cancelled():
+                    raise ExportCancelled()
+                to_band = pixel_from_scene * QtGui.QTransform.fromTranslate(0, -top)
+                area = to_band.inverted()[0].mapRect(QtCore.QRectF(band.rect()))
+                if scene.items(area, Qt.IntersectsItemBoundingRect):
+                    with tracer.span("render_original_band", top=top):
+                        painter = QtGui.QPainter(band)
+                        painter.setRenderHints(QtGui.QPainter.Antialiasing | QtGui.QPainter.SmoothPixmapTransform)
+                        painter.setTransform(to_band)
+                        scene.render(painter, area, area, Qt.IgnoreAspectRatio)
+                        painter.end()
+                if writer is None:  # the resolution of the original is known once its first band is decoded
+                    dpi = round(band.dotsPerMeterX() * 0.0254) or 96
+                    writer = stack.enter_context(_row_writer(file_name, size.width(), size.height(), dpi))
+                    stack.callback(lambda: pending and pending.result())  # runs before the writer is closed
+                rows = band.convertToFormat(writer.row_format)
+                if pending:
+                    pending.result()  # at most one band waits in the encoder
+                pending = encoder.submit(writer.write_rows, _image_rows(rows, size.width() * 3))
+                if progress:
+                    progress(done, total)
+        return writer is not None
+    except ExportCancelled:
+        return False
+
+
+class SaveWorker(QtCore.QObject):
+    """
+    Renders and encodes a scene snapshot in a worker thread.
+
+    The snapshot is drawn by a `scene_snapshot.SnapshotRenderer` inside the worker (graphics scenes and items may
+    only be used in the GUI thread), so the user can keep editing the live scene while the file is written, the
+    file shows the scene as it was when the snapshot was taken.
+    """
+    progress = QtCore.pyqtSignal(int, int)  # done, total
+    finished = QtCore.pyqtSignal(bool, str, str)  # saved, file name, error message (empty when cancelled)
+
+    def __init__(self, snapshot, file_name: str, options: ExportOptions = None, svg_size: QtCore.QSize = None,
+                 base_record=None):
+        """
+        :param snapshot: `scene_snapshot.SceneSnapshot` of the scene to save
+        :param options: raster export options, ignored for svg files
+        :param svg_size: canvas size written to svg files
+        :param base_record: record of a proxy image in the snapshot, the rest of the scene is rendered onto its
+            original file (proxy editing), options are ignored then
+        """
+        super().__init__()
+        self.snapshot = snapshot
+        self.file_name = file_name
+        self.options = options
+        self.svg_size = svg_size
+        self.base_record = base_record
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled
+
+    @QtCore.pyqtSlot()
+    @traced("save")
+    def run(self):
+        snapshot = self.snapshot
+        if self.base_record is not None:
+            snapshot = snapshot._replace(records=tuple(record for record in snapshot.records
+                                                       if record is not self.base_record))
+        with tracer.span("index_snapshot", items=len(snapshot.records)):
+            scene = scene_snapshot.SnapshotRenderer(snapshot)
+        saved, error = False, ""
+        try:
+            if os.path.splitext(self.file_name)[1].lower() == ".svg":
+                saved = self._save_svg(scene)
+            elif self.base_record is not None:
+                saved = export_onto_original(scene, self.base_record, self.file_name,
+                                             progress=self.progress.emit, is_cancelled=self.is_cancelled)
+            else:
+                saved = export_scene_image(scene, self.file_name, self.options,
+                                           progress=self.progress.emit, is_cancelled=self.is_cancelled)
+        except (OSError, ExportError, image_loader.ImageLoadError) as e:
+            error = str(e) or type(e).__name__
+        finally:  # also for unexpected errors, those propagate after the GUI got told the save is over
+            self.finished.emit(saved, self.file_name, error)
+
+    def _save_svg(self, scene: scene_snapshot.SnapshotRenderer) -> bool:
+        self.progress.emit(0, 1)
+        svg_generator = QtSvg.QSvgGenerator()
+        svg_generator.setFileName(self.file_name)
+        svg_generator.setSize(self.svg_size)
+
+        painter = QtGui.QPainter()
+        if not painter.begin(svg_generator):
+            raise OSError(f"can not write {self.file_name}")
+        scene.render(painter)
+        painter.end()
+        if self._cancelled:  # svg rendering can not be interrupted, drop the result instead
+            os.remove(self.file_name)
+            return False
+        self.progress.emit(1, 1)
+        return True
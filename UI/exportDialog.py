@@ -0,0 +1,58 @@
+from PyQt5 import QtWidgets, QtCore
+
+from UI.export import ExportOptions
+
+
+class ExportDialog(QtWidgets.QDialog):
+    """
+    asks for the output size and dpi of a raster export
+    """
+
+    def __init__(self, source_rect: QtCore.QRectF, parent: QtWidgets.QWidget = None):
+        super().__init__(parent=parent)
+        self.setWindowTitle("Export Image")
+        self._source_rect = source_rect
+        self._aspect_ratio = source_rect.width() / max(1.0, source_rect.height())
+
+        self.spinBox_width = QtWidgets.QSpinBox(self)
+        self.spinBox_height = QtWidgets.QSpinBox(self)
+        for spin_box in (self.spinBox_width, self.spinBox_height):
+            spin_box.setRange(1, 100000)
+            spin_box.setSuffix(" px")
+        self.spinBox_width.setValue(max(1, round(source_rect.width())))
+        self.spinBox_height.setValue(max(1, round(source_rect.height())))
+        self.checkBox_keep_aspect = QtWidgets.QCheckBox("Keep aspect ratio", self)
+        self.checkBox_keep_aspect.setChecked(True)
+        self.spinBox_dpi = QtWidgets.QSpinBox(self)
+        self.spinBox_dpi.setRange(1, 2400)
+        self.spinBox_dpi.setValue(96)
+
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel, self)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        layout = QtWidgets.QFormLayout(self)
+        layout.addRow("Width", self.spinBox_width)
+        layout.addRow("Height", self.spinBox_height)
+        layout.addRow("", self.checkBox_keep_aspect)
+        layout.addRow("DPI", self.spinBox_dpi)
+        layout.addRow(buttons)
+
+        self.spinBox_width.valueChanged[int].connect(self.width_changed)
+        self.spinBox_height.valueChanged[int].connect(self.height_changed)
+
+    def width_changed(self, width: int):
+        if self.checkBox_keep_aspect.isChecked():
+            self.spinBox_height.blockSignals(True)
+            self.spinBox_height.setValue(max(1, round(width / self._aspect_ratio)))
+            self.spinBox_height.blockSignals(False)
+
+    def height_changed(self, height: int):
+        if self.checkBox_keep_aspect.isChecked():
+            self.spinBox_width.blockSignals(True)
+            self.spinBox_width.setValue(max(1, round(height * self._aspect_ratio)))
+            self.spinBox_width.blockSignals(False)
+
+    def options(self) -> ExportOptions:
+        return ExportOptions(self.spinBox_width.value(), self.spinBox_height.value(), self.spinBox_dpi.value(),
+                             source_rect=self._source_rect)
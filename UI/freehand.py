@@ -0,0 +1,104 @@
+"""
+Freehand strokes, reduced to a few vertices and drawn as smooth cubic segments.
+
+Pointer samples are filtered as they arrive: a sample closer than the tolerance to the last kept one is dropped
+(radial distance filter), so a stroke only grows with the distance covered, not with the event rate. When the
+stroke ends the kept points are simplified with Ramer-Douglas-Peucker to the same tolerance and a Catmull-Rom
+spline through the remaining vertices is turned into one `QPainterPath` of cubic segments.
+"""
+import typing
+
+import numpy as np
+from PyQt5 import QtCore, QtGui
+
+from UI import shapes
+
+DEFAULT_TOLERANCE = 1.5  # view pixels
+
+
+def simplify(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Ramer-Douglas-Peucker simplification of an open polyline
+    :param points: (n, 2) array
+    :param tolerance: largest distance of a dropped point from the simplified polyline
+    :return: (m, 2) array of the kept points, first and last point are always kept
+    """
+    count = len(points)
+    if count < 3:
+        return points
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    ranges = [(0, count - 1)]
+    while ranges:
+        first, last = ranges.pop()
+        if last - first < 2:
+            continue
+        start = points[first]
+        chord = points[last] - start
+        offsets = points[first + 1:last] - start
+        length = np.hypot(*chord)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(offsets[:, 0] * chord[1] - offsets[:, 1] * chord[0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            ranges.append((first, split))
+            ranges.append((split, last))
+    return points[keep]
+
+
+class FreehandStroke:
+    """
+    Points of a stroke while it is drawn, `path` is the live polyline through the kept samples and `finish`
+    returns the final smooth path.
+    """
+
+    def __init__(self, start: QtCore.QPointF, tolerance: float):
+        """
+        :param tolerance: in scene units
+        """
+        self.tolerance = tolerance
+        self.sample_count = 1
+        self._points = [(start.x(), start.y())]
+        self._last = self._points[0]
+        self.path = QtGui.QPainterPath(start)
+        self.vertices: typing.Union[None, np.ndarray] = None  # vertices of the finished stroke
+
+    @property
+    def kept_count(self) -> int:
+        return len(self._points)
+
+    @property
+    def vertex_count(self) -> int:
+        return len(self.vertices) if self.vertices is not None else len(self._points)
+
+    def add(self, point: QtCore.QPointF) -> bool:
+        """
+        :return: True when the sample was kept
+        """
+        self.sample_count += 1
+        x, y = point.x(), point.y()
+        last_x, last_y = self._last
+        if (x - last_x) ** 2 + (y - last_y) ** 2 < self.tolerance * self.tolerance:
+            return False
+        self._last = (x, y)
+        self._points.append(self._last)
+        self.path.lineTo(x, y)
+        return True
+
+    def finish(self, end: QtCore.QPointF = None) -> QtGui.QPainterPath:
+        """
+        :param end: last position, kept even when it is within the tolerance
+        :return: smooth path through the simplified stroke
+        """
+        points = self._points
+        if end is not None:
+            self.sample_count += 1
+            if (end.x(), end.y()) != self._last:
+                points = points + [(end.x(), end.y())]
+        self.vertices = simplify(np.array(points, dtype=np.float64), self.tolerance)
+        self.path = shapes.catmull_rom_path(self.vertices)
+        return self.path
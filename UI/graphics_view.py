@@ -1,10 +1,17 @@
 import copy
+import math
+import time
 import typing
 
 from PyQt5 import QtCore, QtWidgets, QtGui
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QGraphicsView, QGraphicsItem
 
+from UI import freehand, grid, input_recorder, perf_hud, snapping, spatial_index
+from UI.tracing import tracer, traced
+
+SPLINE_PRESS, SPLINE_MOVE, SPLINE_RELEASE = range(3)  # kinds of spline tool events
+
 
 class CopyItem(QGraphicsItem):
     def __init__(self, item: QGraphicsItem):
@@ -24,6 +31,33 @@ class CopyItem(QGraphicsItem):
         return self.item.type()
 
 
+class CursorTracker:
+    """
+    Remembers the cursor shape last applied to a widget and only calls `setCursor` when the shape changes.
+    """
+
+    def __init__(self, widget: QtWidgets.QWidget):
+        self._widget = widget
+        self._shape: typing.Union[None, Qt.CursorShape] = None
+        self.set_cursor_calls = 0
+
+    @property
+    def shape(self):
+        return self._shape
+
+    def set_shape(self, shape: Qt.CursorShape) -> bool:
+        """
+        :param shape: wanted cursor shape
+        :return: True if the widget cursor was actually changed
+        """
+        if shape == self._shape:
+            return False
+        self._shape = shape
+        self._widget.setCursor(QtGui.QCursor(shape))
+        self.set_cursor_calls += 1
+        return True
+
+
 class CustomGraphicsView(QGraphicsView):
     mouse_pos_signal = QtCore.pyqtSignal(object)
     draw_line_signal = QtCore.pyqtSignal(object)
@@ -32,18 +66,25 @@ class CustomGraphicsView(QGraphicsView):
     draw_text_signal = QtCore.pyqtSignal(object)
     draw_curve_signal = QtCore.pyqtSignal(object)
     draw_polyline_signal = QtCore.pyqtSignal(object)
+    finish_shape_signal = QtCore.pyqtSignal()  # right click or tool change ends the polyline / spline being drawn
+    spline_signal = QtCore.pyqtSignal(object)  # (SPLINE_PRESS / SPLINE_MOVE / SPLINE_RELEASE, scene position)
+    draw_freehand_signal = QtCore.pyqtSignal(object)  # freehand.FreehandStroke, finished on release
     toggle_temp_drawing = QtCore.pyqtSignal(bool)
-    change_cursor_signal = QtCore.pyqtSignal(object)
     item_pasted_signal = QtCore.pyqtSignal(object)
     draw_selected_item_rect = QtCore.pyqtSignal(object)
     clear_selection_rect = QtCore.pyqtSignal()
     show_status_bar_message_signal = QtCore.pyqtSignal(str)
+    # (item, (old pos, old transform, old transform origin), merge key), after an item got moved or rotated
+    item_placement_changed_signal = QtCore.pyqtSignal(object)
+    # performance overlay (see UI.perf_hud), None while hidden. class level, viewport events arrive during __init__
+    hud: typing.Union[None, perf_hud.PerformanceHud] = None
 
     def __init__(self, parent=None):
         super().__init__(parent=parent)
         self._copied_item_center = None
         self.move_start_pos = None
         self._item_for_move: typing.Union[None, QGraphicsItem] = None
+        self._move_sequence = 0  # one per right button drag, the steps of one drag are merged into one undo step
         self._curve_points = []
         self._copied_item = None
         self._move_start_pos = None
@@ -53,29 +94,121 @@ class CustomGraphicsView(QGraphicsView):
         self.current_item: typing.Union[None, QGraphicsItem] = None
         # self.setDragMode(QGraphicsView.RubberBandDrag)
         self.setMouseTracking(True)
+        self.cursor_tracker = CursorTracker(self.viewport())
+        self.cursor_tracker.set_shape(Qt.CrossCursor)
         self.grid_on = False
-        self.grid_size = 10
+        self.grid_painter = grid.GridPainter(size=10)
         self.is_first_line = True
         self.last_point = 0
         self.control_key = False
+        # picking (right click selection, hover), the main window keeps the document items in it
+        self.selection_index = spatial_index.SelectionIndex()
+        self.pick_radius = 3  # pick tolerance in view pixels
+        self.freehand_tolerance = freehand.DEFAULT_TOLERANCE  # view pixels
+        self._stroke: typing.Union[None, freehand.FreehandStroke] = None
+
+        # ---- mouse move coalescing (latest pointer position is processed once per display frame) ----
+        self.coalesce_mouse_moves = True
+        self._pending_move_pos: typing.Union[None, QtCore.QPoint] = None
+        self.move_events_received = 0
+        self.move_events_dropped = 0
+        self.move_frames_processed = 0
+        self._move_frame_timer = QtCore.QTimer(self)
+        self._move_frame_timer.setSingleShot(True)
+        self._move_frame_timer.setTimerType(Qt.PreciseTimer)
+        self._move_frame_timer.timeout.connect(self.flush_pending_mouse_move)
+
+        # input recording (see UI.input_recorder), None while not recording
+        self.input_recorder: typing.Union[None, input_recorder.InputRecorder] = None
+
+        # performance overlay counters, polled by the overlay while shown
+        self._hud_paint_time = 0.0
+        self.hud_counters: typing.Dict[str, typing.Callable[[], int]] = {
+            "items": lambda: len(self.scene().items()) if self.scene() else 0
+        }
 
         # add keyboard shortcuts
         # right key shortcut
-        QtWidgets.QShortcut(QtGui.QKeySequence(Qt.Key_Right), self, lambda: self.rotate_item(True))
+        QtWidgets.QShortcut(QtGui.QKeySequence(Qt.Key_Right), self,
+                            lambda: self.trigger_shortcut(input_recorder.SHORTCUT_ROTATE_RIGHT))
         # left key shortcut
-        QtWidgets.QShortcut(QtGui.QKeySequence(Qt.Key_Left), self, lambda: self.rotate_item(False))
+        QtWidgets.QShortcut(QtGui.QKeySequence(Qt.Key_Left), self,
+                            lambda: self.trigger_shortcut(input_recorder.SHORTCUT_ROTATE_LEFT))
         # copy key shortcut
-        QtWidgets.QShortcut(QtGui.QKeySequence("Ctrl+C"), self, lambda: self.copy_item_to_clipboard())
+        QtWidgets.QShortcut(QtGui.QKeySequence("Ctrl+C"), self,
+                            lambda: self.trigger_shortcut(input_recorder.SHORTCUT_COPY))
         # paste key shortcut
-        QtWidgets.QShortcut(QtGui.QKeySequence("Ctrl+V"), self, lambda: self.paste_item_from_clipboard())
+        QtWidgets.QShortcut(QtGui.QKeySequence("Ctrl+V"), self,
+                            lambda: self.trigger_shortcut(input_recorder.SHORTCUT_PASTE))
+
+    def trigger_shortcut(self, shortcut_id: int):
+        if self.input_recorder:
+            self.input_recorder.shortcut(shortcut_id)
+        if shortcut_id == input_recorder.SHORTCUT_ROTATE_RIGHT:
+            self.rotate_item(True)
+        elif shortcut_id == input_recorder.SHORTCUT_ROTATE_LEFT:
+            self.rotate_item(False)
+        elif shortcut_id == input_recorder.SHORTCUT_COPY:
+            self.copy_item_to_clipboard()
+        elif shortcut_id == input_recorder.SHORTCUT_PASTE:
+            self.paste_item_from_clipboard()
+
+    def start_input_recording(self):
+        self.input_recorder = input_recorder.InputRecorder()
+
+    def stop_input_recording(self) -> typing.Union[None, input_recorder.InputRecorder]:
+        recorder, self.input_recorder = self.input_recorder, None
+        return recorder
+
+    def set_hud_visible(self, visible: bool):
+        if visible and self.hud is None:
+            self.hud = perf_hud.PerformanceHud(self, self.hud_counters)
+        elif not visible and self.hud is not None:
+            self.hud.deleteLater()
+            self.hud = None
+        self.viewport().update()
 
+    def viewportEvent(self, event: QtCore.QEvent) -> bool:
+        if self.hud is None or event.type() == QtCore.QEvent.Paint:
+            return super().viewportEvent(event)
+        started = time.perf_counter()
+        handled = super().viewportEvent(event)
+        self.hud.record_event(time.perf_counter() - started)
+        return handled
+
+    def paintEvent(self, event: QtGui.QPaintEvent) -> None:
+        if self.hud is None:
+            return super().paintEvent(event)
+        self._hud_paint_time = 0.0
+        started = time.perf_counter()
+        super().paintEvent(event)
+        self.hud.record_paint(started, time.perf_counter(), self._hud_paint_time, event.region().rectCount())
+
+    def drawForeground(self, painter: QtGui.QPainter, rect: QtCore.QRectF) -> None:
+        super().drawForeground(painter, rect)
+        if self.hud is not None:
+            started = time.perf_counter()
+            self.hud.paint(painter)
+            self._hud_paint_time = time.perf_counter() - started
+
+    def scrollContentsBy(self, dx: int, dy: int) -> None:
+        super().scrollContentsBy(dx, dy)
+        if self.hud is not None:  # scrolling moves the pixels of the overlay too
+            self.viewport().update()
+
+    def keyPressEvent(self, event: QtGui.QKeyEvent) -> None:
+        if self.input_recorder:
+            self.input_recorder.key(event)
+        super().keyPressEvent(event)
+
+    @traced("copy_item_to_clipboard")
     def copy_item_to_clipboard(self):
         if self._item_for_move:
             self._copied_item = CopyItem(self._item_for_move)
             self._copied_item_center = self._item_for_move.sceneBoundingRect().center()
-            print(f"{self._copied_item_center=}")
             self.show_status_bar_message_signal.emit("Item copied to clipboard")
 
+    @traced("paste_item_from_clipboard")
     def paste_item_from_clipboard(self):
         if self._copied_item:
             # locate point at center of item
@@ -88,6 +221,7 @@ class CustomGraphicsView(QGraphicsView):
             # print(f"{diff_point=}\n")
             self._copied_item.setPos(pos)
             self._copied_item.setPos(diff_point)  # this only works when copied from original item
+            self.selection_index.insert(self._copied_item)
 
             self.item_pasted_signal.emit(self._copied_item)  # to add new item to drawing list
 
@@ -95,11 +229,13 @@ class CustomGraphicsView(QGraphicsView):
             self._copied_item_center = None
             self.show_status_bar_message_signal.emit("Item pasted from clipboard")
 
+    @traced("rotate_item")
     def rotate_item(self, is_right=True):
         multiplier = -1
         if is_right:
             multiplier = 1
         if self._item_for_move:
+            old_placement = self._placement(self._item_for_move)
             center_prev = self._item_for_move.sceneBoundingRect().center()
 
             self._item_for_move.setTransformOriginPoint(center_prev)
@@ -111,19 +247,74 @@ class CustomGraphicsView(QGraphicsView):
 
             # move to the new center
             self._item_for_move.moveBy(center_prev.x() - center_now.x(), center_prev.y() - center_now.y())
+            self.selection_index.update(self._item_for_move)
+            self.item_placement_changed_signal.emit((self._item_for_move, old_placement, None))
 
-    def is_grid_on(self, is_on):
-        if is_on:
-            self.grid_on = False
-            print(self.grid_on)
-        else:
-            self.grid_on = True
-            print(self.grid_on)
-        return
+    @staticmethod
+    def _placement(item: QGraphicsItem) -> tuple:
+        return item.pos(), item.transform(), item.transformOriginPoint()
+
+    def move_item_for_move(self, dx: float, dy: float):
+        """
+        move the item picked with the right button
+        """
+        if dx == 0 and dy == 0:
+            return
+        old_placement = self._placement(self._item_for_move)
+        self._item_for_move.moveBy(dx, dy)
+        self.selection_index.update(self._item_for_move)
+        self.item_placement_changed_signal.emit((self._item_for_move, old_placement, ("move", self._move_sequence)))
+
+    def cancel_item_move(self):
+        """
+        forget the picked item, e.g. after it got removed from the scene
+        """
+        self._item_for_move = None
+        self._move_start_pos = None
+
+    def item_at(self, scene_pos: QtCore.QPointF) -> typing.Union[None, QGraphicsItem]:
+        """
+        topmost document item within `pick_radius` view pixels of the scene position
+        """
+        return self.selection_index.item_at(scene_pos, self.scene_length(self.pick_radius), self.scene())
+
+    def scene_length(self, pixels: float) -> float:
+        """
+        :return: length in scene units of a distance in view pixels
+        """
+        transform = self.transform()
+        return pixels / (math.hypot(transform.m11(), transform.m12()) or 1.0)
+
+    @property
+    def grid_size(self) -> float:
+        """
+        grid spacing in scene units, drawn and snapped to
+        """
+        return self.grid_painter.size
+
+    def set_grid_visible(self, visible: bool):
+        self.grid_on = visible
+        tracer.instant("grid", on=self.grid_on)
+        self.viewport().update()
+
+    def set_grid_size(self, size: float):
+        self.grid_painter.size = size
+        if self.grid_on:
+            self.viewport().update()
+
+    def drawBackground(self, painter: QtGui.QPainter, rect: QtCore.QRectF) -> None:
+        super().drawBackground(painter, rect)
+        if self.grid_on:
+            self.grid_painter.paint(painter, rect)
 
     def set_current_item(self, item: str):
+        self.finish_shape()
         self.current_item = item
 
+    def finish_shape(self):
+        self.is_first_line = True
+        self.finish_shape_signal.emit()
+
     def cancel_wait_for_mouse_click(self):
         self._wait_for_mouse_click = False
         self._to_enter_text = ""
@@ -132,15 +323,49 @@ class CustomGraphicsView(QGraphicsView):
         self._wait_for_mouse_click = True
         self._to_enter_text = text
 
-    @staticmethod
-    def draw_line_grid_on(pos, grid_size):
-        if (pos % grid_size) < grid_size / 2:
-            counted_pos = (pos // grid_size) * grid_size
-        else:
-            counted_pos = (pos // grid_size) * grid_size + grid_size
-        return counted_pos
+    def _move_delta(self, start_pos: QtCore.QPoint, end_pos: QtCore.QPoint) -> QtCore.QPointF:
+        """
+        scene offset of a right button move between two view positions, in whole grid steps while the grid is on
+        """
+        start, end = self.mapToScene(start_pos), self.mapToScene(end_pos)
+        if self.grid_on:
+            return snapping.snapped_delta(start, end, self.grid_size)
+        return end - start
+
+    def coalescing_stats(self) -> dict:
+        """
+        :return: counters of the mouse move coalescing layer
+        """
+        return {
+            "received": self.move_events_received,
+            "dropped": self.move_events_dropped,
+            "processed": self.move_frames_processed,
+        }
+
+    def reset_coalescing_stats(self):
+        self.move_events_received = 0
+        self.move_events_dropped = 0
+        self.move_frames_processed = 0
+
+    def _frame_interval(self) -> int:
+        refresh_rate = self.screen().refreshRate() or 60.0
+        return max(1, int(1000 / refresh_rate))
+
+    def flush_pending_mouse_move(self):
+        """
+        process the latest queued pointer position right away (if there is one)
+        """
+        self._move_frame_timer.stop()
+        if self._pending_move_pos is not None:
+            view_pos = self._pending_move_pos
+            self._pending_move_pos = None
+            self.move_frames_processed += 1
+            self._process_mouse_move(view_pos)
 
     def mousePressEvent(self, event):
+        if self.input_recorder:
+            self.input_recorder.mouse(input_recorder.MOUSE_PRESS, event)
+        self.flush_pending_mouse_move()  # press must see the state of the last move
         if event.button() == Qt.LeftButton:
             if self._wait_for_mouse_click:
                 self.draw_text_signal.emit((self._to_enter_text, self.mapToScene(event.pos())))
@@ -150,13 +375,19 @@ class CustomGraphicsView(QGraphicsView):
                 self.drag_start_pos = event.pos()
                 if self.current_item == 'curve' and len(self._curve_points) < 3:
                     self._curve_points.append(self.mapToScene(event.pos()))
+                elif self.current_item == "freehand":
+                    self._stroke = freehand.FreehandStroke(self.mapToScene(event.pos()),
+                                                           self.scene_length(self.freehand_tolerance))
+                elif self.current_item == "spline":
+                    self.spline_signal.emit((SPLINE_PRESS, self.mapToScene(event.pos())))
                 self.toggle_temp_drawing.emit(True)
 
         elif event.button() == Qt.RightButton:
             self._move_start_pos = event.pos()
             _point = self.mapToScene(self._move_start_pos)
-            self._item_for_move = self.scene().itemAt(_point, self.transform())
+            self._item_for_move = self.item_at(_point)
             if self._item_for_move:
+                self._move_sequence += 1
                 self._move_start_pos = event.pos()
                 rect_f = self._item_for_move.sceneBoundingRect()
                 self.draw_selected_item_rect.emit((rect_f, self._item_for_move))
@@ -164,6 +395,9 @@ class CustomGraphicsView(QGraphicsView):
                 self._move_start_pos = None
 
     def mouseReleaseEvent(self, event):
+        if self.input_recorder:
+            self.input_recorder.mouse(input_recorder.MOUSE_RELEASE, event)
+        self.flush_pending_mouse_move()  # release uses its own exact position below
         if event.button() == Qt.LeftButton:
             if self.drag_start_pos:
                 drag_end_pos = self.mapToScene(event.pos())
@@ -191,44 +425,46 @@ class CustomGraphicsView(QGraphicsView):
                         drag_start_pos = self.last_point
                         self.draw_polyline_signal.emit((drag_start_pos, drag_end_pos))
                         self.last_point = drag_end_pos
+                elif self.current_item == "freehand" and self._stroke is not None:
+                    self._stroke.finish(drag_end_pos)
+                    self.draw_freehand_signal.emit(self._stroke)
+                    self._stroke = None
+                elif self.current_item == "spline":
+                    self.spline_signal.emit((SPLINE_RELEASE, drag_end_pos))
 
             self.drag_start_pos = None
         elif event.button() == Qt.RightButton:
-            if self.grid_on:
-                if self._item_for_move:
-                    _move_end_pos = event.pos()
-                    start_pos_x = self.draw_line_grid_on(self._move_start_pos.x(), self.grid_size)
-                    start_pos_y = self.draw_line_grid_on(self._move_start_pos.y(), self.grid_size)
-                    end_pos_x = self.draw_line_grid_on(_move_end_pos.x(), self.grid_size)
-                    end_pos_y = self.draw_line_grid_on(_move_end_pos.y(), self.grid_size)
-                    diff = (self.mapToScene(end_pos_x, end_pos_y) - self.mapToScene(start_pos_x, start_pos_y))
-                    dx = diff.x()
-                    dy = diff.y()
-                    self._item_for_move.moveBy(dx, dy)
-                    self._item_for_move = None
-                    self._move_start_pos = None
-                    self.clear_selection_rect.emit()
-                else:
-                    self.clear_selection_rect.emit()
-            else:
-                if self._item_for_move:
-                    _move_end_pos = event.pos()
-                    diff = (self.mapToScene(_move_end_pos) - self.mapToScene(self._move_start_pos))
-                    dx = diff.x()
-                    dy = diff.y()
-                    self._item_for_move.moveBy(dx, dy)
-                    self._item_for_move = None
-                    self._move_start_pos = None
-                    self.clear_selection_rect.emit()
-                else:
-                    self.clear_selection_rect.emit()
-            if not self.is_first_line:
-                self.is_first_line = True
+            if self._item_for_move:
+                diff = self._move_delta(self._move_start_pos, event.pos())
+                self.move_item_for_move(diff.x(), diff.y())
+                self._item_for_move = None
+                self._move_start_pos = None
+            self.clear_selection_rect.emit()
+            self.finish_shape()
         super().mouseReleaseEvent(event)
 
     def mouseMoveEvent(self, event):
+        if self.input_recorder:
+            self.input_recorder.mouse(input_recorder.MOUSE_MOVE, event)
+        self.move_events_received += 1
+        if self._stroke is not None:  # every sample reaches the stroke, only the redraw is coalesced
+            self._stroke.add(self.mapToScene(event.pos()))
+        if self.coalesce_mouse_moves:
+            if self._pending_move_pos is not None:
+                self.move_events_dropped += 1  # superseded before it was processed
+            else:
+                self._move_frame_timer.start(self._frame_interval())
+            self._pending_move_pos = event.pos()
+        else:
+            self.move_frames_processed += 1
+            self._process_mouse_move(event.pos())
+        super().mouseMoveEvent(event)
+
+    @traced("mouse_move")
+    def _process_mouse_move(self, view_pos: QtCore.QPoint):
+        scene_pos = self.mapToScene(view_pos)
         if self.drag_start_pos:
-            temp_drag_end_pos = self.mapToScene(event.pos())
+            temp_drag_end_pos = scene_pos
             temp_drag_start_pos = self.mapToScene(self.drag_start_pos)
             if self.current_item == 'line':
                 self.draw_line_signal.emit((temp_drag_start_pos, temp_drag_end_pos))
@@ -249,31 +485,35 @@ class CustomGraphicsView(QGraphicsView):
                     temp_drag_start_pos = self.last_point
                     self.draw_polyline_signal.emit((temp_drag_start_pos, temp_drag_end_pos))
                     # self.last_point = temp_drag_end_pos
+            elif self.current_item == "freehand" and self._stroke is not None:
+                self.draw_freehand_signal.emit(self._stroke)
+        if self.current_item == "spline":  # the next knot follows the pointer, pressed or not
+            self.spline_signal.emit((SPLINE_MOVE, scene_pos))
 
         if self._item_for_move and self._move_start_pos:
-            _move_end_pos = event.pos()
-            if self.grid_on:
-                start_pos_x = self.draw_line_grid_on(self._move_start_pos.x(), self.grid_size)
-                start_pos_y = self.draw_line_grid_on(self._move_start_pos.y(), self.grid_size)
-                end_pos_x = self.draw_line_grid_on(_move_end_pos.x(), self.grid_size)
-                end_pos_y = self.draw_line_grid_on(_move_end_pos.y(), self.grid_size)
-                diff = (self.mapToScene(end_pos_x, end_pos_y) - self.mapToScene(start_pos_x, start_pos_y))
-                dx = diff.x()
-                dy = diff.y()
-                self._item_for_move.moveBy(dx, dy)
-                self._move_start_pos = _move_end_pos
-                self.clear_selection_rect.emit()
-                self.draw_selected_item_rect.emit((self._item_for_move.sceneBoundingRect(), self._item_for_move))
-            else:
-                diff = (self.mapToScene(_move_end_pos) - self.mapToScene(self._move_start_pos))
-                dx = diff.x()
-                dy = diff.y()
-                self._item_for_move.moveBy(dx, dy)
-                self._move_start_pos = _move_end_pos
-                self.clear_selection_rect.emit()
-                self.draw_selected_item_rect.emit((self._item_for_move.sceneBoundingRect(), self._item_for_move))
-
-        item_under_mouse = self.scene().itemAt(self.mapToScene(event.pos()), self.transform())
-        self.mouse_pos_signal.emit(self.mapToScene(event.pos()).toPoint())
-        self.change_cursor_signal.emit(Qt.PointingHandCursor if item_under_mouse else Qt.CrossCursor)
-        super().mouseMoveEvent(event)
+            diff = self._move_delta(self._move_start_pos, view_pos)
+            self.move_item_for_move(diff.x(), diff.y())
+            self._move_start_pos = view_pos
+            self.clear_selection_rect.emit()
+            self.draw_selected_item_rect.emit((self._item_for_move.sceneBoundingRect(), self._item_for_move))
+
+        if self.hud is None:
+            item_under_mouse = self.item_at(scene_pos)
+        else:
+            started = time.perf_counter()
+            item_under_mouse = self.item_at(scene_pos)
+            self.hud.record_hit_test(time.perf_counter() - started)
+        self.mouse_pos_signal.emit(scene_pos.toPoint())
+        self.update_cursor(Qt.PointingHandCursor if item_under_mouse else Qt.CrossCursor)
+
+    def update_cursor(self, shape: Qt.CursorShape):
+        self.cursor_tracker.set_shape(shape)
+
+    def enterEvent(self, event: QtCore.QEvent) -> None:
+        self.update_cursor(Qt.CrossCursor)
+        super().enterEvent(event)
+
+    def leaveEvent(self, event: QtCore.QEvent) -> None:
+        # hover state is stale once the pointer is gone, start from the default cursor on the next enter
+        self.update_cursor(Qt.CrossCursor)
+        super().leaveEvent(event)
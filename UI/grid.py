@@ -0,0 +1,95 @@
+import math
+import typing
+
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtCore import Qt
+
+MIN_SPACING = 4.0  # px, denser grids only show every 2nd, 4th, ... line (still on the snap positions)
+MAX_CELLS = 64  # cells per tile side at most
+
+
+def _cells_per_tile(spacing: float) -> int:
+    """
+    number of cells per tile whose total width is closest to whole pixels, a tile is a whole number of pixels so
+    the repeated grid drifts by that difference per tile (integer spacings do not drift at all)
+    """
+    best, best_drift = 1, math.inf
+    for cells in range(1, MAX_CELLS + 1):
+        width = cells * spacing
+        drift = abs(width - round(width)) / width  # px of drift per px of viewport
+        if drift < best_drift - 1e-9:
+            best, best_drift = cells, drift
+            if drift == 0:
+                break
+    return best
+
+
+class GridPainter:
+    """
+    Draws a grid of `size` scene units over the exposed background of a view.
+
+    The grid is rasterized once into a small tile pixmap in device pixels, repeated over the exposed rect as a
+    texture brush anchored at the scene origin, so a repaint costs a single texture fill. The tile is rebuilt only
+    when the grid size, the colour or the view scale changes.
+    """
+
+    def __init__(self, size: float = 10.0, color: QtGui.QColor = QtGui.QColor("#999")):
+        self.size = size
+        self.color = QtGui.QColor(color)
+        self._tile: typing.Union[None, QtGui.QPixmap] = None
+        self._tile_key = None
+        self.tiles_built = 0
+
+    def _build_tile(self, spacing_x: float, spacing_y: float) -> QtGui.QPixmap:
+        cells_x, cells_y = _cells_per_tile(spacing_x), _cells_per_tile(spacing_y)
+        width, height = max(1, round(cells_x * spacing_x)), max(1, round(cells_y * spacing_y))
+        tile = QtGui.QPixmap(width, height)
+        tile.fill(Qt.transparent)
+        painter = QtGui.QPainter(tile)
+        painter.setPen(QtGui.QPen(self.color, 0))
+        painter.drawLines([QtCore.QLineF(round(i * spacing_x), 0, round(i * spacing_x), height)
+                           for i in range(cells_x)])
+        painter.drawLines([QtCore.QLineF(0, round(i * spacing_y), width, round(i * spacing_y))
+                           for i in range(cells_y)])
+        painter.end()
+        self.tiles_built += 1
+        return tile
+
+    def tile(self, scale_x: float, scale_y: float) -> typing.Optional[typing.Tuple[QtGui.QPixmap, float, float]]:
+        """
+        :param scale_x: device pixels per scene unit
+        :return: tile, drawn spacing in device pixels along x and y, None when the spacing is degenerate (zero
+            grid size or view scale)
+        """
+        spacing_x, spacing_y = self.size * abs(scale_x), self.size * abs(scale_y)
+        if not (0 < spacing_x < math.inf and 0 < spacing_y < math.inf):
+            return None  # zero never doubles up to MIN_SPACING, infinity has no tile size
+        while spacing_x < MIN_SPACING:
+            spacing_x *= 2
+        while spacing_y < MIN_SPACING:
+            spacing_y *= 2
+        key = (spacing_x, spacing_y, self.color.rgba())
+        if key != self._tile_key:
+            self._tile = self._build_tile(spacing_x, spacing_y)
+            self._tile_key = key
+        return self._tile, spacing_x, spacing_y
+
+    def paint(self, painter: QtGui.QPainter, rect: QtCore.QRectF):
+        """
+        :param painter: painter in scene coordinates (`QGraphicsView.drawBackground`)
+        :param rect: exposed scene rect
+        """
+        transform = painter.worldTransform()
+        if transform.type() > QtGui.QTransform.TxScale:
+            return  # rotated or sheared views get no grid
+        grid_tile = self.tile(transform.m11(), transform.m22())
+        if grid_tile is None:
+            return  # e.g. a view scaled to zero
+        origin = transform.map(QtCore.QPointF(0, 0))  # device position of the scene origin, a grid line
+        brush = QtGui.QBrush(grid_tile[0])
+        brush.setTransform(QtGui.QTransform.fromTranslate(round(origin.x()), round(origin.y())))
+        device_rect = transform.mapRect(rect).toAlignedRect()
+        painter.save()
+        painter.resetTransform()
+        painter.fillRect(device_rect, brush)
+        painter.restore()
@@ -0,0 +1,372 @@
+"""
+Command based undo / redo.
+
+Commands only hold item ids and small value deltas (placements, item records of removed items), never the live
+items of the scene. Items get an id on first use, stored in the item data under `ITEM_ID`, and the history keeps
+the id -> item map of the items currently in the document.
+"""
+import collections
+import itertools
+import typing
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import Qt
+
+from UI import scene_snapshot
+
+ITEM_ID = Qt.UserRole + 1  # Qt.UserRole holds the source file of pixmap items
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+_COMMAND_BYTES = 128  # rough per command / per item overhead used by the memory estimate
+
+
+class Placement(typing.NamedTuple):
+    """
+    where an item sits in the scene
+    """
+    pos: QtCore.QPointF
+    transform: QtGui.QTransform
+    origin: QtCore.QPointF  # transform origin point
+
+    @classmethod
+    def of(cls, item: QtWidgets.QGraphicsItem) -> 'Placement':
+        return cls(item.pos(), item.transform(), item.transformOriginPoint())
+
+    def apply(self, item: QtWidgets.QGraphicsItem):
+        item.setTransformOriginPoint(self.origin)
+        item.setTransform(self.transform)
+        item.setPos(self.pos)
+
+
+def record_bytes(record: scene_snapshot.ItemRecord) -> int:
+    """
+    :return: rough memory footprint of an item record
+    """
+    size = _COMMAND_BYTES
+    geometry = record.geometry
+    if isinstance(geometry, QtGui.QPainterPath):
+        size += geometry.elementCount() * 24
+    elif isinstance(geometry, QtGui.QImage):
+        size += geometry.sizeInBytes()
+    elif isinstance(geometry, str):
+        size += len(geometry) * 2
+    return size
+
+
+class Command:
+    """
+    base of the history commands
+    """
+    label = ""
+
+    def undo(self, history: 'History'):
+        raise NotImplementedError
+
+    def redo(self, history: 'History'):
+        raise NotImplementedError
+
+    def merge(self, other: 'Command') -> bool:
+        """
+        fold a following command into this one
+        :return: True if merged, other is dropped then
+        """
+        return False
+
+    def size(self) -> int:
+        return _COMMAND_BYTES
+
+
+class AddItems(Command):
+    label = "Add"
+
+    def __init__(self, item_ids: typing.Sequence[int]):
+        self.item_ids = tuple(item_ids)
+        self._records: typing.Tuple[scene_snapshot.ItemRecord, ...] = ()  # filled while undone
+
+    def undo(self, history: 'History'):
+        self._records = tuple(history.take_item(item_id) for item_id in self.item_ids)
+
+    def redo(self, history: 'History'):
+        for item_id, record in zip(self.item_ids, self._records):
+            history.restore_item(item_id, record)
+        self._records = ()
+
+    def size(self) -> int:
+        return _COMMAND_BYTES + len(self.item_ids) * 8 + sum(record_bytes(record) for record in self._records)
+
+
+class RemoveItems(Command):
+    label = "Delete"
+
+    def __init__(self, item_ids: typing.Sequence[int], records: typing.Sequence[scene_snapshot.ItemRecord]):
+        self.item_ids = tuple(item_ids)
+        self._records = tuple(records)  # empty while undone (items are back in the scene)
+
+    def undo(self, history: 'History'):
+        for item_id, record in zip(self.item_ids, self._records):
+            history.restore_item(item_id, record)
+        self._records = ()
+
+    def redo(self, history: 'History'):
+        self._records = tuple(history.take_item(item_id) for item_id in self.item_ids)
+
+    def size(self) -> int:
+        return _COMMAND_BYTES + len(self.item_ids) * 8 + sum(record_bytes(record) for record in self._records)
+
+
+class TransformItem(Command):
+    label = "Transform"
+
+    def __init__(self, item_id: int, old: Placement, new: Placement, merge_key: typing.Hashable = None):
+        """
+        :param merge_key: consecutive commands of the same item with the same (not None) key are merged,
+            e.g. every step of one drag
+        """
+        self.item_id = item_id
+        self.old = old
+        self.new = new
+        self.merge_key = merge_key
+
+    def undo(self, history: 'History'):
+        self.old.apply(history.item(self.item_id))
+        history.item_changed(self.item_id)
+
+    def redo(self, history: 'History'):
+        self.new.apply(history.item(self.item_id))
+        history.item_changed(self.item_id)
+
+    def merge(self, other: Command) -> bool:
+        if (isinstance(other, TransformItem) and self.merge_key is not None and other.merge_key == self.merge_key
+                and other.item_id == self.item_id):
+            self.new = other.new
+            return True
+        return False
+
+
+class ReshapeItem(Command):
+    """
+    geometry change of an item (e.g. a moved spline knot), undo and redo rebuild the item from the record of the
+    other state under the same id, in the same place of the stacking order
+    """
+    label = "Edit"
+
+    def __init__(self, item_id: int, old: scene_snapshot.ItemRecord, new: scene_snapshot.ItemRecord):
+        self.item_id = item_id
+        self.old = old
+        self.new = new
+
+    def undo(self, history: 'History'):
+        history.replace_item(self.item_id, self.old)
+
+    def redo(self, history: 'History'):
+        history.replace_item(self.item_id, self.new)
+
+    def size(self) -> int:
+        return _COMMAND_BYTES + record_bytes(self.old) + record_bytes(self.new)
+
+
+class History(QtCore.QObject):
+    """
+    Undo / redo stacks with a memory budget, the oldest steps are dropped once the estimated size of the
+    stacks exceeds max_bytes. Undo and redo cost the same no matter how long the history is.
+
+    Every change of the document, done, undone or redone, is also announced item by item (e.g. for the edit
+    journal): items_added [(item id, item)], items_removed [item id], item_placed (item id, item) and
+    item_replaced (item id, item) for a new geometry of an item that keeps its place in the stacking order.
+    """
+    changed = QtCore.pyqtSignal()
+    items_added = QtCore.pyqtSignal(object)
+    items_removed = QtCore.pyqtSignal(object)
+    item_placed = QtCore.pyqtSignal(object)
+    item_replaced = QtCore.pyqtSignal(object)
+
+    def __init__(self, scene: QtWidgets.QGraphicsScene, selection_index=None, max_bytes: int = DEFAULT_MAX_BYTES,
+                 parent: QtCore.QObject = None):
+        """
+        :param selection_index: `spatial_index.SelectionIndex` kept in sync with the items the history adds,
+            removes and moves
+        """
+        super().__init__(parent)
+        self.scene = scene
+        self.selection_index = selection_index
+        self.max_bytes = max_bytes
+        self.items: typing.Dict[int, QtWidgets.QGraphicsItem] = {}  # document items by id, in insertion order
+        self._undo: typing.Deque[typing.Tuple[Command, int]] = collections.deque()  # (command, estimated size)
+        self._redo: typing.Deque[typing.Tuple[Command, int]] = collections.deque()
+        self._bytes = 0
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self._undo)
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._bytes
+
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    # ------ items ------
+    def item_id(self, item: QtWidgets.QGraphicsItem) -> int:
+        """
+        id of a document item, items without one get registered
+        """
+        item_id = item.data(ITEM_ID)
+        if item_id is None:
+            item_id = next(self._ids)
+            item.setData(ITEM_ID, item_id)
+        self.items[item_id] = item
+        return item_id
+
+    def item(self, item_id: int) -> QtWidgets.QGraphicsItem:
+        return self.items[item_id]
+
+    def item_changed(self, item_id: int):
+        item = self.items[item_id]
+        if self.selection_index is not None:
+            self.selection_index.update(item)
+        self.item_placed.emit((item_id, item))
+
+    def take_item(self, item_id: int) -> scene_snapshot.ItemRecord:
+        """
+        remove an item from the document
+        :return: record to restore the item from
+        """
+        item = self.items.pop(item_id)
+        record = scene_snapshot.snapshot_item(item)
+        if self.selection_index is not None:
+            self.selection_index.remove(item)
+        if item.scene() is not None:
+            item.scene().removeItem(item)
+        self.items_removed.emit([item_id])
+        return record
+
+    def restore_item(self, item_id: int, record: scene_snapshot.ItemRecord) -> QtWidgets.QGraphicsItem:
+        item = scene_snapshot.build_item(record)
+        item.setData(ITEM_ID, item_id)
+        self.scene.addItem(item)
+        self.items[item_id] = item
+        if self.selection_index is not None:
+            self.selection_index.insert(item)
+        self.items_added.emit([(item_id, item)])
+        return item
+
+    def replace_item(self, item_id: int, record: scene_snapshot.ItemRecord) -> QtWidgets.QGraphicsItem:
+        """
+        rebuild an item of the document from a record, stacked where the item it replaces was
+        """
+        old = self.items[item_id]
+        item = scene_snapshot.build_item(record)
+        item.setData(ITEM_ID, item_id)
+        self.scene.addItem(item)
+        if old.scene() is not None:
+            item.stackBefore(old)
+            old.scene().removeItem(old)
+        self.items[item_id] = item  # an existing key keeps its place in the insertion order
+        if self.selection_index is not None:
+            self.selection_index.replace(old, item)
+        self.item_replaced.emit((item_id, item))
+        return item
+
+    def load_items(self, item_ids: typing.Sequence[int], items: typing.Sequence[QtWidgets.QGraphicsItem]):
+        """
+        take over the items of an opened document with their saved ids, no undo step is recorded
+        """
+        for item_id, item in zip(item_ids, items):
+            item.setData(ITEM_ID, item_id)
+            self.items[item_id] = item
+        self._ids = itertools.count(max(self.items, default=0) + 1)
+
+    # ------ recording ------
+    def push(self, command: Command):
+        """
+        record a command that has already been carried out
+        """
+        self._drop_redo()
+        if self._undo and self._undo[-1][0].merge(command):
+            self.changed.emit()
+            return
+        self._push_undo(command)
+        self.changed.emit()
+
+    def add_items(self, items: typing.Iterable[QtWidgets.QGraphicsItem]):
+        """
+        record items that were just added to the scene as one step
+        """
+        items = list(items)
+        item_ids = [self.item_id(item) for item in items]
+        if item_ids:
+            self.push(AddItems(item_ids))
+            self.items_added.emit(list(zip(item_ids, items)))
+
+    def remove_items(self, items: typing.Iterable[QtWidgets.QGraphicsItem]):
+        """
+        remove items from the scene as one undoable step
+        """
+        item_ids = [self.item_id(item) for item in items]
+        if item_ids:
+            records = [self.take_item(item_id) for item_id in item_ids]
+            self.push(RemoveItems(item_ids, records))
+
+    def item_placement_changed(self, item: QtWidgets.QGraphicsItem, old: Placement, merge_key=None):
+        item_id = self.item_id(item)
+        self.push(TransformItem(item_id, old, Placement.of(item), merge_key))
+        self.item_placed.emit((item_id, item))
+
+    def item_reshaped(self, item: QtWidgets.QGraphicsItem, old: scene_snapshot.ItemRecord):
+        """
+        record a geometry change of an item that was edited in place
+        :param old: record of the item before the change
+        """
+        item_id = self.item_id(item)
+        if self.selection_index is not None:
+            self.selection_index.update(item)
+        self.push(ReshapeItem(item_id, old, scene_snapshot.snapshot_item(item)))
+        self.item_replaced.emit((item_id, item))
+
+    def _push_undo(self, command: Command):
+        size = command.size()
+        self._undo.append((command, size))
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._undo) > 1:
+            _, dropped = self._undo.popleft()  # oldest first
+            self._bytes -= dropped
+
+    def _drop_redo(self):
+        while self._redo:
+            _, size = self._redo.pop()
+            self._bytes -= size
+
+    # ------ undo / redo ------
+    def undo(self) -> typing.Union[None, Command]:
+        if not self._undo:
+            return None
+        command, size = self._undo.pop()
+        self._bytes -= size
+        command.undo(self)
+        size = command.size()  # undone commands may hold records now
+        self._redo.append((command, size))
+        self._bytes += size
+        self.changed.emit()
+        return command
+
+    def redo(self) -> typing.Union[None, Command]:
+        if not self._redo:
+            return None
+        command, size = self._redo.pop()
+        self._bytes -= size
+        command.redo(self)
+        self._push_undo(command)
+        self.changed.emit()
+        return command
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self._bytes = 0
+        self.items.clear()
+        self._ids = itertools.count(1)
+        self.changed.emit()
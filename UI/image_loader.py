@@ -0,0 +1,205 @@
+"""
+Image loading off the GUI thread.
+
+Images are decoded with `QImageReader` on the global thread pool, several files in parallel. An image larger than
+the preview size is decoded scaled down right away (the jpeg reader scales while decoding, so neither the time
+nor the memory of the full image is spent) and shown by an `ImagePixmapItem` at its full size. The full
+resolution is decoded only once the item is painted larger than its preview, e.g. after zooming in, and for
+exports (`scene_snapshot.SnapshotRenderer`).
+
+In proxy editing mode (`set_proxy_editing`) previews are never replaced on screen, they stay screen sized
+proxies of their source files, and raster exports composite the document onto the original file instead
+(`export.export_onto_original`).
+"""
+import typing
+
+from PyQt5 import QtCore, QtGui, QtWidgets, sip
+from PyQt5.QtCore import Qt
+
+from UI.tracing import tracer
+
+
+class ImageLoadError(Exception):
+    pass
+
+
+_proxy_editing = False
+
+
+def set_proxy_editing(enabled: bool):
+    global _proxy_editing
+    _proxy_editing = enabled
+
+
+def proxy_editing() -> bool:
+    return _proxy_editing
+
+
+class DecodedImage(typing.NamedTuple):
+    file_name: str
+    image: QtGui.QImage
+    full_size: QtCore.QSize  # size of the image in the file, image may be smaller
+
+    @property
+    def is_preview(self) -> bool:
+        return self.image.size() != self.full_size
+
+
+def decode_image(file_name: str, max_size: QtCore.QSize = None) -> DecodedImage:
+    """
+    decode an image file, safe to call from any thread
+    :param max_size: images that do not fit are decoded scaled down to fit (keeping the aspect ratio)
+    :raises ImageLoadError: when the file can not be decoded
+    """
+    return _read(QtGui.QImageReader(file_name), file_name, max_size)
+
+
+def decode_image_data(data: bytes, max_size: QtCore.QSize = None, file_name: str = "") -> DecodedImage:
+    """
+    same as `decode_image`, from the bytes of an image file
+    """
+    buffer = QtCore.QBuffer()
+    buffer.setData(data)
+    buffer.open(QtCore.QIODevice.ReadOnly)
+    return _read(QtGui.QImageReader(buffer), file_name, max_size)
+
+
+def _read(reader: QtGui.QImageReader, file_name: str, max_size: typing.Optional[QtCore.QSize]) -> DecodedImage:
+    reader.setAutoTransform(True)
+    full_size = reader.size()
+    if reader.transformation() & QtGui.QImageIOHandler.TransformationRotate90:
+        full_size.transpose()  # size() is the stored size, exif rotation is applied while reading
+    scaled = max_size is not None and full_size.isValid() and (full_size.width() > max_size.width() or
+                                                               full_size.height() > max_size.height())
+    if scaled:
+        target = full_size.scaled(max_size, Qt.KeepAspectRatio)
+        if reader.transformation() & QtGui.QImageIOHandler.TransformationRotate90:
+            target.transpose()
+        reader.setScaledSize(target)
+    with tracer.span("image_decode", file=file_name, scaled=scaled):
+        image = reader.read()
+    if image.isNull():
+        raise ImageLoadError(reader.errorString())
+    return DecodedImage(file_name, image, full_size if full_size.isValid() else image.size())
+
+
+class _Signals(QtCore.QObject):
+    decoded = QtCore.pyqtSignal(object)  # (request, DecodedImage)
+    failed = QtCore.pyqtSignal(object)  # (request, file name, error message)
+
+
+class _DecodeTask(QtCore.QRunnable):
+    def __init__(self, request, file_name: str, max_size: typing.Optional[QtCore.QSize], signals: _Signals):
+        super().__init__()
+        self.request = request
+        self.file_name = file_name
+        self.max_size = max_size
+        self.signals = signals
+
+    def run(self):
+        try:
+            decoded = decode_image(self.file_name, self.max_size)
+        except ImageLoadError as e:
+            self.signals.failed.emit((self.request, self.file_name, str(e)))
+            return
+        self.signals.decoded.emit((self.request, decoded))
+
+
+class ImagePixmapItem(QtWidgets.QGraphicsPixmapItem):
+    """
+    Pixmap item that always covers the full size of its source image in item coordinates, while its pixmap may
+    be a smaller preview. The full resolution is requested from the `ImageLoader` the first time the item gets
+    painted at a scale the preview can not serve.
+    """
+
+    def __init__(self, pixmap: QtGui.QPixmap, size: QtCore.QSizeF, source: str = None):
+        super().__init__(pixmap)
+        self._size = QtCore.QSizeF(size)
+        self._full_requested = False
+        self.setData(Qt.UserRole, source)
+        self.setTransformationMode(Qt.SmoothTransformation)
+
+    @property
+    def display_size(self) -> QtCore.QSizeF:
+        return QtCore.QSizeF(self._size)
+
+    def is_preview(self) -> bool:
+        return self.pixmap().width() < self._size.width()
+
+    def set_full_image(self, image: QtGui.QImage):
+        self.setPixmap(QtGui.QPixmap.fromImage(image))
+
+    def boundingRect(self) -> QtCore.QRectF:
+        return QtCore.QRectF(self.offset(), self._size)
+
+    def shape(self) -> QtGui.QPainterPath:
+        path = QtGui.QPainterPath()
+        path.addRect(self.boundingRect())
+        return path
+
+    def contains(self, point: QtCore.QPointF) -> bool:
+        return self.boundingRect().contains(point)
+
+    def paint(self, painter: QtGui.QPainter, option: 'QtWidgets.QStyleOptionGraphicsItem',
+              widget: typing.Optional[QtWidgets.QWidget] = ...) -> None:
+        pixmap = self.pixmap()
+        if not self._full_requested and not _proxy_editing and self.is_preview():
+            level_of_detail = option.levelOfDetailFromTransform(painter.worldTransform())
+            if self._size.width() * level_of_detail > pixmap.width() and self.data(Qt.UserRole):
+                self._full_requested = True
+                shared_loader().load_full(self)
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, True)
+        painter.drawPixmap(self.boundingRect(), pixmap, QtCore.QRectF(pixmap.rect()))
+
+
+class ImageLoader(QtCore.QObject):
+    """
+    Decodes images on the global thread pool and reports them back on the GUI thread.
+    """
+    image_loaded = QtCore.pyqtSignal(object)  # DecodedImage, preview or full size
+    load_failed = QtCore.pyqtSignal(object)  # (file name, error message)
+
+    def __init__(self, parent: QtCore.QObject = None):
+        super().__init__(parent)
+        self._pool = QtCore.QThreadPool.globalInstance()
+        self._signals = _Signals(self)
+        self._signals.decoded.connect(self._decoded)
+        self._signals.failed.connect(self._failed)
+
+    def load(self, file_name: str, preview_size: QtCore.QSize = None):
+        """
+        decode an image in the background, `image_loaded` is emitted when done
+        :param preview_size: larger images are decoded scaled down to fit
+        """
+        self._pool.start(_DecodeTask(None, file_name, preview_size, self._signals))
+
+    def load_full(self, item: ImagePixmapItem):
+        """
+        decode the full resolution of a preview item in the background and swap it in
+        """
+        self._pool.start(_DecodeTask(item, item.data(Qt.UserRole), None, self._signals))
+
+    def _decoded(self, args: typing.Tuple[typing.Optional[ImagePixmapItem], DecodedImage]):
+        item, decoded = args
+        if item is None:
+            self.image_loaded.emit(decoded)
+        elif not sip.isdeleted(item):  # the item may have been deleted (undo, new document) while decoding
+            with tracer.span("image_full_resolution", file=decoded.file_name):
+                item.set_full_image(decoded.image)
+
+    def _failed(self, args: typing.Tuple[typing.Optional[ImagePixmapItem], str, str]):
+        item, file_name, error = args
+        if item is None:
+            self.load_failed.emit((file_name, error))
+        # a missing full resolution keeps the preview
+
+
+_shared_loader: typing.Optional[ImageLoader] = None
+
+
+def shared_loader() -> ImageLoader:
+    global _shared_loader
+    if _shared_loader is None:
+        _shared_loader = ImageLoader()
+    return _shared_loader
+
@@ -0,0 +1,155 @@
+import statistics
+import struct
+import time
+import typing
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import Qt
+
+MAGIC = b"IEIR"
+VERSION = 1
+_HEADER = struct.Struct("<4sH")
+# timestamp (s since start), kind, button (or key modifiers >> 24), extra (buttons | modifiers, key code or
+# shortcut id), x, y
+_RECORD = struct.Struct("<dBBIff")
+
+MOUSE_PRESS = 1
+MOUSE_MOVE = 2
+MOUSE_RELEASE = 3
+KEY_PRESS = 4
+SHORTCUT = 5
+
+KIND_NAMES = {MOUSE_PRESS: "mouse_press", MOUSE_MOVE: "mouse_move", MOUSE_RELEASE: "mouse_release",
+              KEY_PRESS: "key_press", SHORTCUT: "shortcut"}
+
+SHORTCUT_ROTATE_RIGHT = 1
+SHORTCUT_ROTATE_LEFT = 2
+SHORTCUT_COPY = 3
+SHORTCUT_PASTE = 4
+
+
+class InputRecord(typing.NamedTuple):
+    timestamp: float
+    kind: int
+    button: int
+    extra: int
+    x: float
+    y: float
+
+
+class InputRecorder:
+    """
+    Records the input of a `CustomGraphicsView` as a compact stream of fixed size binary records.
+    """
+
+    def __init__(self):
+        self.records: typing.List[InputRecord] = []
+        self._started = time.perf_counter()
+
+    def _add(self, kind: int, button: int = 0, extra: int = 0, x: float = 0.0, y: float = 0.0):
+        self.records.append(InputRecord(time.perf_counter() - self._started, kind, button, extra, x, y))
+
+    def mouse(self, kind: int, event: QtGui.QMouseEvent):
+        pos = event.localPos()
+        self._add(kind, int(event.button()), int(event.buttons()) | int(event.modifiers()), pos.x(), pos.y())
+
+    def key(self, event: QtGui.QKeyEvent):
+        self._add(KEY_PRESS, int(event.modifiers()) >> 24, event.key())  # modifier flags all live in the top byte
+
+    def shortcut(self, shortcut_id: int):
+        self._add(SHORTCUT, 0, shortcut_id)
+
+    def save(self, file_name: str):
+        with open(file_name, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION))
+            for record in self.records:
+                f.write(_RECORD.pack(*record))
+
+
+def load_records(file_name: str) -> typing.List[InputRecord]:
+    with open(file_name, "rb") as f:
+        data = f.read()
+    magic, version = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{file_name} is not an input recording")
+    return [InputRecord(*values) for values in _RECORD.iter_unpack(data[_HEADER.size:])]
+
+
+class ReplayStats:
+    def __init__(self):
+        self.handling: typing.Dict[int, typing.List[float]] = {}  # event kind -> durations (s)
+        self.frames: typing.List[float] = []  # render durations (s)
+
+    def add_handling(self, kind: int, duration: float):
+        self.handling.setdefault(kind, []).append(duration)
+
+    @staticmethod
+    def _summary(samples: typing.List[float]) -> dict:
+        if not samples:
+            return {"count": 0}
+        ordered = sorted(samples)
+        return {
+            "count": len(ordered),
+            "p50_ms": ordered[len(ordered) // 2] * 1000,
+            "p99_ms": ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))] * 1000,
+            "max_ms": ordered[-1] * 1000,
+            "mean_ms": statistics.fmean(ordered) * 1000,
+        }
+
+    def summary(self) -> dict:
+        result = {KIND_NAMES[kind]: self._summary(samples) for kind, samples in sorted(self.handling.items())}
+        result["frame"] = self._summary(self.frames)
+        return result
+
+
+class InputReplayer:
+    """
+    Feeds a recorded input stream through the real event handlers of a `CustomGraphicsView` and measures
+    the handling time of every event and the render time of every frame.
+    """
+
+    def __init__(self, view):
+        self.view = view
+
+    def _dispatch(self, record: InputRecord):
+        view = self.view
+        if record.kind in (MOUSE_PRESS, MOUSE_MOVE, MOUSE_RELEASE):
+            event_type, handler = {
+                MOUSE_PRESS: (QtCore.QEvent.MouseButtonPress, view.mousePressEvent),
+                MOUSE_MOVE: (QtCore.QEvent.MouseMove, view.mouseMoveEvent),
+                MOUSE_RELEASE: (QtCore.QEvent.MouseButtonRelease, view.mouseReleaseEvent),
+            }[record.kind]
+            buttons = Qt.MouseButtons(record.extra & ~int(Qt.KeyboardModifierMask) & 0xffffffff)
+            modifiers = Qt.KeyboardModifiers(record.extra & int(Qt.KeyboardModifierMask))
+            event = QtGui.QMouseEvent(event_type, QtCore.QPointF(record.x, record.y), Qt.MouseButton(record.button),
+                                      buttons, modifiers)
+            handler(event)
+        elif record.kind == KEY_PRESS:
+            modifiers = Qt.KeyboardModifiers(record.button << 24)
+            view.keyPressEvent(QtGui.QKeyEvent(QtCore.QEvent.KeyPress, record.extra, modifiers))
+        elif record.kind == SHORTCUT:
+            view.trigger_shortcut(record.extra)
+
+    def replay(self, records: typing.Iterable[InputRecord], realtime: bool = False, render: bool = True) -> ReplayStats:
+        """
+        :param realtime: keep the recorded timing (events in between are processed normally, so move coalescing
+            behaves like in the recorded session), otherwise replay at full speed
+        :param render: repaint the canvas synchronously after every event and measure it
+        """
+        stats = ReplayStats()
+        app = QtWidgets.QApplication.instance()
+        started = time.perf_counter()
+        for record in records:
+            if realtime:
+                while time.perf_counter() - started < record.timestamp:
+                    app.processEvents(QtCore.QEventLoop.AllEvents, 1)
+            event_started = time.perf_counter()
+            self._dispatch(record)
+            if not realtime:
+                self.view.flush_pending_mouse_move()  # full speed: the coalesced work belongs to this event
+            stats.add_handling(record.kind, time.perf_counter() - event_started)
+            if render:
+                frame_started = time.perf_counter()
+                self.view.viewport().repaint()
+                stats.frames.append(time.perf_counter() - frame_started)
+        return stats
@@ -0,0 +1,412 @@
+"""
+Append-only edit journal, kept next to a project file (`<project>.journal`).
+
+Every change of the document (items added, removed, placed or reshaped) is appended as a small record, so saving
+costs as much as the edits since the last save, not as much as the document. Records are encoded and written by a
+background thread. Once the journal has grown past `COMPACT_BYTES` it is folded into a full project snapshot and
+started over. Opening a project replays the journal on top of the snapshot, which also recovers the edits of a
+session that crashed.
+
+    header  magic "IEJNL\\0", u16 version, u64 generation (journal id of the snapshot the journal continues)
+    record  u32 payload length, u32 crc32 of op + payload, u8 op, payload
+
+    ADD     project file bytes of the added items, with their item ids (`project_format.dumps_project`), images
+            loaded from a file only reference it, they get embedded when the journal is compacted
+    REMOVE  u64 item ids
+    PLACE   u64 item id, pos (2 doubles), transform (9 doubles), transform origin (2 doubles)
+    REPLACE same as ADD, for new geometry of known items, which keep their place in the stacking order
+
+A torn record at the end (crash while writing) fails its length or crc check, replay stops there and the
+journal is cut back to the last complete record.
+"""
+import os
+import queue
+import struct
+import threading
+import typing
+import zlib
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from UI import history, project_format, scene_snapshot
+from UI.tracing import tracer
+
+MAGIC = b"IEJNL\0"
+VERSION = 2  # 2: REPLACE
+SUFFIX = ".journal"
+COMPACT_BYTES = 16 * 1024 * 1024  # journal size that triggers a compaction into the project file
+FLUSH_INTERVAL = 100  # ms, edits are batched for this long before they are handed to the writer
+
+_HEADER = struct.Struct("<6sHQ")
+_RECORD = struct.Struct("<IIB")
+_PLACEMENT = struct.Struct("<13d")
+_ID = struct.Struct("<Q")
+
+ADD = 1
+REMOVE = 2
+PLACE = 3
+REPLACE = 4
+
+
+class JournalError(Exception):
+    pass
+
+
+def journal_file(project_file: str) -> str:
+    return project_file + SUFFIX
+
+
+def new_journal_id() -> int:
+    """
+    random generation, a journal left over from another project with the same file name never matches
+    """
+    return int.from_bytes(os.urandom(8), "little") or 1
+
+
+# ------------------ encoding ------------------
+def _placement_values(placement: history.Placement) -> tuple:
+    pos, transform, origin = placement
+    return (pos.x(), pos.y(), transform.m11(), transform.m12(), transform.m13(), transform.m21(), transform.m22(),
+            transform.m23(), transform.m31(), transform.m32(), transform.m33(), origin.x(), origin.y())
+
+
+def _placement(values: tuple) -> history.Placement:
+    return history.Placement(QtCore.QPointF(values[0], values[1]), QtGui.QTransform(*values[2:11]),
+                             QtCore.QPointF(values[11], values[12]))
+
+
+def _record(op: int, payload: bytes) -> bytes:
+    op_byte = bytes((op,))
+    return _RECORD.pack(len(payload), zlib.crc32(payload, zlib.crc32(op_byte)), op) + payload
+
+
+def _record_bytes(record: scene_snapshot.ItemRecord) -> int:
+    """
+    :return: rough journal size of an item record, images loaded from a file are only referenced
+    """
+    if record.source:
+        return _RECORD.size + len(record.source)
+    return history.record_bytes(record)
+
+
+def _encode(op: int, data) -> bytes:
+    """
+    runs in the writer thread, records only hold value types
+    """
+    if op in (ADD, REPLACE):
+        item_ids, records = data
+        snapshot = scene_snapshot.SceneSnapshot(tuple(records), QtCore.QRectF(), QtGui.QBrush())
+        return _record(op, project_format.dumps_project(snapshot, embed_images=False, item_ids=item_ids))
+    if op == REMOVE:
+        return _record(REMOVE, struct.pack(f"<{len(data)}Q", *data))
+    item_id, values = data
+    return _record(PLACE, _ID.pack(item_id) + _PLACEMENT.pack(*values))
+
+
+def capture(document: history.History) -> typing.Tuple[scene_snapshot.SceneSnapshot, typing.List[int]]:
+    """
+    snapshot of the document items of a history, in stacking order
+    :return: snapshot and the item ids of its records
+    """
+    records, item_ids = [], []
+    for item_id, item in document.items.items():
+        record = scene_snapshot.snapshot_item(item)
+        if record is not None:
+            records.append(record)
+            item_ids.append(item_id)
+    scene = document.scene
+    return scene_snapshot.SceneSnapshot(tuple(records), scene.sceneRect(), scene.backgroundBrush()), item_ids
+
+
+# ------------------ replay ------------------
+class Recovered(typing.NamedTuple):
+    item_ids: typing.List[int]
+    items: typing.List[QtWidgets.QGraphicsItem]  # bottom to top, not added to any scene yet
+    edits: int  # journal records replayed
+    valid_bytes: int  # journal length up to the last complete record, 0 when the journal does not apply
+
+
+def _read_records(data: bytes) -> typing.Iterator[typing.Tuple[int, bytes, int]]:
+    """
+    :return: (op, payload, end offset) of every complete record
+    """
+    position = _HEADER.size
+    while position + _RECORD.size <= len(data):
+        size, crc, op = _RECORD.unpack_from(data, position)
+        start = position + _RECORD.size
+        payload = data[start:start + size]
+        if len(payload) != size or zlib.crc32(payload, zlib.crc32(bytes((op,)))) != crc:
+            return  # torn write
+        position = start + size
+        yield op, payload, position
+
+
+def replay(project_file: str, project: project_format.Project) -> Recovered:
+    """
+    apply the journal of a project file to the freshly loaded project
+    :raises JournalError: when a complete record can not be applied
+    """
+    if project.item_ids is not None:
+        items = dict(zip(project.item_ids, project.items))
+    else:  # saved without ids, they are handed out in order
+        items = dict(enumerate(project.items, 1))
+    try:
+        with open(journal_file(project_file), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = b""
+    edits, valid_bytes = 0, 0
+    if len(data) >= _HEADER.size:
+        magic, version, generation = _HEADER.unpack_from(data)
+        if magic == MAGIC and version <= VERSION and project.journal_id and generation == project.journal_id:
+            valid_bytes = _HEADER.size
+            with tracer.span("journal_replay", size=len(data)):
+                for op, payload, valid_bytes in _read_records(data):
+                    try:
+                        _apply(items, op, payload)
+                    except (KeyError, struct.error, project_format.ProjectFormatError) as e:
+                        raise JournalError(f"damaged journal record {edits + 1}: {e}") from None
+                    edits += 1
+    return Recovered(list(items), list(items.values()), edits, valid_bytes)
+
+
+def _apply(items: typing.Dict[int, QtWidgets.QGraphicsItem], op: int, payload: bytes):
+    if op == ADD:
+        added = project_format.loads_project(payload)
+        if added.item_ids is None:
+            raise KeyError("added items without ids")
+        for item_id, item in zip(added.item_ids, added.items):
+            items.pop(item_id, None)  # version 1 journaled reshapes as an ADD of the known id, on top
+            items[item_id] = item
+    elif op == REPLACE:
+        replaced = project_format.loads_project(payload)
+        if replaced.item_ids is None:
+            raise KeyError("replaced items without ids")
+        for item_id, item in zip(replaced.item_ids, replaced.items):
+            items[item_id] = item  # a known id keeps its place in the stacking order
+    elif op == REMOVE:  # unknown ids belong to items the journal could not record (no snapshot support)
+        for item_id in struct.unpack(f"<{len(payload) // 8}Q", payload):
+            items.pop(item_id, None)
+    elif op == PLACE:
+        item_id, = _ID.unpack_from(payload)
+        if item_id in items:
+            _placement(_PLACEMENT.unpack_from(payload, _ID.size)).apply(items[item_id])
+    else:
+        raise KeyError(f"unknown op {op}")
+
+
+# ------------------ writing ------------------
+class _Writer(threading.Thread):
+    """
+    owns the journal file, encodes and appends the queued edits and runs compactions
+    """
+
+    def __init__(self, project_file: str, journal_id: int, valid_bytes: int, on_error: typing.Callable[[str], None]):
+        """
+        :raises OSError: when the journal can not be opened
+        """
+        super().__init__(name="journal writer", daemon=True)
+        self.project_file = project_file
+        self.tasks: queue.Queue = queue.Queue()
+        self._on_error = on_error
+        self._file: typing.Optional[typing.BinaryIO] = None
+        self._failed = False
+        if valid_bytes:  # continue the journal, a torn record at the end gets cut off
+            self._file = open(journal_file(project_file), "r+b")
+            self._file.truncate(valid_bytes)
+            self._file.seek(valid_bytes)
+        else:
+            self._start_journal(journal_id)
+
+    def _start_journal(self, journal_id: int):
+        if self._file is not None:
+            self._file.close()
+        file_name = journal_file(self.project_file)
+        with open(file_name + ".part", "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, journal_id))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(file_name + ".part", file_name)
+        self._file = open(file_name, "ab")
+
+    def _fail(self, error: Exception):
+        self._failed = True  # later edits are dropped, the journal would have a gap otherwise
+        self._on_error(f"journal of {self.project_file} stopped: {error}")
+
+    def run(self):
+        running = True
+        while running:
+            tasks = [self.tasks.get()]
+            while True:  # everything queued meanwhile goes out with one flush
+                try:
+                    tasks.append(self.tasks.get_nowait())
+                except queue.Empty:
+                    break
+            written = []
+            for task in tasks:
+                kind = task[0]
+                if kind == "stop":
+                    running = False
+                elif kind == "sync":
+                    written.append(task[1])
+                elif not self._failed:
+                    try:
+                        if kind == "edits":
+                            with tracer.span("journal_write", edits=len(task[1])):
+                                self._file.writelines(_encode(op, data) for op, data in task[1])
+                        else:
+                            self._compact(*task[1:])
+                    except (OSError, ValueError) as e:
+                        self._fail(e)
+            if self._file is not None and not self._failed:
+                try:
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                except OSError as e:
+                    self._fail(e)
+            for event in written:
+                event.set()
+        if self._file is not None:
+            self._file.close()
+
+    def _compact(self, snapshot: scene_snapshot.SceneSnapshot, item_ids: typing.List[int], journal_id: int):
+        with tracer.span("journal_compact", items=len(item_ids)):
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            # the old journal stays valid until the new snapshot has replaced the project file
+            project_format.save_project(self.project_file, snapshot, item_ids=item_ids, journal_id=journal_id)
+            self._start_journal(journal_id)
+
+
+class Journal(QtCore.QObject):
+    """
+    Journals the changes of a history into the journal of a project file, from the state the project file (plus
+    its journal, when continued) holds.
+    """
+    failed = QtCore.pyqtSignal(str)  # emitted from the writer thread
+
+    def __init__(self, project_file: str, document: history.History, journal_id: int, valid_bytes: int = 0,
+                 compact_bytes: int = COMPACT_BYTES, parent: QtCore.QObject = None):
+        """
+        :param journal_id: generation of the project file
+        :param valid_bytes: length of the existing journal to continue (`Recovered.valid_bytes`), 0 to start a
+            new one
+        :raises OSError: when the journal can not be opened
+        """
+        super().__init__(parent)
+        self.project_file = project_file
+        self.history = document
+        self.journal_id = journal_id
+        self.compact_bytes = compact_bytes
+        self._journal_bytes = valid_bytes  # estimate, placements are counted at their encoded size only
+        self._pending: typing.List[list] = []  # [op, data] in order
+        self._flush_timer = QtCore.QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.timeout.connect(self.flush)
+        self._writer = _Writer(project_file, journal_id, valid_bytes, self.failed.emit)
+        self._writer.start()
+        document.items_added.connect(self._items_added)
+        document.items_removed.connect(self._items_removed)
+        document.item_placed.connect(self._item_placed)
+        document.item_replaced.connect(self._item_replaced)
+
+    # ------ recording ------
+    def _schedule(self):
+        if not self._flush_timer.isActive():
+            self._flush_timer.start(FLUSH_INTERVAL)
+
+    def _items_added(self, added: typing.List[typing.Tuple[int, QtWidgets.QGraphicsItem]]):
+        item_ids, records = [], []
+        for item_id, item in added:
+            record = scene_snapshot.snapshot_item(item)
+            if record is not None:
+                item_ids.append(item_id)
+                records.append(record)
+        if not records:
+            return
+        if self._pending and self._pending[-1][0] == ADD:  # e.g. redo of a large import, item by item
+            self._pending[-1][1][0].extend(item_ids)
+            self._pending[-1][1][1].extend(records)
+        else:
+            self._pending.append([ADD, (item_ids, records)])
+        self._schedule()
+
+    def _items_removed(self, item_ids: typing.List[int]):
+        if self._pending and self._pending[-1][0] == REMOVE:
+            self._pending[-1][1].extend(item_ids)
+        else:
+            self._pending.append([REMOVE, list(item_ids)])
+        self._schedule()
+
+    def _item_placed(self, args: typing.Tuple[int, QtWidgets.QGraphicsItem]):
+        # the placement is read at flush time, so the steps of a drag end up as one record
+        item_id, item = args
+        if not (self._pending and self._pending[-1][0] == PLACE and self._pending[-1][1][0] == item_id):
+            self._pending.append([PLACE, (item_id, item)])
+        self._schedule()
+
+    def _item_replaced(self, args: typing.Tuple[int, QtWidgets.QGraphicsItem]):
+        item_id, item = args
+        record = scene_snapshot.snapshot_item(item)
+        if record is None:
+            return
+        if self._pending and self._pending[-1][0] == REPLACE and self._pending[-1][1][0] == [item_id]:
+            self._pending[-1][1][1][0] = record  # e.g. undo and redo in a row, the last geometry counts
+        else:
+            self._pending.append([REPLACE, ([item_id], [record])])
+        self._schedule()
+
+    # ------ writing ------
+    def flush(self):
+        """
+        hand the pending edits to the writer thread
+        """
+        self._flush_timer.stop()
+        if not self._pending:
+            return
+        edits = []
+        for op, data in self._pending:
+            if op == PLACE:
+                item_id, item = data
+                data = (item_id, _placement_values(history.Placement.of(item)))
+                self._journal_bytes += _RECORD.size + _ID.size + _PLACEMENT.size
+            elif op == REMOVE:
+                self._journal_bytes += _RECORD.size + 8 * len(data)
+            else:
+                self._journal_bytes += sum(_record_bytes(record) for record in data[1])
+            edits.append((op, data))
+        self._pending = []
+        self._writer.tasks.put(("edits", edits))
+        if self._journal_bytes > self.compact_bytes:
+            self.compact()
+
+    def sync(self):
+        """
+        write out every edit so far and wait until it is on disk
+        """
+        self.flush()
+        written = threading.Event()
+        self._writer.tasks.put(("sync", written))
+        written.wait()
+
+    def compact(self):
+        """
+        fold the journal into a new snapshot of the project file, written in the background
+        """
+        self.flush()
+        snapshot, item_ids = capture(self.history)
+        self.journal_id = new_journal_id()
+        self._journal_bytes = 0
+        self._writer.tasks.put(("compact", snapshot, item_ids, self.journal_id))
+
+    def close(self):
+        """
+        write out the pending edits and stop journaling
+        """
+        self.history.items_added.disconnect(self._items_added)
+        self.history.items_removed.disconnect(self._items_removed)
+        self.history.item_placed.disconnect(self._item_placed)
+        self.history.item_replaced.disconnect(self._item_replaced)
+        self.flush()
+        self._writer.tasks.put(("stop",))
+        self._writer.join()
@@ -0,0 +1,110 @@
+import collections
+import time
+import typing
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import Qt
+
+SAMPLES = 120  # rolling window (frames / events) the averages and maxima are taken over
+
+
+class _Rolling:
+    def __init__(self):
+        self.samples: typing.Deque[float] = collections.deque(maxlen=SAMPLES)
+
+    def add(self, value: float):
+        self.samples.append(value)
+
+    def text(self, unit: str = "ms", scale: float = 1000) -> str:
+        if not self.samples:
+            return "-"
+        return f"{sum(self.samples) / len(self.samples) * scale:.2f} {unit} (max {max(self.samples) * scale:.2f})"
+
+
+class PerformanceHud(QtCore.QObject):
+    """
+    Collects paint, hit-test and event handling timings of a `CustomGraphicsView` and draws them on top of the canvas.
+
+    Only exists while the overlay is shown, the view checks for it with a single attribute test, so nothing is
+    measured while the overlay is off.
+    """
+
+    def __init__(self, view: QtWidgets.QGraphicsView, counters: typing.Dict[str, typing.Callable[[], int]],
+                 refresh_interval: int = 500):
+        """
+        :param counters: name -> callable, polled every refresh_interval ms (counting items is too costly per frame)
+        """
+        super().__init__(view)
+        self._view = view
+        self._counters = counters
+        self.frame_time = _Rolling()  # time between two paints
+        self.paint_time = _Rolling()  # time spent painting the scene (overlay excluded)
+        self.dirty_regions = _Rolling()  # rects in the update region of each paint
+        self.hit_test_time = _Rolling()
+        self.event_time = _Rolling()  # time spent handling one input event
+        self.events_per_second = 0.0
+        self._events = 0
+        self._counter_values: typing.Dict[str, int] = {}
+        self._last_paint: typing.Union[None, float] = None
+        self._last_refresh = time.perf_counter()
+        self._font = QtGui.QFont("monospace", 9)
+        self._font.setStyleHint(QtGui.QFont.TypeWriter)
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start(refresh_interval)
+        self.refresh()
+
+    # ------ measurements (called by the view) ------
+    def record_paint(self, started: float, finished: float, overlay_time: float, rect_count: int):
+        if self._last_paint is not None:
+            self.frame_time.add(started - self._last_paint)
+        self._last_paint = started
+        self.paint_time.add(finished - started - overlay_time)
+        self.dirty_regions.add(rect_count)
+
+    def record_event(self, duration: float):
+        self._events += 1
+        self.event_time.add(duration)
+
+    def record_hit_test(self, duration: float):
+        self.hit_test_time.add(duration)
+
+    def refresh(self):
+        now = time.perf_counter()
+        self.events_per_second = self._events / max(1e-6, now - self._last_refresh)
+        self._events = 0
+        self._last_refresh = now
+        self._counter_values = {name: counter() for name, counter in self._counters.items()}
+        self._view.viewport().update()
+
+    # ------ drawing ------
+    def lines(self) -> typing.List[str]:
+        lines = [
+            f"frame     {self.frame_time.text()}",
+            f"paint     {self.paint_time.text()}",
+            f"dirty     {self.dirty_regions.text('rects', 1)}",
+            f"hit test  {self.hit_test_time.text()}",
+            f"event     {self.event_time.text()}",
+            f"events/s  {self.events_per_second:.0f}",
+        ]
+        lines.extend(f"{name:<9} {value}" for name, value in self._counter_values.items())
+        return lines
+
+    def paint(self, painter: QtGui.QPainter):
+        """
+        draw the overlay in the top left corner of the viewport
+        :param painter: painter of the viewport, the transform gets reset so the overlay does not zoom or scroll
+        """
+        painter.save()
+        painter.resetTransform()
+        painter.setFont(self._font)
+        metrics = QtGui.QFontMetrics(self._font)
+        lines = self.lines()
+        line_height = metrics.height()
+        width = max(metrics.horizontalAdvance(line) for line in lines) + 12
+        painter.fillRect(QtCore.QRect(4, 4, width, line_height * len(lines) + 8), QtGui.QColor(0, 0, 0, 170))
+        painter.setPen(Qt.white)
+        for row, line in enumerate(lines):
+            painter.drawText(10, 8 + metrics.ascent() + row * line_height, line)
+        painter.restore()
@@ -0,0 +1,77 @@
+import typing
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+
+class PreviewEngine:
+    """
+    Keeps a single rubber-band item alive for the duration of a drag.
+
+    The item is created on the first update of a drag and its geometry is changed in place afterwards,
+    so the scene index and the allocator are not churned on every mouse move. On release the preview item
+    is handed over as the committed item with `commit()`.
+    """
+
+    def __init__(self, scene: QtWidgets.QGraphicsScene):
+        self._scene = scene
+        self._item: typing.Union[None, QtWidgets.QAbstractGraphicsShapeItem, QtWidgets.QGraphicsLineItem] = None
+
+    @property
+    def item(self):
+        return self._item
+
+    def _ensure(self, item_type):
+        if type(self._item) is not item_type:
+            self.discard()
+            self._item = item_type()
+            self._scene.addItem(self._item)
+        return self._item
+
+    def line(self, x1: float, y1: float, x2: float, y2: float, pen: QtGui.QPen) -> QtWidgets.QGraphicsLineItem:
+        item = self._ensure(QtWidgets.QGraphicsLineItem)
+        item.setPen(pen)
+        item.setLine(x1, y1, x2, y2)
+        return item
+
+    def rect(self, rect: QtCore.QRectF, pen: QtGui.QPen) -> QtWidgets.QGraphicsRectItem:
+        item = self._ensure(QtWidgets.QGraphicsRectItem)
+        item.setPen(pen)
+        item.setRect(rect)
+        return item
+
+    def ellipse(self, rect: QtCore.QRectF, pen: QtGui.QPen) -> QtWidgets.QGraphicsEllipseItem:
+        item = self._ensure(QtWidgets.QGraphicsEllipseItem)
+        item.setPen(pen)
+        item.setRect(rect)
+        return item
+
+    def path(self, path: QtGui.QPainterPath, pen: QtGui.QPen) -> QtWidgets.QGraphicsPathItem:
+        item = self._ensure(QtWidgets.QGraphicsPathItem)
+        item.setPen(pen)
+        item.setPath(path)
+        return item
+
+    def commit(self):
+        """
+        stop tracking the current preview item and return it, it stays in the scene as a regular item
+        :return: committed item (or None when nothing was previewed)
+        """
+        item = self._item
+        self._item = None
+        return item
+
+    def discard(self):
+        """
+        remove the current preview item from the scene
+        """
+        if self._item is not None:
+            _scene = self._item.scene()
+            if _scene:
+                _scene.removeItem(self._item)
+            self._item = None
+
+    def forget(self):
+        """
+        drop the reference without touching the scene (used when the scene itself is being cleared)
+        """
+        self._item = None
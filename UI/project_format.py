@@ -0,0 +1,459 @@
+"""
+Native project files (.iep), the full editable scene in a compact binary form.
+
+The file is a header followed by length-prefixed sections. Every section is one column over all items (kinds,
+transforms, geometry, style indices, ...) or a small table (pens, brushes, fonts), stored as raw little-endian
+arrays, so loading is a handful of bulk array conversions on a memory map instead of per element parsing.
+
+    header   magic "IEPRJ\\0", u16 version, u32 section count
+    section  4 byte tag, u64 payload length, payload, zero padding to 8 bytes
+
+Variable length data (texts, images, fonts) is stored per kind, as a u64 offsets column (one entry per item of
+that kind + 1) plus one data blob. Paths are stored as element columns: element count and fill rule per path,
+element type and point of every element.
+
+Optional sections: the item ids of the edit history (IIDS) and the generation of the edit journal that continues
+the file (JRNL), see `journal`.
+"""
+import array
+import gc
+import io
+import mmap
+import os
+import struct
+import sys
+import typing
+
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import Qt
+
+from UI import image_loader, scene_snapshot, shapes, tiled_image
+from UI.styles import style_cache
+from UI.tracing import traced
+
+MAGIC = b"IEPRJ\0"
+VERSION = 1
+EXTENSION = ".iep"
+_HEADER = struct.Struct("<6sHI")
+_SECTION = struct.Struct("<4sQ")
+_META = struct.Struct("<4dIIQ")  # scene rect, background rgba, background brush style, item count
+
+KIND_CODES = {scene_snapshot.LINE: 1, scene_snapshot.RECT: 2, scene_snapshot.ELLIPSE: 3, scene_snapshot.PATH: 4,
+              scene_snapshot.TEXT: 5, scene_snapshot.PIXMAP: 6}
+KIND_NAMES = {code: kind for kind, code in KIND_CODES.items()}
+
+_MOVE_TO = int(QtGui.QPainterPath.MoveToElement)
+_LINE_TO = int(QtGui.QPainterPath.LineToElement)
+_CURVE_TO = int(QtGui.QPainterPath.CurveToElement)
+
+_IDENTITY = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+
+
+class ProjectFormatError(Exception):
+    pass
+
+
+def _array(type_code: str, values=()) -> array.array:
+    column = array.array(type_code, values)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column
+
+
+def _to_list(type_code: str, data: memoryview) -> list:
+    column = array.array(type_code)
+    column.frombytes(data)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column.tolist()
+
+
+class _BlobColumn:
+    """
+    variable length values of all items, offsets + data
+    """
+
+    def __init__(self):
+        self.offsets = _array("Q", [0])
+        self.parts: typing.List[bytes] = []
+        self._size = 0
+
+    def append(self, data: bytes = b""):
+        if data:
+            self.parts.append(data)
+            self._size += len(data)
+        self.offsets.append(self._size)
+
+
+# ------------------ saving ------------------
+def _transform_values(transform: QtGui.QTransform) -> tuple:
+    return (transform.m11(), transform.m12(), transform.m13(), transform.m21(), transform.m22(), transform.m23(),
+            transform.m31(), transform.m32(), transform.m33())
+
+
+def _image_bytes(record: scene_snapshot.ItemRecord) -> bytes:
+    """
+    the original file when there is one (no re-encoding, decodes to the very same pixels), png otherwise
+    """
+    if record.source and os.path.isfile(record.source):
+        with open(record.source, "rb") as f:
+            return f.read()
+    data = QtCore.QByteArray()
+    buffer = QtCore.QBuffer(data)
+    buffer.open(QtCore.QIODevice.WriteOnly)
+    record.geometry.save(buffer, "PNG")
+    buffer.close()
+    return bytes(data)
+
+
+def _encode(snapshot: scene_snapshot.SceneSnapshot, embed_images: bool, item_ids: typing.Sequence[int],
+            journal_id: int) -> typing.List[typing.Tuple[bytes, list]]:
+    records = snapshot.records
+    kinds = _array("B")
+    z_values = _array("d")
+    transforms = _array("d")
+    geometry = _array("d")  # 4 per item: line points, rect, or pixmap offset and display size (0 0: pixmap size)
+    pen_indices = _array("i")
+    brush_indices = _array("i")
+    # per kind columns, one entry per item of that kind
+    texts, images, sources, font_column = _BlobColumn(), _BlobColumn(), _BlobColumn(), _BlobColumn()
+    path_sizes = _array("I")
+    path_fill_rules = _array("B")
+    element_types = _array("B")
+    element_points = _array("d")
+    font_indices = _array("i")
+    text_colors = _array("I")
+    pens: typing.Dict[tuple, int] = {}
+    brushes: typing.Dict[tuple, int] = {}
+    fonts: typing.Dict[str, int] = {}
+    no_geometry = (0.0, 0.0, 0.0, 0.0)
+    last_pen, last_pen_index = None, -1  # runs of items with the same style are common, skips the key lookup
+    last_brush, last_brush_index = None, -1
+
+    for record in records:
+        kind = record.kind
+        kinds.append(KIND_CODES[kind])
+        z_values.append(record.z)
+        transform = record.transform
+        transforms.extend(_IDENTITY if transform.isIdentity() else _transform_values(transform))
+        pen = record.pen
+        if pen is None:
+            pen_indices.append(-1)
+        else:
+            if last_pen is None or pen != last_pen:
+                key = (pen.color().rgba(), pen.widthF(), pen.style(), pen.capStyle(), pen.joinStyle())
+                last_pen, last_pen_index = pen, pens.setdefault(key, len(pens))
+            pen_indices.append(last_pen_index)
+        brush = record.brush
+        if brush is None:
+            brush_indices.append(-1)
+        else:
+            if last_brush is None or brush != last_brush:
+                key = (brush.color().rgba(), brush.style())
+                last_brush, last_brush_index = brush, brushes.setdefault(key, len(brushes))
+            brush_indices.append(last_brush_index)
+
+        if kind == scene_snapshot.LINE:
+            line = record.geometry
+            geometry.extend((line.x1(), line.y1(), line.x2(), line.y2()))
+        elif kind == scene_snapshot.RECT or kind == scene_snapshot.ELLIPSE:
+            rect = record.geometry
+            geometry.extend((rect.x(), rect.y(), rect.width(), rect.height()))
+        elif kind == scene_snapshot.PATH:
+            geometry.extend(no_geometry)
+            path = record.geometry
+            size = path.elementCount()
+            path_sizes.append(size)
+            path_fill_rules.append(path.fillRule())
+            for index in range(size):
+                element = path.elementAt(index)
+                element_types.append(element.type)
+                element_points.append(element.x)
+                element_points.append(element.y)
+        elif kind == scene_snapshot.TEXT:
+            geometry.extend(no_geometry)
+            texts.append(record.geometry.encode("utf-8"))
+            font_indices.append(fonts.setdefault(record.font.toString(), len(fonts)))
+            text_colors.append(record.color.rgba())
+        else:
+            offset = record.offset or QtCore.QPointF()
+            size = record.size
+            geometry.extend((offset.x(), offset.y(), size.width(), size.height()) if size is not None
+                            else (offset.x(), offset.y(), 0.0, 0.0))
+            images.append(_image_bytes(record) if embed_images or not record.source else b"")
+            sources.append((record.source or "").encode("utf-8"))
+
+    for font in fonts:
+        font_column.append(font.encode("utf-8"))
+    rect = snapshot.scene_rect
+    sections = [
+        (b"META", [_META.pack(rect.x(), rect.y(), rect.width(), rect.height(), snapshot.background.color().rgba(),
+                              int(snapshot.background.style()), len(records))]),
+        (b"KIND", [kinds]), (b"ZVAL", [z_values]), (b"XFRM", [transforms]), (b"GEOM", [geometry]),
+        (b"PENI", [pen_indices]), (b"BRSI", [brush_indices]),
+        (b"PENC", [_array("I", [key[0] for key in pens])]),
+        (b"PENW", [_array("d", [key[1] for key in pens])]),
+        (b"PENS", [_array("B", [int(value) for key in pens for value in key[2:]])]),  # style, cap, join
+        (b"BRSC", [_array("I", [key[0] for key in brushes])]),
+        (b"BRSS", [_array("B", [int(key[1]) for key in brushes])]),
+        (b"FNTO", [font_column.offsets]), (b"FNTD", font_column.parts),
+        (b"PTHN", [path_sizes]), (b"PTHF", [path_fill_rules]), (b"PTHT", [element_types]), (b"PTHP", [element_points]),
+        (b"TXTO", [texts.offsets]), (b"TXTD", texts.parts), (b"TXTF", [font_indices]), (b"TXTC", [text_colors]),
+        (b"IMGO", [images.offsets]), (b"IMGD", images.parts),
+        (b"SRCO", [sources.offsets]), (b"SRCD", sources.parts),
+    ]
+    if item_ids is not None:
+        if len(item_ids) != len(records):
+            raise ValueError("one item id per record is needed")
+        sections.append((b"IIDS", [_array("Q", item_ids)]))
+    if journal_id:
+        sections.append((b"JRNL", [_array("Q", [journal_id])]))
+    return sections
+
+
+def _write_sections(f: typing.BinaryIO, sections: typing.List[typing.Tuple[bytes, list]]):
+    f.write(_HEADER.pack(MAGIC, VERSION, len(sections)))
+    for tag, parts in sections:
+        payload = [part if isinstance(part, bytes) else part.tobytes() for part in parts]
+        size = sum(len(part) for part in payload)
+        f.write(_SECTION.pack(tag, size))
+        f.writelines(payload)
+        f.write(b"\0" * (-size % 8))
+
+
+@traced("save_project")
+def save_project(file_name: str, snapshot: scene_snapshot.SceneSnapshot, embed_images: bool = True,
+                 item_ids: typing.Sequence[int] = None, journal_id: int = 0):
+    """
+    :param snapshot: scene to save, see `scene_snapshot.SceneSnapshot.capture`
+    :param embed_images: store the image data in the file, otherwise pixmaps loaded from a file are only
+        referenced by their path
+    :param item_ids: history ids of the records, in the same order
+    :param journal_id: generation of the edit journal that continues this file, 0 for none
+    """
+    sections = _encode(snapshot, embed_images, item_ids, journal_id)
+    temp_file_name = file_name + ".part"
+    with open(temp_file_name, "wb") as f:
+        _write_sections(f, sections)
+    os.replace(temp_file_name, file_name)  # an interrupted save never leaves a broken project behind
+
+
+def dumps_project(snapshot: scene_snapshot.SceneSnapshot, embed_images: bool = True,
+                  item_ids: typing.Sequence[int] = None) -> bytes:
+    """
+    same as `save_project`, into memory
+    """
+    f = io.BytesIO()
+    _write_sections(f, _encode(snapshot, embed_images, item_ids, 0))
+    return f.getvalue()
+
+
+# ------------------ loading ------------------
+def _read_sections(data: memoryview) -> typing.Dict[bytes, memoryview]:
+    magic, version, count = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ProjectFormatError("not a project file")
+    if version > VERSION:
+        raise ProjectFormatError(f"project file version {version} is newer than this application")
+    sections = {}
+    position = _HEADER.size
+    for _ in range(count):
+        tag, size = _SECTION.unpack_from(data, position)
+        position += _SECTION.size
+        if position + size > len(data):
+            raise ProjectFormatError(f"section {tag!r} is truncated")
+        sections[tag] = data[position:position + size]
+        position += size + (-size % 8)
+    return sections
+
+
+class _Blobs:
+    def __init__(self, sections: typing.Dict[bytes, memoryview], offsets_tag: bytes, data_tag: bytes):
+        self.offsets = _to_list("Q", sections[offsets_tag])
+        self.data = sections[data_tag]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> bytes:
+        return bytes(self.data[self.offsets[index]:self.offsets[index + 1]])
+
+
+class Project(typing.NamedTuple):
+    items: typing.List[QtWidgets.QGraphicsItem]  # bottom to top, not added to any scene yet
+    scene_rect: QtCore.QRectF
+    background: QtGui.QBrush
+    item_ids: typing.Optional[typing.List[int]] = None  # history ids of the items, when saved with them
+    journal_id: int = 0
+
+
+@traced("load_project")
+def load_project(file_name: str) -> Project:
+    """
+    :raises ProjectFormatError: when the file is not a (readable) project file
+    """
+    with open(file_name, "rb") as f:
+        if os.fstat(f.fileno()).st_size < _HEADER.size:
+            raise ProjectFormatError("not a project file")
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    try:
+        return _parse(view)
+    finally:
+        view.release()
+        mapped.close()
+
+
+def loads_project(data: bytes) -> Project:
+    """
+    same as `load_project`, from memory
+    """
+    if len(data) < _HEADER.size:
+        raise ProjectFormatError("not a project file")
+    return _parse(memoryview(data))
+
+
+def _parse(data: memoryview) -> Project:
+    gc_enabled = gc.isenabled()
+    gc.disable()  # only new objects without cycles, collections would rescan the growing item list over and over
+    error = None
+    try:
+        project = _build_items(_read_sections(data))
+    except ProjectFormatError as e:
+        error = str(e)
+    except (KeyError, IndexError, struct.error, ValueError) as e:
+        error = f"damaged project file: {e}"
+    finally:
+        if gc_enabled:
+            gc.enable()
+    # raised out here, the traceback must not keep the section views (and so the memory map) alive
+    if error is not None:
+        raise ProjectFormatError(error)
+    return project
+
+
+def _build_items(sections: typing.Dict[bytes, memoryview]) -> Project:
+    x, y, width, height, background, background_style, count = _META.unpack(sections[b"META"])
+    kinds = _to_list("B", sections[b"KIND"])
+    z_values = _to_list("d", sections[b"ZVAL"])
+    transforms = _to_list("d", sections[b"XFRM"])
+    geometry = _to_list("d", sections[b"GEOM"])
+    pen_indices = _to_list("i", sections[b"PENI"])
+    brush_indices = _to_list("i", sections[b"BRSI"])
+    if not (len(kinds) == len(z_values) == len(pen_indices) == len(brush_indices) == count
+            and len(transforms) == 9 * count and len(geometry) == 4 * count):
+        raise ProjectFormatError("column lengths do not match the item count")
+    item_ids = _to_list("Q", sections[b"IIDS"]) if b"IIDS" in sections else None
+    if item_ids is not None and len(item_ids) != count:
+        raise ProjectFormatError("item ids do not match the item count")
+    journal_id = _to_list("Q", sections[b"JRNL"])[0] if b"JRNL" in sections else 0
+
+    pen_styles = _to_list("B", sections[b"PENS"])
+    pens = [style_cache.pen(QtGui.QColor.fromRgba(color), width, *pen_styles[3 * i:3 * i + 3])
+            for i, (color, width) in enumerate(zip(_to_list("I", sections[b"PENC"]),
+                                                   _to_list("d", sections[b"PENW"])))]
+    brushes = [style_cache.brush(QtGui.QColor.fromRgba(color), style)
+               for color, style in zip(_to_list("I", sections[b"BRSC"]), _to_list("B", sections[b"BRSS"]))]
+    font_blobs = _Blobs(sections, b"FNTO", b"FNTD")
+    fonts = []
+    for index in range(len(font_blobs)):
+        font = QtGui.QFont()
+        font.fromString(str(font_blobs[index], "utf-8"))
+        fonts.append(font)
+    path_sizes = iter(_to_list("I", sections[b"PTHN"]))
+    path_fill_rules = iter(_to_list("B", sections[b"PTHF"]))
+    element_types = _to_list("B", sections[b"PTHT"])
+    element_points = _to_list("d", sections[b"PTHP"])
+    element = 0  # next path element
+    texts = iter(_Blobs(sections, b"TXTO", b"TXTD"))
+    text_fonts = iter(_to_list("i", sections[b"TXTF"]))
+    text_colors = iter(_to_list("I", sections[b"TXTC"]))
+    images = iter(_Blobs(sections, b"IMGO", b"IMGD"))
+    sources = iter(_Blobs(sections, b"SRCO", b"SRCD"))
+
+    line_code, rect_code, ellipse_code, path_code, text_code = (
+        KIND_CODES[kind] for kind in (scene_snapshot.LINE, scene_snapshot.RECT, scene_snapshot.ELLIPSE,
+                                      scene_snapshot.PATH, scene_snapshot.TEXT))
+    identity = list(_IDENTITY)
+    items = []
+    for i, code in enumerate(kinds):
+        g = 4 * i
+        if code == line_code:
+            item = QtWidgets.QGraphicsLineItem(*geometry[g:g + 4])
+        elif code == rect_code:
+            item = QtWidgets.QGraphicsRectItem(*geometry[g:g + 4])
+        elif code == ellipse_code:
+            item = QtWidgets.QGraphicsEllipseItem(*geometry[g:g + 4])
+        elif code == path_code:
+            fill_rule = next(path_fill_rules)
+            size = next(path_sizes)
+            end = element + size
+            item = None
+            if size and element_types[element] == _MOVE_TO:
+                # polylines and splines take their vertices straight from the points column
+                if element_types[element + 1:end].count(_LINE_TO) == size - 1:
+                    item = shapes.PolylineItem(np.array(element_points[2 * element:2 * end]))
+                elif size >= 4 and size % 3 == 1 and \
+                        element_types[element + 1:end:3].count(_CURVE_TO) == (size - 1) // 3:
+                    knots = shapes.knots_of_elements(np.array(element_points[2 * element:2 * end]).reshape(-1, 2))
+                    if knots is not None:
+                        item = shapes.SplineItem(knots)
+            if item is not None:
+                path = item.path()
+                path.setFillRule(fill_rule)
+                item.setPath(path)
+                element = end
+            else:
+                path = QtGui.QPainterPath()
+                path.setFillRule(fill_rule)
+                while element < end:
+                    element_type = element_types[element]
+                    point = 2 * element
+                    if element_type == _MOVE_TO:
+                        path.moveTo(element_points[point], element_points[point + 1])
+                        element += 1
+                    elif element_type == _LINE_TO:
+                        path.lineTo(element_points[point], element_points[point + 1])
+                        element += 1
+                    else:  # curve to, followed by the two curve data elements
+                        path.cubicTo(*element_points[point:point + 6])
+                        element += 3
+                item = QtWidgets.QGraphicsPathItem(path)
+        elif code == text_code:
+            item = QtWidgets.QGraphicsTextItem(str(next(texts), "utf-8"))
+            item.setFont(fonts[next(text_fonts)])
+            item.setDefaultTextColor(QtGui.QColor.fromRgba(next(text_colors)))
+        else:
+            source = str(next(sources), "utf-8") or None
+            image_data = next(images)
+            display_width, display_height = geometry[g + 2], geometry[g + 3]
+            pixmap = QtGui.QPixmap()
+            if display_width and source and os.path.isfile(source):
+                # was shown as a preview, the full resolution can be decoded from the source again when needed
+                try:
+                    decoded = (image_loader.decode_image_data(image_data, tiled_image.PREVIEW_SIZE) if image_data
+                               else image_loader.decode_image(source, tiled_image.PREVIEW_SIZE))
+                except image_loader.ImageLoadError as e:
+                    raise ProjectFormatError(f"image {source or i} could not be loaded: {e}") from None
+                pixmap.convertFromImage(decoded.image)
+            elif not (pixmap.loadFromData(image_data) if image_data else pixmap.load(source or "")):
+                raise ProjectFormatError(f"image {source or i} could not be loaded")
+            if display_width and (display_width, display_height) != (pixmap.width(), pixmap.height()):
+                item = tiled_image.image_item(pixmap, QtCore.QSizeF(display_width, display_height), source)
+            else:
+                item = QtWidgets.QGraphicsPixmapItem(pixmap)
+                item.setData(Qt.UserRole, source)
+            item.setOffset(geometry[g], geometry[g + 1])
+        if pen_indices[i] >= 0:
+            item.setPen(pens[pen_indices[i]])
+        if brush_indices[i] >= 0:
+            item.setBrush(brushes[brush_indices[i]])
+        values = transforms[9 * i:9 * i + 9]
+        if values != identity:
+            item.setTransform(QtGui.QTransform(*values))
+        if z_values[i]:
+            item.setZValue(z_values[i])
+        items.append(item)
+    return Project(items, QtCore.QRectF(x, y, width, height),
+                   QtGui.QBrush(QtGui.QColor.fromRgba(background), background_style), item_ids, journal_id)
@@ -0,0 +1,97 @@
+import typing
+
+from PyQt5 import QtWidgets
+
+from UI.tracing import tracer
+
+
+class BulkInsert:
+    """
+    Collects graphics items and inserts them into a scene in one batch.
+
+    While the batch is inserted the scene index and the scene signals are suspended and the views do not repaint,
+    afterwards the index is rebuilt once and a single update is issued. Meant for importers that add
+    thousands of items at once:
+
+        with BulkInsert(scene) as bulk:
+            for ...:
+                bulk.add(QtWidgets.QGraphicsLineItem(...))
+
+    Inside a `SuspendedIndex` (importers that insert batch after batch) the index is left off and gets built
+    once, when the suspension ends.
+    """
+
+    def __init__(self, scene: QtWidgets.QGraphicsScene):
+        self._scene = scene
+        self._items: typing.List[QtWidgets.QGraphicsItem] = []
+        self.inserted_items: typing.List[QtWidgets.QGraphicsItem] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self._items.clear()
+        return False
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item: QtWidgets.QGraphicsItem) -> QtWidgets.QGraphicsItem:
+        self._items.append(item)
+        return item
+
+    def extend(self, items: typing.Iterable[QtWidgets.QGraphicsItem]):
+        self._items.extend(items)
+
+    def flush(self) -> typing.List[QtWidgets.QGraphicsItem]:
+        """
+        insert every collected item into the scene
+        :return: the inserted items
+        """
+        items, self._items = self._items, []
+        if not items:
+            return items
+        scene = self._scene
+        index_method = scene.itemIndexMethod()
+        signals_blocked = scene.blockSignals(True)
+        views = [view for view in scene.views() if view.updatesEnabled()]
+        for view in views:
+            view.setUpdatesEnabled(False)
+        scene.setItemIndexMethod(QtWidgets.QGraphicsScene.NoIndex)
+        try:
+            with tracer.span("bulk_insert", items=len(items)):
+                for item in items:
+                    scene.addItem(item)
+        finally:
+            scene.setItemIndexMethod(index_method)  # the index gets rebuilt once, with every item in place
+            scene.blockSignals(signals_blocked)
+            for view in views:
+                view.setUpdatesEnabled(True)
+        scene.update()
+        self.inserted_items.extend(items)
+        return items
+
+
+class SuspendedIndex:
+    """
+    Switches the scene index off until `restore`, for importers that insert items in several `BulkInsert`
+    batches, so the index is built once for the whole import instead of once per batch (every rebuild covers
+    all items of the scene).
+    """
+
+    def __init__(self, scene: QtWidgets.QGraphicsScene):
+        self._scene: typing.Optional[QtWidgets.QGraphicsScene] = scene
+        self._index_method = scene.itemIndexMethod()
+        scene.setItemIndexMethod(QtWidgets.QGraphicsScene.NoIndex)
+
+    def restore(self):
+        """
+        switch the index back on, the index gets built with every item in place
+        """
+        if self._scene is not None:
+            with tracer.span("restore_index"):
+                self._scene.setItemIndexMethod(self._index_method)
+            self._scene = None
@@ -0,0 +1,275 @@
+import math
+import typing
+
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import Qt
+
+from UI import image_loader, shapes, tiled_image
+from UI.graphics_view import CopyItem
+
+LINE = "line"
+RECT = "rect"
+ELLIPSE = "ellipse"
+PATH = "path"
+TEXT = "text"
+PIXMAP = "pixmap"
+
+
+class ItemRecord(typing.NamedTuple):
+    """
+    Value copy of everything needed to draw one scene item (Qt value types are implicitly shared,
+    so taking a record is cheap and later edits of the live item do not leak into it).
+    """
+    kind: str
+    geometry: typing.Any  # QLineF, QRectF, QPainterPath, str (text) or QImage (pixmap)
+    transform: QtGui.QTransform  # item to scene
+    z: float = 0.0
+    pen: typing.Optional[QtGui.QPen] = None
+    brush: typing.Optional[QtGui.QBrush] = None
+    font: typing.Optional[QtGui.QFont] = None
+    color: typing.Optional[QtGui.QColor] = None  # text color
+    offset: typing.Optional[QtCore.QPointF] = None  # pixmap offset
+    source: typing.Optional[str] = None  # file the pixmap was loaded from
+    size: typing.Optional[QtCore.QSizeF] = None  # pixmap shown at this size (a preview of its source), None: as is
+
+
+def snapshot_item(item: QtWidgets.QGraphicsItem, transform: QtGui.QTransform = None) -> typing.Optional[ItemRecord]:
+    """
+    :return: record of the item or None if the item type is not supported
+    """
+    if transform is None:
+        transform = item.sceneTransform()
+    if isinstance(item, CopyItem):  # pasted items draw the original item with their own transform
+        return snapshot_item(item.item, transform)
+    z = item.zValue()
+    if isinstance(item, QtWidgets.QGraphicsLineItem):
+        return ItemRecord(LINE, item.line(), transform, z, item.pen())
+    if isinstance(item, QtWidgets.QGraphicsRectItem):
+        return ItemRecord(RECT, item.rect(), transform, z, item.pen(), item.brush())
+    if isinstance(item, QtWidgets.QGraphicsEllipseItem):
+        return ItemRecord(ELLIPSE, item.rect(), transform, z, item.pen(), item.brush())
+    if isinstance(item, QtWidgets.QGraphicsPathItem):
+        return ItemRecord(PATH, item.path(), transform, z, item.pen(), item.brush())
+    if isinstance(item, QtWidgets.QGraphicsTextItem):
+        return ItemRecord(TEXT, item.toPlainText(), transform, z, font=item.font(), color=item.defaultTextColor())
+    if isinstance(item, image_loader.ImagePixmapItem):
+        return ItemRecord(PIXMAP, item.pixmap().toImage(), transform, z, offset=item.offset(),
+                          source=item.data(Qt.UserRole), size=item.display_size)
+    if isinstance(item, QtWidgets.QGraphicsPixmapItem):
+        return ItemRecord(PIXMAP, item.pixmap().toImage(), transform, z, offset=item.offset(),
+                          source=item.data(Qt.UserRole))
+    return None
+
+
+def build_item(record: ItemRecord) -> QtWidgets.QGraphicsItem:
+    """
+    create a (scene-less) graphics item from a record, GUI thread only (`SnapshotRenderer` draws records elsewhere)
+    """
+    kind = record.kind
+    if kind == LINE:
+        item = QtWidgets.QGraphicsLineItem(record.geometry)
+    elif kind == RECT:
+        item = QtWidgets.QGraphicsRectItem(record.geometry)
+    elif kind == ELLIPSE:
+        item = QtWidgets.QGraphicsEllipseItem(record.geometry)
+    elif kind == PATH:  # splines and polylines stay editable / faster to pick, the same path for rendering
+        item = shapes.SplineItem.from_path(record.geometry) or shapes.PolylineItem.from_path(record.geometry)
+        if item is None:
+            item = QtWidgets.QGraphicsPathItem(record.geometry)
+    elif kind == TEXT:
+        item = QtWidgets.QGraphicsTextItem(record.geometry)
+        item.setFont(record.font)
+        item.setDefaultTextColor(record.color)
+    elif kind == PIXMAP:
+        if record.size is not None:
+            item = tiled_image.image_item(QtGui.QPixmap.fromImage(record.geometry), record.size, record.source)
+            item.setOffset(record.offset)
+        else:
+            item = QtWidgets.QGraphicsPixmapItem(QtGui.QPixmap.fromImage(record.geometry))
+            item.setOffset(record.offset)
+            item.setData(Qt.UserRole, record.source)
+    else:
+        raise ValueError(f"unknown item kind {kind!r}")
+    if record.pen is not None:
+        item.setPen(record.pen)
+    if record.brush is not None:
+        item.setBrush(record.brush)
+    item.setTransform(record.transform)
+    item.setZValue(record.z)
+    return item
+
+
+class SceneSnapshot(typing.NamedTuple):
+    """
+    Immutable render description of a scene, taken on the GUI thread and safe to hand to a worker thread.
+    """
+    records: typing.Tuple[ItemRecord, ...]
+    scene_rect: QtCore.QRectF
+    background: QtGui.QBrush
+
+    @classmethod
+    def capture(cls, scene: QtWidgets.QGraphicsScene,
+                exclude: typing.Iterable[QtWidgets.QGraphicsItem] = ()) -> 'SceneSnapshot':
+        """
+        :param exclude: helper items (selection rect, drawing previews) that are not part of the document
+        """
+        excluded = {id(item) for item in exclude if item is not None}
+        records = []
+        for item in scene.items(Qt.AscendingOrder):  # bottom to top, keeps the stacking order
+            if id(item) in excluded or item.parentItem() is not None or not item.isVisible():
+                continue
+            record = snapshot_item(item)
+            if record is not None:
+                records.append(record)
+        return cls(tuple(records), scene.sceneRect(), scene.backgroundBrush())
+
+
+class SnapshotRenderer:
+    """
+    Draws the records of a snapshot with a plain QPainter, stands in for a QGraphicsScene (`sceneRect`,
+    `itemsBoundingRect`, `items`, `render`) where the graphics view classes can not be used: they belong to the
+    widgets module and may only be created in the GUI thread, so exports render snapshots through this.
+
+    The scene bounds of all records are kept in one array, so finding the records of a tile is a vectorized test.
+    A preview image is replaced by the full resolution of its source file once it is drawn at a scale the preview
+    can not serve, the decoding happens in the rendering thread.
+    """
+
+    def __init__(self, snapshot: SceneSnapshot):
+        self.snapshot = snapshot
+        self.records = snapshot.records
+        self._documents: typing.Dict[int, QtGui.QTextDocument] = {}  # text layouts, by record index
+        self._images: typing.Dict[int, QtGui.QImage] = {}  # full resolution of previews, by record index
+        bounds = np.empty((len(self.records), 4), dtype=np.float64)
+        for index, record in enumerate(self.records):
+            rect = record.transform.mapRect(self._local_bounds(index, record))
+            bounds[index] = rect.left(), rect.top(), rect.right(), rect.bottom()
+        self._bounds = bounds
+
+    def _local_bounds(self, index: int, record: ItemRecord) -> QtCore.QRectF:
+        kind = record.kind
+        if kind == TEXT:
+            document = QtGui.QTextDocument()
+            document.setDefaultFont(record.font)
+            document.setPlainText(record.geometry)
+            self._documents[index] = document
+            return QtCore.QRectF(QtCore.QPointF(), document.size())
+        if kind == PIXMAP:
+            return QtCore.QRectF(record.offset or QtCore.QPointF(),
+                                 record.size or QtCore.QSizeF(record.geometry.size()))
+        if kind == LINE:
+            rect = QtCore.QRectF(record.geometry.p1(), record.geometry.p2()).normalized()
+        elif kind == PATH:
+            rect = record.geometry.controlPointRect()
+        else:
+            rect = record.geometry.normalized()
+        pen = record.pen
+        if pen is None or pen.style() == Qt.NoPen or pen.isCosmetic():
+            return rect  # cosmetic strokes are covered by the padding of `render`
+        extra = pen.widthF()  # half the width, doubled for miter joins
+        return rect.adjusted(-extra, -extra, extra, extra)
+
+    def sceneRect(self) -> QtCore.QRectF:
+        return QtCore.QRectF(self.snapshot.scene_rect)
+
+    def itemsBoundingRect(self) -> QtCore.QRectF:
+        if not len(self._bounds):
+            return QtCore.QRectF()
+        left, top = self._bounds[:, :2].min(axis=0)
+        right, bottom = self._bounds[:, 2:].max(axis=0)
+        return QtCore.QRectF(QtCore.QPointF(left, top), QtCore.QPointF(right, bottom))
+
+    def _indices(self, rect: QtCore.QRectF) -> np.ndarray:
+        """
+        :return: indices of the records whose bounds intersect `rect`, bottom to top
+        """
+        bounds = self._bounds
+        hits = ((bounds[:, 0] <= rect.right()) & (bounds[:, 2] >= rect.left()) &
+                (bounds[:, 1] <= rect.bottom()) & (bounds[:, 3] >= rect.top()))
+        return np.flatnonzero(hits)
+
+    def items(self, rect: QtCore.QRectF, mode=Qt.IntersectsItemBoundingRect) -> typing.List[ItemRecord]:
+        """
+        :return: records whose bounds intersect `rect` (only bounding rect intersection is supported)
+        """
+        return [self.records[index] for index in self._indices(rect).tolist()]
+
+    def render(self, painter: QtGui.QPainter, target: QtCore.QRectF = QtCore.QRectF(),
+               source: QtCore.QRectF = QtCore.QRectF(), mode=Qt.KeepAspectRatio):
+        """
+        same as `QGraphicsScene.render`: draw the `source` scene area (scene rect when null) into `target` (whole
+        paint device when null)
+        """
+        if source.isNull():
+            source = self.sceneRect()
+        if target.isNull():
+            device = painter.device()
+            target = QtCore.QRectF(0, 0, device.width(), device.height())
+        scale_x, scale_y = target.width() / source.width(), target.height() / source.height()
+        if mode == Qt.KeepAspectRatio:
+            scale_x = scale_y = min(scale_x, scale_y)
+        elif mode == Qt.KeepAspectRatioByExpanding:
+            scale_x = scale_y = max(scale_x, scale_y)
+        painter.save()
+        painter.setClipRect(target, Qt.IntersectClip)
+        painter.setWorldTransform(QtGui.QTransform.fromTranslate(target.left(), target.top())
+                                  .scale(scale_x, scale_y).translate(-source.left(), -source.top()), True)
+        if self.snapshot.background.style() != Qt.NoBrush:
+            painter.fillRect(source, self.snapshot.background)
+        world = painter.worldTransform()
+        padding = 2 / min(abs(scale_x), abs(scale_y))  # 2 device pixels, antialiasing and cosmetic pens
+        for index in self._indices(source.adjusted(-padding, -padding, padding, padding)).tolist():
+            record = self.records[index]
+            painter.setWorldTransform(record.transform * world)
+            self._paint(painter, index, record)
+        painter.restore()
+
+    def _paint(self, painter: QtGui.QPainter, index: int, record: ItemRecord):
+        kind = record.kind
+        if kind == TEXT:
+            context = QtGui.QAbstractTextDocumentLayout.PaintContext()
+            context.palette.setColor(QtGui.QPalette.Text, record.color)
+            self._documents[index].documentLayout().draw(painter, context)
+            return
+        if kind == PIXMAP:
+            self._paint_image(painter, index, record)
+            return
+        painter.setPen(record.pen)
+        painter.setBrush(record.brush if record.brush is not None else QtGui.QBrush())
+        if kind == LINE:
+            painter.drawLine(record.geometry)
+        elif kind == RECT:
+            painter.drawRect(record.geometry)
+        elif kind == ELLIPSE:
+            painter.drawEllipse(record.geometry)
+        elif kind == PATH:
+            painter.drawPath(record.geometry)
+
+    def _paint_image(self, painter: QtGui.QPainter, index: int, record: ItemRecord):
+        image = self._images.get(index, record.geometry)
+        target = QtCore.QRectF(record.offset or QtCore.QPointF(), record.size or QtCore.QSizeF(image.size()))
+        painter.save()
+        if image.width() < target.width():
+            if record.source and index not in self._images and \
+                    target.width() * _level_of_detail(painter.worldTransform()) > image.width():
+                try:
+                    image = image_loader.decode_image(record.source).image
+                except image_loader.ImageLoadError:
+                    pass  # keeps rendering the preview
+                self._images[index] = image
+            painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, True)
+        painter.drawImage(target, image)
+        painter.restore()
+
+
+def _level_of_detail(transform: QtGui.QTransform) -> float:
+    """
+    same as `QStyleOptionGraphicsItem.levelOfDetailFromTransform`
+    """
+    if transform.type() <= QtGui.QTransform.TxTranslate:
+        return 1.0
+    origin = transform.map(QtCore.QPointF(0, 0))
+    x_axis = transform.map(QtCore.QPointF(1, 0)) - origin
+    y_axis = transform.map(QtCore.QPointF(0, 1)) - origin
+    return math.sqrt(math.hypot(x_axis.x(), x_axis.y()) * math.hypot(y_axis.x(), y_axis.y()))
@@ -0,0 +1,327 @@
+import typing
+
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from UI import snapping
+
+
+class PolylineItem(QtWidgets.QGraphicsPathItem):
+    """
+    Open polyline drawn as a single path item.
+
+    While drawing, vertices are appended to the path in place (`append`), so a polyline of any length is one scene
+    item, one index entry and one undo step. The vertices are also kept as an (n, 2) array in item coordinates,
+    the selection index hit tests against them segment by segment instead of stroking the path.
+    """
+
+    def __init__(self, points: np.ndarray = None, parent: QtWidgets.QGraphicsItem = None):
+        super().__init__(parent)
+        self._points = np.empty((16, 2), dtype=np.float64)
+        self._count = 0
+        if points is not None and len(points):
+            points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+            self._points = points.copy()
+            self._count = len(points)
+            path = QtGui.QPainterPath()
+            path.addPolygon(snapping.to_polygon(points))
+            self.setPath(path)
+
+    @classmethod
+    def from_path(cls, path: QtGui.QPainterPath) -> typing.Optional['PolylineItem']:
+        """
+        :return: polyline of a path made of one move followed by lines only, None for any other path
+        """
+        count = path.elementCount()
+        if count == 0 or not path.elementAt(0).isMoveTo():
+            return None
+        points = np.empty((count, 2), dtype=np.float64)
+        for index in range(count):
+            element = path.elementAt(index)
+            if index and not element.isLineTo():
+                return None
+            points[index] = element.x, element.y
+        item = cls(points)
+        item.setPath(path)  # keeps the fill rule
+        return item
+
+    def __len__(self):
+        return self._count
+
+    def points(self) -> np.ndarray:
+        """
+        :return: vertices in item coordinates (a view, do not modify)
+        """
+        return self._points[:self._count]
+
+    def polyline(self) -> np.ndarray:
+        """
+        :return: outline used for hit testing, the vertices themselves
+        """
+        return self.points()
+
+    def last_point(self) -> typing.Optional[QtCore.QPointF]:
+        if not self._count:
+            return None
+        return QtCore.QPointF(*self._points[self._count - 1])
+
+    def append(self, point: QtCore.QPointF):
+        """
+        add a vertex at the end of the polyline
+        """
+        if self._count == len(self._points):
+            self._points = np.concatenate((self._points, np.empty_like(self._points)))
+        self._points[self._count] = point.x(), point.y()
+        self._count += 1
+        path = self.path()
+        if self._count == 1:
+            path.moveTo(point)
+        else:
+            path.lineTo(point)
+        self.setPath(path)
+
+
+def catmull_rom_controls(points: np.ndarray, spans: np.ndarray = None) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    bezier control points of the uniform Catmull-Rom spline through the points, the end points are repeated for the
+    end tangents
+    :param points: (n, 2) array, n >= 2
+    :param spans: indices of the segments to compute, all by default
+    :return: first and second control point of every segment, (spans, 2) arrays, segment i runs from points[i] to
+             points[i + 1]
+    """
+    if spans is None:
+        spans = np.arange(len(points) - 1)
+    before = np.maximum(spans - 1, 0)
+    after = np.minimum(spans + 2, len(points) - 1)
+    first = points[spans] + (points[spans + 1] - points[before]) / 6
+    second = points[spans + 1] - (points[after] - points[spans]) / 6
+    return first, second
+
+
+def cubic_to(path: QtGui.QPainterPath, x1: float, y1: float, x2: float, y2: float, x: float, y: float):
+    """
+    `QPainterPath.cubicTo` that always adds the three elements of the segment, Qt drops segments that stay at the
+    current point, which would shift the elements of all following segments
+    """
+    count = path.elementCount()
+    path.cubicTo(x1, y1, x2, y2, x, y)
+    if path.elementCount() == count:
+        path.cubicTo(x + 1, y, x + 1, y, x + 1, y)
+        path.setElementPositionAt(count, x1, y1)
+        path.setElementPositionAt(count + 1, x2, y2)
+        path.setElementPositionAt(count + 2, x, y)
+
+
+def catmull_rom_path(points: np.ndarray) -> QtGui.QPainterPath:
+    """
+    :return: path of cubic segments through all points (straight for two points)
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    path = QtGui.QPainterPath()
+    if not len(points):
+        return path
+    path.moveTo(*points[0])
+    if len(points) == 1:
+        return path
+    first, second = catmull_rom_controls(points)
+    for segment in np.hstack((first, second, points[1:])).tolist():
+        cubic_to(path, *segment)
+    return path
+
+
+def catmull_rom_knots(path: QtGui.QPainterPath, tolerance: float = 1e-6) -> typing.Optional[np.ndarray]:
+    """
+    :return: knots of a path made by `catmull_rom_path` (one move followed by cubic segments whose control points
+             are those of the spline through the segment ends), None for any other path
+    """
+    count = path.elementCount()
+    if count < 4 or count % 3 != 1 or not path.elementAt(0).isMoveTo():
+        return None
+    elements = np.empty((count, 2), dtype=np.float64)
+    for index in range(count):
+        element = path.elementAt(index)
+        if index and element.type != (QtGui.QPainterPath.CurveToElement if index % 3 == 1 else
+                                       QtGui.QPainterPath.CurveToDataElement):
+            return None
+        elements[index] = element.x, element.y
+    return knots_of_elements(elements, tolerance)
+
+
+def knots_of_elements(elements: np.ndarray, tolerance: float = 1e-6) -> typing.Optional[np.ndarray]:
+    """
+    same as `catmull_rom_knots`, from the (move + 3 * spans, 2) element points of a path of cubic segments
+    """
+    knots = elements[::3]
+    first, second = catmull_rom_controls(knots)
+    scale = max(1.0, float(np.abs(knots).max()))
+    if np.abs(first - elements[1::3]).max() > tolerance * scale or \
+            np.abs(second - elements[2::3]).max() > tolerance * scale:
+        return None
+    return knots.copy()
+
+
+SPAN_SAMPLES = 16  # points per span of the flattened spline
+KNOT_HANDLE_SIZE = 6  # px
+KNOT_HANDLE_COLOR = QtGui.QColor("#2073e8")
+_SAMPLE_T = np.linspace(0.0, 1.0, SPAN_SAMPLES + 1)[1:]
+_BERNSTEIN = np.stack(((1 - _SAMPLE_T) ** 3, 3 * _SAMPLE_T * (1 - _SAMPLE_T) ** 2, 3 * _SAMPLE_T ** 2 * (1 - _SAMPLE_T),
+                       _SAMPLE_T ** 3), axis=1)  # (samples, 4) weights of start, controls and end of a span
+
+
+class SplineItem(QtWidgets.QGraphicsPathItem):
+    """
+    Catmull-Rom spline through any number of knots, drawn as one path of cubic segments (spans).
+
+    The knots, the bezier control points of every span and the flattened spans (used for hit testing) are kept in
+    arrays. A span only depends on the four knots around it, so moving a knot recomputes the (at most) four spans
+    around it, vectorized, and writes their elements into the path in place. The rest of the spline is not
+    touched, which keeps editing a spline of thousands of knots interactive.
+    """
+
+    def __init__(self, knots: np.ndarray, parent: QtWidgets.QGraphicsItem = None):
+        """
+        :param knots: (n, 2) array, n >= 2
+        """
+        super().__init__(parent)
+        self._knots = np.array(knots, dtype=np.float64).reshape(-1, 2)
+        self._first, self._second = catmull_rom_controls(self._knots)
+        self._flat: typing.Union[None, np.ndarray] = None  # (spans, SPAN_SAMPLES, 2), computed on demand
+        self._show_knots = False
+        self._rebuild_path()
+
+    @classmethod
+    def from_path(cls, path: QtGui.QPainterPath) -> typing.Optional['SplineItem']:
+        knots = catmull_rom_knots(path)
+        if knots is None:
+            return None
+        item = cls(knots)
+        item.setPath(path)  # keeps the fill rule
+        return item
+
+    def __len__(self):
+        return len(self._knots)
+
+    def knots(self) -> np.ndarray:
+        """
+        :return: knots in item coordinates (a view, do not modify)
+        """
+        return self._knots
+
+    def knot(self, index: int) -> QtCore.QPointF:
+        return QtCore.QPointF(*self._knots[index])
+
+    # ------ geometry ------
+    def _rebuild_path(self):
+        path = QtGui.QPainterPath()
+        path.setFillRule(self.path().fillRule())
+        path.moveTo(*self._knots[0])
+        for segment in np.hstack((self._first, self._second, self._knots[1:])).tolist():
+            cubic_to(path, *segment)
+        self.setPath(path)
+        self._flat = None
+
+    def _refresh_spans(self, first_span: int, last_span: int):
+        """
+        recompute the spans first_span..last_span and write them into the path
+        """
+        spans = np.arange(max(0, first_span), min(len(self._knots) - 2, last_span) + 1)
+        if not len(spans):
+            return
+        first, second = catmull_rom_controls(self._knots, spans)
+        self._first[spans] = first
+        self._second[spans] = second
+        path = self.path()
+        if spans[0] == 0:
+            path.setElementPositionAt(0, *self._knots[0])
+        for span, (x1, y1, x2, y2, x, y) in zip(spans.tolist(),
+                                                 np.hstack((first, second, self._knots[spans + 1])).tolist()):
+            element = 3 * span
+            path.setElementPositionAt(element + 1, x1, y1)
+            path.setElementPositionAt(element + 2, x2, y2)
+            path.setElementPositionAt(element + 3, x, y)
+        self.setPath(path)
+        if self._flat is not None:
+            self._flat[spans] = self._flatten(spans)
+
+    def move_knot(self, index: int, pos: QtCore.QPointF):
+        self._knots[index] = pos.x(), pos.y()
+        self._refresh_spans(index - 2, index + 1)  # the spans whose four knots include this one
+
+    def append_knot(self, pos: QtCore.QPointF):
+        self._knots = np.concatenate((self._knots, [(pos.x(), pos.y())]))
+        spans = len(self._knots) - 1
+        self._first = np.concatenate((self._first, np.empty((1, 2))))
+        self._second = np.concatenate((self._second, np.empty((1, 2))))
+        if self._flat is not None:
+            self._flat = np.concatenate((self._flat, np.empty((1, SPAN_SAMPLES, 2))))
+        path = self.path()
+        cubic_to(path, pos.x(), pos.y(), pos.x(), pos.y(), pos.x(), pos.y())  # placeholder elements of the new span
+        self.setPath(path)
+        self._refresh_spans(spans - 2, spans - 1)
+
+    def remove_last_knot(self):
+        """
+        drop the last knot (the spline keeps at least two)
+        """
+        if len(self._knots) <= 2:
+            return
+        self._knots = self._knots[:-1].copy()
+        self._first, self._second = self._first[:-1].copy(), self._second[:-1].copy()
+        self._first[-1:], self._second[-1:] = catmull_rom_controls(self._knots, np.array([len(self._knots) - 2]))
+        self._rebuild_path()
+
+    def _flatten(self, spans: np.ndarray) -> np.ndarray:
+        controls = np.stack((self._knots[spans], self._first[spans], self._second[spans], self._knots[spans + 1]),
+                            axis=1)  # (spans, 4, 2)
+        return np.einsum("sk,jkd->jsd", _BERNSTEIN, controls)
+
+    def polyline(self) -> np.ndarray:
+        """
+        :return: the spline flattened to SPAN_SAMPLES points per span, in item coordinates
+        """
+        if self._flat is None:
+            self._flat = self._flatten(np.arange(len(self._knots) - 1))
+        return np.concatenate((self._knots[:1], self._flat.reshape(-1, 2)))
+
+    def knot_at(self, pos: QtCore.QPointF, radius: float, count: int = None) -> typing.Optional[int]:
+        """
+        :param pos: item coordinates
+        :param count: only look at the first count knots
+        :return: index of the knot closest to pos within radius, None if there is none
+        """
+        knots = self._knots[:count]
+        if not len(knots):
+            return None
+        distances = np.hypot(knots[:, 0] - pos.x(), knots[:, 1] - pos.y())
+        index = int(np.argmin(distances))
+        return index if distances[index] <= radius else None
+
+    # ------ knot handles ------
+    @property
+    def show_knots(self) -> bool:
+        return self._show_knots
+
+    @show_knots.setter
+    def show_knots(self, show: bool):
+        if show != self._show_knots:
+            self.prepareGeometryChange()
+            self._show_knots = show
+
+    def boundingRect(self) -> QtCore.QRectF:
+        rect = super().boundingRect()
+        if self._show_knots:
+            rect.adjust(-KNOT_HANDLE_SIZE, -KNOT_HANDLE_SIZE, KNOT_HANDLE_SIZE, KNOT_HANDLE_SIZE)
+        return rect
+
+    def paint(self, painter: QtGui.QPainter, option: 'QtWidgets.QStyleOptionGraphicsItem',
+              widget: typing.Optional[QtWidgets.QWidget] = ...) -> None:
+        super().paint(painter, option, widget)
+        if self._show_knots:
+            painter.save()
+            pen = QtGui.QPen(KNOT_HANDLE_COLOR, KNOT_HANDLE_SIZE)
+            pen.setCosmetic(True)
+            painter.setPen(pen)
+            painter.drawPoints(snapping.to_polygon(self._knots))
+            painter.restore()
+
@@ -0,0 +1,118 @@
+"""
+Grid snapping and coordinate transforms on whole point sets.
+
+Points are handled as float64 NumPy arrays of shape (n, 2), so a polyline, the points of imported svg geometry or
+the positions of several moved items are snapped or transformed with one vectorized call instead of one Python
+call per coordinate. `QPolygonF` shares its memory with such an array (`polygon_points`), which lets a polygon be
+snapped in place without copying its points through Python objects.
+
+Every snap uses the same rounding rule: to the nearest multiple of the grid size, halves towards +inf.
+"""
+import typing
+
+import numpy as np
+from PyQt5 import QtCore, QtGui
+
+Points = typing.Union[np.ndarray, typing.Sequence[QtCore.QPointF], QtGui.QPolygonF]
+
+
+def snap(values, grid_size: float, out: np.ndarray = None) -> np.ndarray:
+    """
+    snap coordinates to the grid
+    :param values: array (any shape) or sequence of coordinates
+    :param out: array to write the result into, may be `values` itself to snap in place
+    :return: snapped coordinates as a float64 array
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.divide(values, grid_size, out=out)
+    out += 0.5
+    np.floor(out, out=out)
+    out *= grid_size
+    return out
+
+
+def snap_value(value: float, grid_size: float) -> float:
+    return float(np.floor(value / grid_size + 0.5) * grid_size)
+
+
+def snap_point(point: QtCore.QPointF, grid_size: float) -> QtCore.QPointF:
+    return QtCore.QPointF(snap_value(point.x(), grid_size), snap_value(point.y(), grid_size))
+
+
+def snapped_delta(start: QtCore.QPointF, end: QtCore.QPointF, grid_size: float) -> QtCore.QPointF:
+    """
+    offset between the grid points closest to `start` and `end`, moving by it keeps an item on the grid steps and
+    the deltas of consecutive moves add up to the delta of the whole move
+    """
+    return snap_point(end, grid_size) - snap_point(start, grid_size)
+
+
+def polygon_points(polygon: QtGui.QPolygonF) -> np.ndarray:
+    """
+    :return: (n, 2) array sharing the memory of the polygon, writes go to the polygon, only valid while the
+             polygon is alive and not resized
+    """
+    if polygon.isEmpty():
+        return np.empty((0, 2), dtype=np.float64)
+    data = polygon.data()
+    data.setsize(polygon.size() * 2 * np.dtype(np.float64).itemsize)
+    return np.frombuffer(data, dtype=np.float64).reshape(-1, 2)
+
+
+def to_array(points: Points) -> np.ndarray:
+    """
+    :return: (n, 2) float64 array of the points (a copy for polygons and point sequences)
+    """
+    if isinstance(points, QtGui.QPolygonF):
+        return polygon_points(points).copy()
+    if isinstance(points, np.ndarray):
+        return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return np.array([(point.x(), point.y()) for point in points], dtype=np.float64).reshape(-1, 2)
+
+
+def to_polygon(points: np.ndarray) -> QtGui.QPolygonF:
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    polygon = QtGui.QPolygonF(len(points))
+    polygon_points(polygon)[:] = points
+    return polygon
+
+
+def to_qpoints(points: np.ndarray) -> typing.List[QtCore.QPointF]:
+    return [QtCore.QPointF(x, y) for x, y in np.asarray(points, dtype=np.float64).reshape(-1, 2).tolist()]
+
+
+def snap_points(points: Points, grid_size: float) -> np.ndarray:
+    """
+    :return: (n, 2) array of the snapped points
+    """
+    points = to_array(points)
+    return snap(points, grid_size, out=points)
+
+
+def snap_polygon(polygon: QtGui.QPolygonF, grid_size: float) -> QtGui.QPolygonF:
+    """
+    snap the points of a polygon in place
+    """
+    points = polygon_points(polygon)
+    snap(points, grid_size, out=points)
+    return polygon
+
+
+def map_points(transform: QtGui.QTransform, points: Points) -> np.ndarray:
+    """
+    same as `QTransform.map` for every point, perspective transforms included
+    :return: (n, 2) array of the mapped points
+    """
+    points = to_array(points)
+    matrix = np.array([[transform.m11(), transform.m12()],
+                       [transform.m21(), transform.m22()]])
+    mapped = points @ matrix
+    mapped += (transform.dx(), transform.dy())
+    if transform.type() == QtGui.QTransform.TxProject:
+        w = points @ np.array([transform.m13(), transform.m23()]) + transform.m33()
+        mapped /= w[:, np.newaxis]
+    return mapped
+
+
+def map_polygon(transform: QtGui.QTransform, polygon: QtGui.QPolygonF) -> QtGui.QPolygonF:
+    return to_polygon(map_points(transform, polygon))
@@ -0,0 +1,253 @@
+import itertools
+import math
+import typing
+
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from UI import shapes, snapping
+
+MAX_ITEM_CELLS = 4096  # items covering more cells are kept in a flat list and tested by their bounding rect
+
+
+class SelectionIndex:
+    """
+    Uniform grid over the scene bounding rects of the document items, used for picking (right click selection,
+    hover cursor) instead of `QGraphicsScene.itemAt`.
+
+    Lines are only entered into the cells their segment crosses, so long diagonal lines do not fill up their
+    whole bounding rect, and are tested by their distance to the pick point. Polylines (and splines, flattened) are
+    handled the same way, segment by segment, with the distances to all of their segments computed at once. A query
+    collects the few items of the cells around the point, and only those get the exact test.
+
+    Helper items (selection rect, drawing preview) are never inserted, so they can not be picked.
+    """
+
+    def __init__(self, cell_size: float = 64.0):
+        self.cell_size = cell_size
+        self._cells: typing.Dict[typing.Tuple[int, int], typing.Set[QtWidgets.QGraphicsItem]] = {}
+        self._item_cells: typing.Dict[QtWidgets.QGraphicsItem, typing.List[typing.Tuple[int, int]]] = {}
+        self._large: typing.Set[QtWidgets.QGraphicsItem] = set()
+        # line items: scene segment and half pen width
+        self._segments: typing.Dict[QtWidgets.QGraphicsItem, typing.Tuple[float, float, float, float, float]] = {}
+        # polyline items: segment starts, segment vectors, their inverse squared lengths and half pen width
+        self._polylines: typing.Dict[QtWidgets.QGraphicsItem,
+                                     typing.Tuple[np.ndarray, np.ndarray, np.ndarray, float]] = {}
+        self._order: typing.Dict[QtWidgets.QGraphicsItem, int] = {}  # insertion order, later items are on top
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, item: QtWidgets.QGraphicsItem):
+        return item in self._order
+
+    # ------ cells ------
+    def _cell_range(self, x1: float, y1: float, x2: float, y2: float) -> typing.Iterator[typing.Tuple[int, int]]:
+        size = self.cell_size
+        for cx in range(math.floor(x1 / size), math.floor(x2 / size) + 1):
+            for cy in range(math.floor(y1 / size), math.floor(y2 / size) + 1):
+                yield cx, cy
+
+    def _rect_cell_count(self, rect: QtCore.QRectF) -> int:
+        size = self.cell_size
+        return ((math.floor(rect.right() / size) - math.floor(rect.left() / size) + 1) *
+                (math.floor(rect.bottom() / size) - math.floor(rect.top() / size) + 1))
+
+    def _segment_cells(self, line: QtCore.QLineF, pad: float) -> typing.List[typing.Tuple[int, int]]:
+        """
+        cells crossed by a line segment grown by pad, column by column
+        """
+        size = self.cell_size
+        x1, y1, x2, y2 = line.x1(), line.y1(), line.x2(), line.y2()
+        if x1 > x2:
+            x1, y1, x2, y2 = x2, y2, x1, y1
+        slope = (y2 - y1) / (x2 - x1) if x2 != x1 else 0.0
+        cells = []
+        for cx in range(int((x1 - pad) // size), int((x2 + pad) // size) + 1):
+            # part of the segment inside the (padded) column
+            xa = cx * size - pad
+            xb = xa + size + 2 * pad
+            xa = x1 if xa < x1 else xa
+            xb = x2 if xb > x2 else xb
+            ya = y1 + (xa - x1) * slope
+            yb = y1 + (xb - x1) * slope if x2 != x1 else y2
+            if ya > yb:
+                ya, yb = yb, ya
+            cells.extend(zip(itertools.repeat(cx), range(int((ya - pad) // size), int((yb + pad) // size) + 1)))
+        return cells
+
+    def _cells_for(self, item: QtWidgets.QGraphicsItem) -> typing.Union[None, typing.List[typing.Tuple[int, int]]]:
+        """
+        :return: cells the item covers, None if it is too large for the grid
+        """
+        if isinstance(item, QtWidgets.QGraphicsLineItem):
+            line = item.sceneTransform().map(item.line())
+            half_width = item.pen().widthF() / 2
+            self._segments[item] = (line.x1(), line.y1(), line.x2(), line.y2(), half_width)
+            return self._segment_cells(line, half_width)
+        if isinstance(item, (shapes.PolylineItem, shapes.SplineItem)) and len(item):
+            points = snapping.map_points(item.sceneTransform(), item.polyline())
+            half_width = item.pen().widthF() / 2
+            starts = points[:-1] if len(points) > 1 else points
+            deltas = np.diff(points, axis=0) if len(points) > 1 else np.zeros_like(points)
+            length_sq = np.einsum("ij,ij->i", deltas, deltas)
+            inverse_length_sq = np.divide(1.0, length_sq, out=np.zeros_like(length_sq), where=length_sq > 0)
+            self._polylines[item] = (starts, deltas, inverse_length_sq, half_width)
+            if len(points) == 1:
+                return self._segment_cells(QtCore.QLineF(*points[0], *points[0]), half_width)
+            cells = set()
+            for x1, y1, x2, y2 in np.hstack((points[:-1], points[1:])).tolist():
+                cells.update(self._segment_cells(QtCore.QLineF(x1, y1, x2, y2), half_width))
+            return list(cells)
+        rect = item.sceneBoundingRect()
+        if self._rect_cell_count(rect) > MAX_ITEM_CELLS:
+            return None
+        return list(self._cell_range(rect.left(), rect.top(), rect.right(), rect.bottom()))
+
+    # ------ updates ------
+    def insert(self, item: QtWidgets.QGraphicsItem):
+        if item in self._order:
+            self.update(item)
+            return
+        self._order[item] = next(self._counter)
+        self._add_cells(item)
+
+    def insert_many(self, items: typing.Iterable[QtWidgets.QGraphicsItem]):
+        for item in items:
+            self.insert(item)
+
+    def _add_cells(self, item: QtWidgets.QGraphicsItem):
+        cells = self._cells_for(item)
+        if cells is None:
+            self._large.add(item)
+            return
+        self._item_cells[item] = cells
+        grid = self._cells
+        for cell in cells:
+            bucket = grid.get(cell)
+            if bucket is None:
+                grid[cell] = {item}
+            else:
+                bucket.add(item)
+
+    def _remove_cells(self, item: QtWidgets.QGraphicsItem):
+        self._large.discard(item)
+        self._segments.pop(item, None)
+        self._polylines.pop(item, None)
+        for cell in self._item_cells.pop(item, ()):
+            bucket = self._cells.get(cell)
+            if bucket is not None:
+                bucket.discard(item)
+                if not bucket:
+                    del self._cells[cell]
+
+    def update(self, item: QtWidgets.QGraphicsItem):
+        """
+        call after an item got moved or transformed
+        """
+        if item in self._order:
+            self._remove_cells(item)
+            self._add_cells(item)
+
+    def remove(self, item: QtWidgets.QGraphicsItem):
+        if self._order.pop(item, None) is not None:
+            self._remove_cells(item)
+
+    def replace(self, old: QtWidgets.QGraphicsItem, item: QtWidgets.QGraphicsItem):
+        """
+        enter an item in place of another one, at the same place in the stacking order
+        """
+        order = self._order.pop(old, None)
+        if order is None:
+            self.insert(item)
+            return
+        self._remove_cells(old)
+        self._order[item] = order
+        self._add_cells(item)
+
+    def clear(self):
+        self._cells.clear()
+        self._item_cells.clear()
+        self._large.clear()
+        self._segments.clear()
+        self._polylines.clear()
+        self._order.clear()
+
+    # ------ queries ------
+    def candidates(self, pos: QtCore.QPointF, radius: float) -> typing.Set[QtWidgets.QGraphicsItem]:
+        """
+        :return: items entered in the cells within radius of pos (no exact test)
+        """
+        x, y = pos.x(), pos.y()
+        found = set(self._large)
+        for cell in self._cell_range(x - radius, y - radius, x + radius, y + radius):
+            bucket = self._cells.get(cell)
+            if bucket:
+                found.update(bucket)
+        return found
+
+    @staticmethod
+    def _segment_hit(segment: typing.Tuple[float, float, float, float, float], x: float, y: float,
+                     radius: float) -> bool:
+        x1, y1, x2, y2, half_width = segment
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+        t = 0.0 if length_sq == 0 else min(1.0, max(0.0, ((x - x1) * dx + (y - y1) * dy) / length_sq))
+        px, py = x1 + t * dx - x, y1 + t * dy - y
+        reach = half_width + radius
+        return px * px + py * py <= reach * reach
+
+    @staticmethod
+    def _polyline_hit(polyline: typing.Tuple[np.ndarray, np.ndarray, np.ndarray, float], x: float, y: float,
+                      radius: float) -> bool:
+        starts, deltas, inverse_length_sq, half_width = polyline
+        offsets = np.array((x, y)) - starts
+        t = np.einsum("ij,ij->i", offsets, deltas)
+        t *= inverse_length_sq
+        np.clip(t, 0.0, 1.0, out=t)
+        distance = offsets - deltas * t[:, np.newaxis]
+        reach = half_width + radius
+        return bool(np.einsum("ij,ij->i", distance, distance).min() <= reach * reach)
+
+    def item_at(self, pos: QtCore.QPointF, radius: float = 0.0,
+                scene: QtWidgets.QGraphicsScene = None) -> typing.Union[None, QtWidgets.QGraphicsItem]:
+        """
+        topmost item whose shape comes within radius of pos
+        :param pos: scene position
+        :param radius: pick tolerance in scene units
+        :param scene: when given, items that are no longer part of this scene are dropped from the index
+        """
+        x, y = pos.x(), pos.y()
+        pick = None
+        best, best_key = None, None
+        for item in self.candidates(pos, radius):
+            key = (item.zValue(), self._order[item])
+            if best_key is not None and key < best_key:
+                continue  # only the topmost hit matters
+            segment = self._segments.get(item)
+            polyline = self._polylines.get(item) if segment is None else None
+            if segment is not None:
+                if not self._segment_hit(segment, x, y, radius):
+                    continue
+            elif polyline is not None:
+                if not self._polyline_hit(polyline, x, y, radius):
+                    continue
+            else:
+                if not item.sceneBoundingRect().adjusted(-radius, -radius, radius, radius).contains(pos):
+                    continue
+                if pick is None:
+                    pick = QtGui.QPainterPath()
+                    if radius > 0:
+                        pick.addEllipse(pos, radius, radius)
+                    else:
+                        pick.addRect(QtCore.QRectF(pos, QtCore.QSizeF(1e-3, 1e-3)))
+                if not item.collidesWithPath(item.mapFromScene(pick)):
+                    continue
+            if not item.isVisible():
+                continue
+            if scene is not None and item.scene() is not scene:
+                self.remove(item)
+                continue
+            best, best_key = item, key
+        return best
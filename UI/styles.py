@@ -0,0 +1,59 @@
+import typing
+from collections import OrderedDict
+
+from PyQt5 import QtGui
+from PyQt5.QtCore import Qt
+
+ColorLike = typing.Union[QtGui.QColor, Qt.GlobalColor, str]
+
+
+class StyleCache:
+    """
+    Bounded flyweight cache of QPen/QBrush objects.
+
+    Items drawn with the same style share one pen object (Qt pens are implicitly shared, so items keep a cheap
+    reference to the same data). Returned pens and brushes are shared: do not modify them, copy them first.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._pens: typing.OrderedDict[tuple, QtGui.QPen] = OrderedDict()
+        self._brushes: typing.OrderedDict[tuple, QtGui.QBrush] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, cache: OrderedDict, key: tuple, factory: typing.Callable):
+        value = cache.get(key)
+        if value is not None:
+            self.hits += 1
+            cache.move_to_end(key)
+            return value
+        self.misses += 1
+        value = cache[key] = factory()
+        if len(cache) > self.max_size:
+            cache.popitem(last=False)  # least recently used
+        return value
+
+    def pen(self, color: ColorLike, width: float = 1, style: Qt.PenStyle = Qt.SolidLine,
+            cap: Qt.PenCapStyle = Qt.SquareCap, join: Qt.PenJoinStyle = Qt.BevelJoin) -> QtGui.QPen:
+        color = QtGui.QColor(color)
+        key = (color.rgba(), float(width), int(style), int(cap), int(join))
+        return self._lookup(self._pens, key, lambda: QtGui.QPen(QtGui.QBrush(color), width, style, cap, join))
+
+    def brush(self, color: ColorLike, style: Qt.BrushStyle = Qt.SolidPattern) -> QtGui.QBrush:
+        color = QtGui.QColor(color)
+        key = (color.rgba(), int(style))
+        return self._lookup(self._brushes, key, lambda: QtGui.QBrush(color, style))
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "pens": len(self._pens), "brushes": len(self._brushes)}
+
+    def clear(self):
+        self._pens.clear()
+        self._brushes.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# shared by the whole application
+style_cache = StyleCache()
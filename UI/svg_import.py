@@ -0,0 +1,251 @@
+import os
+import typing
+
+from PyQt5 import QtCore, QtGui
+from svgelements import (SVG, Arc, Circle, Close, CubicBezier, Ellipse, Line, Move, Path, Point, Polygon, Polyline,
+                         QuadraticBezier, Rect, SimpleLine, Text)
+
+from UI.tracing import tracer, traced
+
+
+class ImportCancelled(Exception):
+    pass
+
+
+class _ProgressReader:
+    """
+    File wrapper handed to the SVG parser, reports how far into the file the parser is and aborts on cancel.
+
+    It also counts the start tags it hands out, an estimate of the number of elements that sizes the progress
+    of the element pass (counting `svg.elements()` would walk the whole document a second time).
+    """
+
+    def __init__(self, file_name: str, on_read: typing.Callable[[int], None], is_cancelled: typing.Callable[[], bool]):
+        self._file = open(file_name, "rb")
+        self._on_read = on_read
+        self._is_cancelled = is_cancelled
+        self.start_tags = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if self._is_cancelled():
+            raise ImportCancelled()
+        data = self._file.read(size)
+        self.start_tags += data.count(b"<") - data.count(b"</")
+        self._on_read(self._file.tell())
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def stroke_style(element) -> typing.Tuple[str, float]:
+    """
+    :return: stroke color and stroke width of an svg element
+    """
+    stroke = element.stroke
+    color = stroke.hex if stroke is not None and stroke.value is not None else "#000000"
+    width = element.stroke_width if element.stroke_width is not None else 1.0
+    return color, width
+
+
+def fill_color(element) -> str:
+    """
+    :return: fill color of an svg element, the stroke color when it is not filled (e.g. outlined text)
+    """
+    fill = element.fill
+    if fill is not None and fill.value is not None:
+        return fill.hex
+    return stroke_style(element)[0]
+
+
+def _move(path: QtGui.QPainterPath, segment: Move):
+    path.moveTo(segment.end.x, segment.end.y)
+
+
+def _line(path: QtGui.QPainterPath, segment: Line):
+    path.lineTo(segment.end.x, segment.end.y)
+
+
+def _close(path: QtGui.QPainterPath, segment: Close):
+    path.closeSubpath()
+
+
+def _quad(path: QtGui.QPainterPath, segment: QuadraticBezier):
+    path.quadTo(segment.control.x, segment.control.y, segment.end.x, segment.end.y)
+
+
+def _cubic(path: QtGui.QPainterPath, segment: CubicBezier):
+    path.cubicTo(segment.control1.x, segment.control1.y, segment.control2.x, segment.control2.y,
+                 segment.end.x, segment.end.y)
+
+
+def _arc(path: QtGui.QPainterPath, segment: Arc):
+    for cubic in segment.as_cubic_curves():
+        _cubic(path, cubic)
+
+
+_SEGMENT_WRITERS = {
+    Move: _move,
+    Line: _line,
+    Close: _close,
+    QuadraticBezier: _quad,
+    CubicBezier: _cubic,
+    Arc: _arc,
+}
+
+
+def path_to_painter_path(element: Path) -> QtGui.QPainterPath:
+    """
+    convert a whole svg path (every sub-path and segment type) into a single QPainterPath
+
+    The svg is parsed with `reify`, so the element transform is already applied to the segment coordinates
+    and nothing has to be transformed here.
+    """
+    path = QtGui.QPainterPath()
+    for segment in element:
+        writer = _SEGMENT_WRITERS.get(type(segment))
+        if writer is not None:
+            writer(path, segment)
+    return path
+
+
+def points_to_painter_path(points, closed: bool = False) -> QtGui.QPainterPath:
+    path = QtGui.QPainterPath()
+    path.moveTo(points[0].x, points[0].y)
+    for point in points[1:]:
+        path.lineTo(point.x, point.y)
+    if closed:
+        path.closeSubpath()
+    return path
+
+
+class SvgChunk(typing.NamedTuple):
+    """
+    Primitives ready to be handed to `MainWindow.draw_svg`
+    """
+    lines: list
+    circles: list
+    rects: list
+    texts: list
+    curves: list
+
+    def __len__(self):
+        return len(self.lines) + len(self.circles) + len(self.rects) + len(self.texts) + len(self.curves)
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [], [])
+
+
+class SvgImportWorker(QtCore.QObject):
+    """
+    Parses an svg file in a worker thread and hands the primitives to the GUI thread in chunks.
+
+    Element types are detected from the svgelements classes. At most `max_pending_chunks` chunks are in flight,
+    the GUI thread has to call `chunk_consumed()` after every chunk it processed, so the importer never runs
+    ahead of the scene and memory stays bounded by the chunk size.
+    """
+    chunk_ready = QtCore.pyqtSignal(object)
+    progress = QtCore.pyqtSignal(int)  # percentage
+    status = QtCore.pyqtSignal(str)
+    finished = QtCore.pyqtSignal(bool)  # False when cancelled or failed
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, file_name: str, chunk_size: int = 2000, max_pending_chunks: int = 2):
+        super().__init__()
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        self._cancelled = False
+        self._free_slots = QtCore.QSemaphore(max_pending_chunks)
+        self._file_size = max(1, os.path.getsize(file_name))
+        self._last_progress = -1
+
+    def cancel(self):
+        self._cancelled = True
+        self._free_slots.release()  # wake up the worker if it waits for the GUI
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled
+
+    def chunk_consumed(self):
+        self._free_slots.release()
+
+    def _report_progress(self, value: int):
+        if value != self._last_progress:
+            self._last_progress = value
+            self.progress.emit(value)
+
+    def _emit_chunk(self, chunk: SvgChunk):
+        while not self._free_slots.tryAcquire(1, 100):
+            if self._cancelled:
+                break
+        if self._cancelled:
+            raise ImportCancelled()
+        self.chunk_ready.emit(chunk)
+
+    @QtCore.pyqtSlot()
+    @traced("svg_import")
+    def run(self):
+        try:
+            self.status.emit("Parsing SVG...")
+            reader = _ProgressReader(self.file_name,
+                                     lambda read: self._report_progress(50 * read // self._file_size),
+                                     self.is_cancelled)
+            try:
+                with tracer.span("svg_parse", file=self.file_name):
+                    svg = SVG.parse(reader)
+            finally:
+                reader.close()
+
+            self.status.emit("Importing SVG elements...")
+            total = max(1, reader.start_tags)
+            chunk = SvgChunk.empty()
+            for index, element in enumerate(svg.elements()):
+                if self._cancelled:
+                    raise ImportCancelled()
+                self.add_element(chunk, element)
+                if len(chunk) >= self.chunk_size:
+                    self._emit_chunk(chunk)
+                    chunk = SvgChunk.empty()
+                    self._report_progress(min(99, 50 + 50 * index // total))  # total is an estimate
+            if len(chunk):
+                self._emit_chunk(chunk)
+            self._report_progress(100)
+        except ImportCancelled:
+            self.finished.emit(False)
+            return
+        except Exception as e:
+            self.failed.emit(str(e))
+            self.finished.emit(False)
+            return
+        self.finished.emit(True)
+
+    @staticmethod
+    def add_element(chunk: SvgChunk, element):
+        if isinstance(element, (Polyline, Polygon)):
+            points = element.points
+            if len(points) == 2 and isinstance(element, Polyline):
+                color, pen_size = stroke_style(element)
+                chunk.lines.append([points[0].x, points[0].y, points[1].x, points[1].y, color, pen_size])
+            elif len(points) >= 2:
+                color, pen_size = stroke_style(element)
+                chunk.curves.append([points_to_painter_path(points, isinstance(element, Polygon)), color, pen_size])
+        elif isinstance(element, SimpleLine):
+            color, pen_size = stroke_style(element)
+            chunk.lines.append([element.x1, element.y1, element.x2, element.y2, color, pen_size])
+        elif isinstance(element, (Circle, Ellipse)):
+            color, pen_size = stroke_style(element)
+            chunk.circles.append([element.cx, element.cy, element.implicit_r, color, pen_size])
+        elif isinstance(element, Rect):
+            if element.values.get("x") is None:
+                return  # background grid rect, has no position of its own
+            color, pen_size = stroke_style(element)
+            chunk.rects.append([element.x, element.y, element.width, element.height, color, pen_size])
+        elif isinstance(element, Text):
+            position = Point(element.x, element.y) * element.transform
+            chunk.texts.append([element.text, position.x, position.y, element.font_family,
+                                int(element.font_size), fill_color(element)])
+        elif isinstance(element, Path):
+            if len(element):
+                color, pen_size = stroke_style(element)
+                chunk.curves.append([path_to_painter_path(element), color, pen_size])
@@ -0,0 +1,385 @@
+"""
+Tiled, multi-resolution display of very large images.
+
+A `TilePyramid` cuts the image into `TILE_SIZE` tiles, level 0 at full resolution and every following level at
+half the resolution of the one before, down to a single tile. The pyramid is built once in the background, into
+memory or into an on-disk cache that is kept across sessions (keyed by file path, size and modification time),
+up to `DISK_CACHE_BYTES`, beyond which the pyramids of the least recently opened images are removed.
+Sources too large for `BUILD_MEMORY` are decoded in bands of rows where the image format allows it.
+
+`TiledImageItem` only draws the tiles of the exposed rect, from the level that matches the view scale. Tiles
+read from the disk cache are kept in one `TileCache` shared by all pyramids, a LRU cache with a memory cap, so
+memory depends on the viewport, not on the image.
+"""
+import collections
+import hashlib
+import itertools
+import math
+import os
+import shutil
+import struct
+import tempfile
+import typing
+
+from PyQt5 import QtCore, QtGui, QtWidgets, sip
+from PyQt5.QtCore import Qt
+
+from UI import image_loader
+from UI.tracing import tracer
+
+TILE_SIZE = 256
+TILED_IMAGE_PIXELS = 40_000_000  # larger images are shown by a `TiledImageItem`
+BUILD_MEMORY = 512 * 1024 * 1024  # decoded source data held at once while building a pyramid
+CACHE_BYTES = 256 * 1024 * 1024  # memory cap of the shared tile cache
+PREVIEW_SIZE = QtCore.QSize(2048, 2048)  # preview of tiled images that are opened from a project file
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "imageedit-tiles")
+DISK_CACHE_BYTES = 4 * 1024 * 1024 * 1024  # disk cap of CACHE_DIR, checked whenever a pyramid is completed
+
+_TILE_HEADER = struct.Struct("<III")  # width, height, QImage format
+_TILE_FORMAT = QtGui.QImage.Format_ARGB32_Premultiplied
+_COMPLETE_FILE = "complete"  # marks a finished pyramid, holds its size in bytes
+_open_directories: typing.Set[str] = set()  # pyramids of disk tile stores of this session
+
+TileKey = typing.Tuple[int, int, int]  # level, column, row
+
+
+# ------------------ tile stores ------------------
+class MemoryTileStore:
+    """
+    keeps the whole pyramid in memory (1.33 times the decoded image)
+    """
+
+    def __init__(self):
+        self._tiles: typing.Dict[TileKey, QtGui.QImage] = {}
+        self.complete = False
+
+    def put(self, key: TileKey, tile: QtGui.QImage):
+        self._tiles[key] = tile
+
+    def get(self, key: TileKey) -> typing.Optional[QtGui.QImage]:
+        return self._tiles.get(key)
+
+    def mark_complete(self):
+        self.complete = True
+
+
+class DiskTileStore:
+    """
+    one raw file per tile, in a directory per source image state
+    """
+
+    def __init__(self, source: str, cache_dir: str = CACHE_DIR):
+        stat = os.stat(source)
+        key = f"{os.path.abspath(source)}:{stat.st_size}:{stat.st_mtime_ns}:{TILE_SIZE}"
+        self.directory = os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest())
+        self.cache_dir = cache_dir
+        os.makedirs(self.directory, exist_ok=True)
+        os.utime(self.directory)  # last use, for the eviction order of `trim_disk_cache`
+        _open_directories.add(self.directory)
+        self._complete_file = os.path.join(self.directory, _COMPLETE_FILE)
+        self.complete = os.path.exists(self._complete_file)  # built in an earlier session
+        self._bytes = 0
+
+    def _file(self, key: TileKey) -> str:
+        return os.path.join(self.directory, "{}_{}_{}.tile".format(*key))
+
+    def put(self, key: TileKey, tile: QtGui.QImage):
+        tile = tile.convertToFormat(_TILE_FORMAT)
+        with open(self._file(key), "wb") as f:
+            f.write(_TILE_HEADER.pack(tile.width(), tile.height(), int(tile.format())))
+            f.write(tile.constBits().asstring(tile.sizeInBytes()))
+        self._bytes += _TILE_HEADER.size + tile.sizeInBytes()
+
+    def get(self, key: TileKey) -> typing.Optional[QtGui.QImage]:
+        try:
+            with open(self._file(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        width, height, image_format = _TILE_HEADER.unpack_from(data)
+        # copy() detaches the image from the bytes object it was constructed on
+        return QtGui.QImage(data[_TILE_HEADER.size:], width, height, 4 * width,
+                            QtGui.QImage.Format(image_format)).copy()
+
+    def mark_complete(self):
+        with open(self._complete_file, "w") as f:
+            f.write(str(self._bytes))  # size on disk, saves walking the tiles in `trim_disk_cache`
+        self.complete = True
+        trim_disk_cache(self.cache_dir, DISK_CACHE_BYTES)
+
+
+def _directory_bytes(directory: str) -> int:
+    try:
+        with open(os.path.join(directory, _COMPLETE_FILE)) as f:
+            return int(f.read())
+    except (OSError, ValueError):  # not completed
+        pass
+    size = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            size += entry.stat().st_size
+    return size
+
+
+def trim_disk_cache(cache_dir: str = CACHE_DIR, max_bytes: int = DISK_CACHE_BYTES):
+    """
+    remove whole pyramids, least recently opened first, until the cache directory fits in `max_bytes`, pyramids
+    opened in this session are kept
+    """
+    pyramids = []
+    try:
+        with os.scandir(cache_dir) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    pyramids.append((entry.stat().st_mtime_ns, _directory_bytes(entry.path), entry.path))
+    except OSError:  # the cache directory or one of the pyramids is gone, e.g. removed by another instance
+        return
+    total = sum(size for _, size, _ in pyramids)
+    for _, size, directory in sorted(pyramids):
+        if total <= max_bytes:
+            break
+        if directory not in _open_directories:
+            shutil.rmtree(directory, ignore_errors=True)
+            total -= size
+
+
+class TileCache:
+    """
+    LRU cache of decoded tiles with a memory cap, shared by all pyramids
+    """
+
+    def __init__(self, max_bytes: int = CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._tiles: typing.MutableMapping[tuple, QtGui.QImage] = collections.OrderedDict()
+        self._bytes = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: tuple) -> typing.Optional[QtGui.QImage]:
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+        return tile
+
+    def put(self, key: tuple, tile: QtGui.QImage):
+        if key in self._tiles:
+            self._bytes -= self._tiles.pop(key).sizeInBytes()
+        self._tiles[key] = tile
+        self._bytes += tile.sizeInBytes()
+        while self._bytes > self.max_bytes and len(self._tiles) > 1:
+            _, evicted = self._tiles.popitem(last=False)  # least recently used
+            self._bytes -= evicted.sizeInBytes()
+
+    def clear(self):
+        self._tiles.clear()
+        self._bytes = 0
+
+
+tile_cache = TileCache()
+_cache_ids = itertools.count()
+
+
+# ------------------ pyramid ------------------
+class _BuildSignals(QtCore.QObject):
+    finished = QtCore.pyqtSignal(str)  # error message, empty on success
+
+
+class _BuildTask(QtCore.QRunnable):
+    def __init__(self, pyramid: 'TilePyramid'):
+        super().__init__()
+        self.pyramid = pyramid
+        self.signals = pyramid.signals
+
+    def run(self):
+        try:
+            with tracer.span("tile_pyramid_build", file=self.pyramid.source):
+                self.pyramid.build()
+        except (image_loader.ImageLoadError, OSError) as e:
+            self.signals.finished.emit(str(e))
+            return
+        self.signals.finished.emit("")
+
+
+class TilePyramid:
+    """
+    Mipmap levels of an image as fixed size tiles, see the module docstring.
+    """
+
+    def __init__(self, source: str, size: QtCore.QSize, use_disk_cache: bool = True):
+        self.source = source
+        self.size = QtCore.QSize(size)
+        self.store = DiskTileStore(source) if use_disk_cache else MemoryTileStore()
+        self.levels: typing.List[typing.Tuple[int, int]] = []  # image size of every level
+        width, height = size.width(), size.height()
+        while True:
+            self.levels.append((width, height))
+            if width <= TILE_SIZE and height <= TILE_SIZE:
+                break
+            width, height = max(1, (width + 1) // 2), max(1, (height + 1) // 2)
+        self.signals = _BuildSignals()
+        self._cache_id = next(_cache_ids)
+        self._building = False
+
+    @property
+    def complete(self) -> bool:
+        return self.store.complete
+
+    def start_build(self):
+        """
+        build the pyramid in the thread pool, unless done or underway
+        """
+        if not self.complete and not self._building:
+            self._building = True
+            QtCore.QThreadPool.globalInstance().start(_BuildTask(self))
+
+    def grid(self, level: int) -> typing.Tuple[int, int]:
+        width, height = self.levels[level]
+        return math.ceil(width / TILE_SIZE), math.ceil(height / TILE_SIZE)
+
+    def level_for(self, level_of_detail: float) -> int:
+        """
+        :param level_of_detail: device pixels per image pixel
+        :return: coarsest level that still has a pixel per device pixel
+        """
+        if level_of_detail <= 0:
+            return len(self.levels) - 1
+        return max(0, min(len(self.levels) - 1, math.floor(math.log2(1 / level_of_detail))))
+
+    def tile(self, key: TileKey) -> typing.Optional[QtGui.QImage]:
+        """
+        tile through the shared cache, None when it is not built yet
+        """
+        cache_key = (self._cache_id, *key)
+        tile = tile_cache.get(cache_key)
+        if tile is None and isinstance(self.store, DiskTileStore):
+            tile = self.store.get(key)
+            if tile is not None:
+                tile_cache.put(cache_key, tile)
+        elif tile is None:
+            tile = self.store.get(key)  # memory store, nothing to cache
+        return tile
+
+    # ------ building (worker thread) ------
+    def build(self):
+        width, height = self.levels[0]
+        # a band of full width rows, as high as the memory budget allows, in whole tile rows
+        band_rows = max(1, BUILD_MEMORY // max(1, 4 * width * TILE_SIZE)) * TILE_SIZE
+        reader = QtGui.QImageReader(self.source)
+        # levels are in the exif oriented pixel grid, clip rects are in the stored one
+        banded = (band_rows < height and reader.supportsOption(QtGui.QImageIOHandler.ClipRect)
+                  and reader.transformation() == QtGui.QImageIOHandler.TransformationNone)
+        band_rows = band_rows if banded else height
+        for top in range(0, height, band_rows):
+            reader = QtGui.QImageReader(self.source)  # a reader decodes only once
+            reader.setAutoTransform(True)
+            if banded:
+                reader.setClipRect(QtCore.QRect(0, top, width, min(band_rows, height - top)))
+            band = reader.read()
+            if band.isNull():
+                raise image_loader.ImageLoadError(reader.errorString())
+            band = band.convertToFormat(_TILE_FORMAT)
+            for ty in range(top // TILE_SIZE, math.ceil(min(height, top + band_rows) / TILE_SIZE)):
+                for tx in range(math.ceil(width / TILE_SIZE)):
+                    self.store.put((0, tx, ty), band.copy(tx * TILE_SIZE, ty * TILE_SIZE - top,
+                                                          min(TILE_SIZE, width - tx * TILE_SIZE),
+                                                          min(TILE_SIZE, height - ty * TILE_SIZE)))
+            del band
+        for level in range(1, len(self.levels)):
+            self._build_level(level)
+        self.store.mark_complete()
+
+    def _build_level(self, level: int):
+        """
+        every tile is its four children of the level below at half size
+        """
+        width, height = self.levels[level]
+        half = TILE_SIZE // 2
+        columns, rows = self.grid(level)
+        for ty in range(rows):
+            for tx in range(columns):
+                tile = QtGui.QImage(min(TILE_SIZE, width - tx * TILE_SIZE), min(TILE_SIZE, height - ty * TILE_SIZE),
+                                    _TILE_FORMAT)
+                tile.fill(Qt.transparent)
+                painter = QtGui.QPainter(tile)
+                painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, True)
+                for dy in (0, 1):
+                    for dx in (0, 1):
+                        child = self.store.get((level - 1, 2 * tx + dx, 2 * ty + dy))
+                        if child is not None:
+                            painter.drawImage(QtCore.QRectF(dx * half, dy * half, child.width() / 2,
+                                                            child.height() / 2), child)
+                painter.end()
+                self.store.put((level, tx, ty), tile)
+
+
+# ------------------ item ------------------
+class TiledImageItem(image_loader.ImagePixmapItem):
+    """
+    Image item for very large images, the pixmap is a preview, drawn where tiles are still missing while the
+    pyramid gets built (started on the first paint that needs more than the preview).
+    """
+
+    def __init__(self, pixmap: QtGui.QPixmap, size: QtCore.QSizeF, source: str, use_disk_cache: bool = True):
+        super().__init__(pixmap, size, source)
+        self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption, True)  # exposedRect
+        self.pyramid = TilePyramid(source, size.toSize(), use_disk_cache)
+        self.pyramid.signals.finished.connect(self._pyramid_built)
+
+    def _pyramid_built(self, error: str):
+        if not sip.isdeleted(self):
+            self.update()
+
+    def paint(self, painter: QtGui.QPainter, option: 'QtWidgets.QStyleOptionGraphicsItem',
+              widget: typing.Optional[QtWidgets.QWidget] = ...) -> None:
+        pixmap = self.pixmap()
+        pyramid = self.pyramid
+        level_of_detail = option.levelOfDetailFromTransform(painter.worldTransform())
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, True)
+        offset = self.offset()
+        exposed = option.exposedRect.translated(-offset).intersected(QtCore.QRectF(QtCore.QPointF(), self.display_size))
+        level = pyramid.level_for(level_of_detail)
+        if (level >= len(pyramid.levels) - 1 or self.display_size.width() * level_of_detail <= pixmap.width()
+                or image_loader.proxy_editing()):
+            # the preview is good enough (or has to do), no tiles needed
+            painter.drawPixmap(self.boundingRect(), pixmap, QtCore.QRectF(pixmap.rect()))
+            return
+        if not pyramid.complete:
+            pyramid.start_build()
+            painter.drawPixmap(self.boundingRect(), pixmap, QtCore.QRectF(pixmap.rect()))
+            return
+        scale = 1 << level  # image pixels per tile pixel
+        span = TILE_SIZE * scale
+        columns, rows = pyramid.grid(level)
+        with tracer.span("draw_tiles", level=level):
+            for ty in range(max(0, int(exposed.top() // span)), min(rows, int(exposed.bottom() // span) + 1)):
+                for tx in range(max(0, int(exposed.left() // span)), min(columns, int(exposed.right() // span) + 1)):
+                    tile = pyramid.tile((level, tx, ty))
+                    if tile is None:
+                        continue
+                    painter.drawImage(QtCore.QRectF(offset.x() + tx * span, offset.y() + ty * span,
+                                                    tile.width() * scale, tile.height() * scale), tile)
+
+
+def image_item(pixmap: QtGui.QPixmap, size: QtCore.QSizeF, source: typing.Optional[str]) -> \
+        QtWidgets.QGraphicsPixmapItem:
+    """
+    item showing a preview pixmap at the full size of its source image, tiled for very large images
+    """
+    if (source and size.width() * size.height() > TILED_IMAGE_PIXELS and not image_loader.proxy_editing()
+            and os.path.isfile(source)):
+        return TiledImageItem(pixmap, size, source)
+    return image_loader.ImagePixmapItem(pixmap, size, source)
+
+
+def decoded_image_item(decoded: image_loader.DecodedImage) -> QtWidgets.QGraphicsPixmapItem:
+    """
+    scene item for a decoded image, previews are shown at the full size of the image
+    """
+    pixmap = QtGui.QPixmap.fromImage(decoded.image)
+    if decoded.is_preview:
+        return image_item(pixmap, QtCore.QSizeF(decoded.full_size), decoded.file_name)
+    item = QtWidgets.QGraphicsPixmapItem(pixmap)
+    item.setData(Qt.UserRole, decoded.file_name)  # lets project files reference or embed the original file
+    return item
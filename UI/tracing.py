@@ -0,0 +1,138 @@
+"""
+Lightweight tracing of named spans and counters, exported as Chrome trace JSON (chrome://tracing, Perfetto).
+
+Tracing is off by default, a disabled `span` hands out a shared no-op context manager and `traced` functions
+only pay for one attribute check:
+
+    from UI.tracing import tracer, traced
+
+    with tracer.span("draw_svg", items=len(lines)):
+        ...
+
+    @traced("create_curve")
+    def create_curve(*points): ...
+"""
+import collections
+import functools
+import json
+import os
+import threading
+import time
+import typing
+
+MAX_EVENTS = 1_000_000  # oldest events are dropped once reached, a forgotten trace can not eat up the memory
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("_tracer", "_name", "_args", "_started")
+
+    def __init__(self, tracer: 'Tracer', name: str, args: dict):
+        self._tracer = tracer
+        self._name = name
+        self._args = args
+
+    def __enter__(self):
+        self._started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._tracer.complete(self._name, self._started, time.perf_counter_ns(), self._args)
+        return False
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self._events: typing.Deque[dict] = collections.deque(maxlen=MAX_EVENTS)
+        self._thread_names: typing.Dict[int, str] = {}
+        self._origin = time.perf_counter_ns()
+
+    def enable(self):
+        self._events.clear()
+        self._thread_names.clear()
+        self._origin = time.perf_counter_ns()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def _timestamp(self, ns: int) -> float:
+        return (ns - self._origin) / 1000  # chrome traces count in microseconds
+
+    def _thread(self) -> int:
+        thread_id = threading.get_ident()
+        if thread_id not in self._thread_names:
+            self._thread_names[thread_id] = threading.current_thread().name
+        return thread_id
+
+    # ------ recording ------
+    def span(self, name: str, **args) -> typing.ContextManager:
+        """
+        :param args: shown with the span in the trace viewer
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def complete(self, name: str, started_ns: int, finished_ns: int, args: dict = None):
+        self._events.append({"name": name, "ph": "X", "ts": self._timestamp(started_ns),
+                             "dur": (finished_ns - started_ns) / 1000, "pid": os.getpid(), "tid": self._thread(),
+                             "args": args or {}})
+
+    def counter(self, name: str, value: float):
+        if self.enabled:
+            self._events.append({"name": name, "ph": "C", "ts": self._timestamp(time.perf_counter_ns()),
+                                 "pid": os.getpid(), "tid": self._thread(), "args": {name: value}})
+
+    def instant(self, name: str, **args):
+        if self.enabled:
+            self._events.append({"name": name, "ph": "i", "s": "t", "ts": self._timestamp(time.perf_counter_ns()),
+                                 "pid": os.getpid(), "tid": self._thread(), "args": args})
+
+    # ------ export ------
+    def event_count(self) -> int:
+        return len(self._events)
+
+    def export_chrome_trace(self, file_name: str):
+        metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread_id, "args": {"name": name}}
+                    for thread_id, name in list(self._thread_names.items())]
+        with open(file_name, "w") as f:
+            json.dump({"traceEvents": metadata + list(self._events), "displayTimeUnit": "ms"}, f, default=str)
+
+
+tracer = Tracer()
+
+
+def traced(name: str = None):
+    """
+    decorator, records every call of the function as a span
+    :param name: span name, defaults to the qualified function name
+    """
+
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                tracer.complete(span_name, started, time.perf_counter_ns())
+
+        return wrapper
+
+    return decorator
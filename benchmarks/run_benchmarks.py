@@ -0,0 +1,382 @@
+"""
+Headless benchmarks for the drawing, import and export hot paths.
+
+Drives a real MainWindow / CustomGraphicsView under the offscreen Qt platform and writes ops/sec, p50/p99 latency
+and peak RSS per case to a JSON file. When the output file already exists it is used as the baseline and a
+regression comparison is printed after the run.
+
+    python benchmarks/run_benchmarks.py [--output benchmarks/results.json] [--svg-sizes 1000,10000,100000]
+                                        [--replay session.inrec]
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import typing
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE)
+
+from PyQt5 import QtCore, QtGui, QtWidgets  # noqa: E402
+from PyQt5.QtCore import Qt  # noqa: E402
+
+DEFAULT_OUTPUT = os.path.join(BASE, "benchmarks", "results.json")
+REGRESSION_THRESHOLD = 0.10  # 10 % slower than the baseline counts as a regression
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024  # bytes on macOS, KiB elsewhere
+
+
+def percentile(samples: typing.List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(samples: typing.List[float], operations_per_sample: int = 1) -> dict:
+    """
+    :param samples: durations in seconds
+    """
+    total = sum(samples)
+    return {
+        "iterations": len(samples),
+        "ops_per_sec": (len(samples) * operations_per_sample) / total if total else 0.0,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+class Bench:
+    def __init__(self):
+        import main
+        self.app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+        self.main = main
+        self.window = main.MainWindow()
+        self.window.show()
+        self.view = self.window.graphicsView_canvas
+        self.view.coalesce_mouse_moves = False  # measure every event
+        self.process_events()
+
+    def process_events(self):
+        self.app.processEvents()
+
+    def mouse(self, kind: QtCore.QEvent.Type, x: float, y: float, button=Qt.LeftButton):
+        buttons = Qt.NoButton if kind == QtCore.QEvent.MouseButtonRelease else button
+        event_button = Qt.NoButton if kind == QtCore.QEvent.MouseMove else button
+        event = QtGui.QMouseEvent(kind, QtCore.QPointF(x, y), event_button, buttons, Qt.NoModifier)
+        if kind == QtCore.QEvent.MouseButtonPress:
+            self.view.mousePressEvent(event)
+        elif kind == QtCore.QEvent.MouseMove:
+            self.view.mouseMoveEvent(event)
+        else:
+            self.view.mouseReleaseEvent(event)
+
+    def reset(self):
+        self.window.new_action_triggered()
+        self.process_events()
+
+    def fill_scene(self, count: int):
+        lines = [[random.uniform(0, 1500), random.uniform(0, 900), random.uniform(0, 1500), random.uniform(0, 900),
+                  "#333333", 1] for _ in range(count)]
+        self.window.draw_svg(lines, [], [], [], [])
+
+    def wait_for(self, predicate: typing.Callable[[], bool], timeout: float = 600):
+        started = time.perf_counter()
+        while not predicate():
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError("benchmark step timed out")
+            self.app.processEvents(QtCore.QEventLoop.AllEvents, 50)
+
+    # ------------------ cases ------------------
+    def drag(self, tool: str, background_items: int, drags: int = 20, moves: int = 50) -> typing.Dict[str, dict]:
+        self.reset()
+        self.fill_scene(background_items)
+        select = {"line": self.window.select_line, "rectangle": self.window.select_rectangle,
+                  "circle": self.window.select_circle, "curve": self.window.select_curve,
+                  "polyline": self.window.select_polyline}[tool]
+        select()
+        move_samples, commit_samples = [], []
+        for i in range(drags):
+            x, y = 50 + i * 5, 50 + i * 3
+            if tool == "curve":  # end points first, the third drag bends the curve
+                for px, py in ((x, y), (x + 300, y)):
+                    self.mouse(QtCore.QEvent.MouseButtonPress, px, py)
+                    self.mouse(QtCore.QEvent.MouseButtonRelease, px, py)
+            self.mouse(QtCore.QEvent.MouseButtonPress, x, y)
+            for step in range(moves):
+                started = time.perf_counter()
+                self.mouse(QtCore.QEvent.MouseMove, x + step * 4, y + step * 2)
+                move_samples.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            self.mouse(QtCore.QEvent.MouseButtonRelease, x + moves * 4, y + moves * 2)
+            commit_samples.append(time.perf_counter() - started)
+            if tool == "polyline":
+                self.mouse(QtCore.QEvent.MouseButtonPress, x, y, Qt.RightButton)
+                self.mouse(QtCore.QEvent.MouseButtonRelease, x, y, Qt.RightButton)
+            self.process_events()
+        return {f"drag_preview_{tool}": summarize(move_samples), f"drag_commit_{tool}": summarize(commit_samples)}
+
+    def freehand(self, background_items: int, seconds: float = 10, rate: int = 1000) -> typing.Dict[str, dict]:
+        """
+        a scribble of `seconds` at `rate` pointer samples per second, reports the vertices the stroke keeps
+        """
+        self.reset()
+        self.fill_scene(background_items)
+        self.window.select_freehand()
+        self.view.coalesce_mouse_moves = True  # as interactive, every sample is recorded, redraws once per frame
+        times = [i / rate for i in range(int(seconds * rate))]
+        points = [(400 + 300 * math.sin(1.4 * math.pi * t) * math.cos(0.26 * math.pi * t),
+                   300 + 200 * math.sin(2.2 * math.pi * t + 0.5)) for t in times]
+        move_samples = []
+        self.mouse(QtCore.QEvent.MouseButtonPress, *points[0])
+        for i, (x, y) in enumerate(points[1:]):
+            started = time.perf_counter()
+            self.mouse(QtCore.QEvent.MouseMove, x, y)
+            move_samples.append(time.perf_counter() - started)
+            if i % 16 == 0:
+                self.process_events()
+        started = time.perf_counter()
+        self.mouse(QtCore.QEvent.MouseButtonRelease, *points[-1])
+        commit = summarize([time.perf_counter() - started])
+        self.view.coalesce_mouse_moves = False
+        stroke = next(reversed(self.window.history.items.values()))
+        commit["samples"] = len(points)
+        commit["vertices"] = (stroke.path().elementCount() + 2) // 3  # move to plus 3 elements per cubic segment
+        return {"freehand_sample": summarize(move_samples), "freehand_commit": commit}
+
+    def spline(self, background_items: int, knots: int = 1000, moves: int = 200) -> typing.Dict[str, dict]:
+        """
+        live preview while placing the next knot of a long spline, then dragging one of its knots
+        """
+        self.reset()
+        self.fill_scene(background_items)
+        self.window.select_spline()
+        rnd = random.Random(knots)
+        for i in range(knots):
+            x, y = 20 + (i % 100) * 8, 50 + (i // 100) * 50 + rnd.uniform(-10, 10)
+            self.mouse(QtCore.QEvent.MouseMove, x, y, Qt.NoButton)
+            self.mouse(QtCore.QEvent.MouseButtonPress, x, y)
+            self.mouse(QtCore.QEvent.MouseButtonRelease, x, y)
+        preview_samples = []
+        for i in range(moves):
+            started = time.perf_counter()
+            self.mouse(QtCore.QEvent.MouseMove, 500 + i % 50, 600 + i % 30, Qt.NoButton)
+            preview_samples.append(time.perf_counter() - started)
+        spline = self.window._spline
+        knot = self.view.mapFromScene(spline.knot(knots // 2))
+        edit_samples = []
+        self.mouse(QtCore.QEvent.MouseButtonPress, knot.x(), knot.y())
+        for i in range(moves):
+            started = time.perf_counter()
+            self.mouse(QtCore.QEvent.MouseMove, knot.x() + i % 40, knot.y() + i % 20)
+            edit_samples.append(time.perf_counter() - started)
+        self.mouse(QtCore.QEvent.MouseButtonRelease, knot.x(), knot.y())
+        self.mouse(QtCore.QEvent.MouseButtonPress, 5, 5, Qt.RightButton)
+        self.mouse(QtCore.QEvent.MouseButtonRelease, 5, 5, Qt.RightButton)
+        self.process_events()
+        return {f"spline_preview_{knots}": summarize(preview_samples),
+                f"spline_knot_drag_{knots}": summarize(edit_samples)}
+
+    def svg_import(self, size: int, work_dir: str) -> typing.Dict[str, dict]:
+        file_name = os.path.join(work_dir, f"synthetic_{size}.svg")
+        write_synthetic_svg(file_name, size)
+        self.reset()
+        started = time.perf_counter()
+        self.window.import_svg(file_name)
+        self.wait_for(lambda: self.window._svg_import_thread is None)
+        result = summarize([time.perf_counter() - started], size)
+        return {f"svg_import_{size}": result}
+
+    def save(self, extension: str, background_items: int, work_dir: str, repeat: int = 3) -> typing.Dict[str, dict]:
+        self.reset()
+        self.fill_scene(background_items)
+        file_name = os.path.join(work_dir, f"export.{extension}")
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            if extension == "svg":
+                self.window.export_svg(file_name)
+            else:
+                source_rect = self.main.export.scene_export_rect(self.window._scene)
+                options = self.main.export.ExportOptions(4000, int(4000 * source_rect.height() / source_rect.width()),
+                                                         source_rect=source_rect)
+                self.window.export_image(file_name, options)
+            self.wait_for(lambda: self.window._save_thread is None)
+            samples.append(time.perf_counter() - started)
+        return {f"save_{extension}": summarize(samples)}
+
+    def transform_items(self, background_items: int, repeat: int = 200) -> typing.Dict[str, dict]:
+        self.reset()
+        self.fill_scene(background_items)
+        self.window.select_line()
+        self.mouse(QtCore.QEvent.MouseButtonPress, 700, 400)
+        self.mouse(QtCore.QEvent.MouseButtonRelease, 800, 450)
+        target = self.view.mapFromScene(QtCore.QPointF(750, 425))
+
+        rotate_samples = []
+        self.view._item_for_move = next(reversed(self.window.history.items.values()))
+        for i in range(repeat):
+            started = time.perf_counter()
+            self.view.rotate_item(i % 2 == 0)
+            rotate_samples.append(time.perf_counter() - started)
+
+        move_samples = []
+        self.mouse(QtCore.QEvent.MouseButtonPress, target.x(), target.y(), Qt.RightButton)
+        for i in range(repeat):
+            started = time.perf_counter()
+            self.mouse(QtCore.QEvent.MouseMove, target.x() + i % 40, target.y() + i % 20, Qt.RightButton)
+            move_samples.append(time.perf_counter() - started)
+        self.mouse(QtCore.QEvent.MouseButtonRelease, target.x(), target.y(), Qt.RightButton)
+        self.view._item_for_move = None
+        return {"rotate_item": summarize(rotate_samples), "move_item": summarize(move_samples)}
+
+    def hit_test(self, background_items: int, queries: int = 500) -> typing.Dict[str, dict]:
+        """
+        right click / hover picking, `QGraphicsScene.itemAt` against the selection index of the view
+        """
+        self.reset()
+        self.fill_scene(background_items)
+        points = [QtCore.QPointF(random.uniform(0, 1500), random.uniform(0, 900)) for _ in range(queries)]
+        scene, transform = self.window._scene, self.view.transform()
+        scene_samples, index_samples = [], []
+        for point in points:
+            started = time.perf_counter()
+            scene.itemAt(point, transform)
+            scene_samples.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            self.view.item_at(point)
+            index_samples.append(time.perf_counter() - started)
+        return {"hit_test_scene_item_at": summarize(scene_samples), "hit_test_selection_index": summarize(index_samples)}
+
+    def snap_points(self, count: int = 1_000_000, repeat: int = 20) -> typing.Dict[str, dict]:
+        """
+        grid snapping and transforming of a whole polyline worth of points
+        """
+        import numpy as np
+        from UI import snapping
+        polygon = snapping.to_polygon(np.random.default_rng(count).uniform(0, 1500, (count, 2)))
+        transform = QtGui.QTransform().rotate(30).scale(1.5, 1.5)
+        snap_samples, map_samples = [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            snapping.snap_points(polygon, 10)
+            snap_samples.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            snapping.map_points(transform, polygon)
+            map_samples.append(time.perf_counter() - started)
+        return {f"snap_points_{count}": summarize(snap_samples), f"map_points_{count}": summarize(map_samples)}
+
+    def replay(self, file_name: str, background_items: int) -> typing.Dict[str, dict]:
+        from UI import input_recorder
+        self.reset()
+        self.fill_scene(background_items)
+        stats = input_recorder.InputReplayer(self.view).replay(input_recorder.load_records(file_name))
+        results = {}
+        for kind, samples in stats.handling.items():
+            results[f"replay_{input_recorder.KIND_NAMES[kind]}"] = summarize(samples)
+        if stats.frames:
+            results["replay_frame"] = summarize(stats.frames)
+        return results
+
+
+def write_synthetic_svg(file_name: str, size: int):
+    colors = ("#000000", "#ff0000", "#0000ff", "#008000")
+    rnd = random.Random(size)
+    with open(file_name, "w") as f:
+        f.write('<svg xmlns="http://www.w3.org/2000/svg" width="1600" height="1000">\n')
+        for i in range(size):
+            color = colors[i % len(colors)]
+            x, y = rnd.uniform(0, 1500), rnd.uniform(0, 900)
+            kind = i % 4
+            if kind == 0:
+                f.write(f'<polyline points="{x:.1f},{y:.1f} {x + 40:.1f},{y + 25:.1f}" stroke="{color}" '
+                        f'stroke-width="2" fill="none"/>\n')
+            elif kind == 1:
+                f.write(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="12" stroke="{color}" stroke-width="1" fill="none"/>\n')
+            elif kind == 2:
+                f.write(f'<rect x="{x:.1f}" y="{y:.1f}" width="30" height="20" stroke="{color}" stroke-width="1" '
+                        f'fill="none"/>\n')
+            else:
+                f.write(f'<path d="M {x:.1f} {y:.1f} C {x + 10:.1f} {y + 30:.1f} {x + 30:.1f} {y + 30:.1f} '
+                        f'{x + 40:.1f} {y:.1f} L {x + 60:.1f} {y + 10:.1f}" stroke="{color}" stroke-width="2" '
+                        f'fill="none"/>\n')
+        f.write("</svg>\n")
+
+
+def compare(previous: dict, current: dict) -> typing.List[str]:
+    """
+    :return: report lines, one per case present in both runs
+    """
+    lines = [f"{'case':<28}{'ops/s before':>14}{'ops/s now':>14}{'change':>10}{'p99 before':>12}{'p99 now':>10}"]
+    for name, result in current["results"].items():
+        before = previous.get("results", {}).get(name)
+        if not before or not before["ops_per_sec"]:
+            continue
+        change = result["ops_per_sec"] / before["ops_per_sec"] - 1
+        flag = "  REGRESSION" if change < -REGRESSION_THRESHOLD else ""
+        lines.append(f"{name:<28}{before['ops_per_sec']:>14.1f}{result['ops_per_sec']:>14.1f}{change:>+10.1%}"
+                     f"{before['p99_ms']:>12.2f}{result['p99_ms']:>10.2f}{flag}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--svg-sizes", default="1000,10000,100000")
+    parser.add_argument("--scene-items", type=int, default=5000, help="items in the scene for drag/save/move cases")
+    parser.add_argument("--replay", help="input recording (File > Record Input Session) to replay as an extra case")
+    args = parser.parse_args(argv)
+
+    random.seed(0)
+    bench = Bench()
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for tool in ("line", "rectangle", "circle", "curve", "polyline"):
+            results.update(bench.drag(tool, args.scene_items))
+        results.update(bench.freehand(args.scene_items))
+        results.update(bench.spline(args.scene_items))
+        for size in (int(size) for size in args.svg_sizes.split(",") if size):
+            results.update(bench.svg_import(size, work_dir))
+        for extension in ("png", "svg"):
+            results.update(bench.save(extension, args.scene_items, work_dir))
+        results.update(bench.transform_items(args.scene_items * 4))
+        results.update(bench.hit_test(args.scene_items * 4))
+        results.update(bench.snap_points())
+        if args.replay:
+            results.update(bench.replay(args.replay, args.scene_items))
+
+    current = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "qt": QtCore.QT_VERSION_STR, "platform": platform.platform(), "scene_items": args.scene_items},
+        "results": results,
+    }
+    previous = None
+    if os.path.exists(args.output):
+        with open(args.output, "r") as f:
+            previous = json.load(f)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2)
+
+    for name, result in results.items():
+        print(f"{name:<28}{result['ops_per_sec']:>12.1f} ops/s  p50 {result['p50_ms']:8.3f} ms  "
+              f"p99 {result['p99_ms']:8.3f} ms  rss {result['peak_rss_mb']:7.1f} MB")
+    if previous:
+        print("\ncompared with the previous run:")
+        print("\n".join(compare(previous, current)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,13 +5,16 @@ import os.path
 import sys
 import typing
 from collections import namedtuple
-from svgelements import SVG
 
-from PyQt5 import QtCore, QtGui, QtWidgets, QtSvg
+from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import Qt
 from typing import Tuple
 
-from UI import home, graphics_view, helpDialog
+from UI import (home, graphics_view, helpDialog, exportDialog, export, freehand, history, image_loader, journal,
+                preview, project_format, scene_snapshot, shapes, snapping, svg_import, tiled_image)
+from UI.scene_loading import BulkInsert, SuspendedIndex
+from UI.styles import style_cache
+from UI.tracing import tracer, traced
 
 pos = namedtuple("mouse_coor", ("x", "y"))
 BASE = os.path.dirname(os.path.abspath(__file__))
@@ -25,17 +28,21 @@ class MainWindow(QtWidgets.QMainWindow):
         self.current_shape = None
         self.ui = home.Ui_MainWindow()
         self.ui.setupUi(self)
+        # only the canvas uses drawing cursors, those are handled by the canvas itself
+        self.setCursor(QtGui.QCursor(Qt.ArrowCursor))
 
         # -------- class attributes --------
-        self.temp_drawing_item: typing.Union[None, QtWidgets.QGraphicsItem] = None
         self.temp_drawing_activated = False
-        self.grid_image = os.path.join(BASE, "UI", "images", "grid2.png")
-        # temp drawing pen with red color and dotted line
 
-        self.selection_rect_pen = QtGui.QPen(QtGui.QColor("#2073e8"), 3, Qt.DashLine)
-        self.drawing_items_list = []  # max length 10
+        self.selection_rect_pen = style_cache.pen("#2073e8", 3, Qt.DashLine)
         self.selected_item: typing.Union[None, QtWidgets.QGraphicsItem] = None
         self.selected_rect_item: typing.Union[None, QtWidgets.QGraphicsItem] = None
+        self._polyline: typing.Union[None, shapes.PolylineItem] = None  # polyline being drawn
+        self._spline: typing.Union[None, shapes.SplineItem] = None  # spline being drawn, last knot is the pointer
+        # (spline, knot index, record of the spline before the edit or None while it is being drawn)
+        self._knot_edit: typing.Union[None, typing.Tuple[shapes.SplineItem, int,
+                                                         typing.Optional[scene_snapshot.ItemRecord]]] = None
+        self._hovered_spline: typing.Union[None, shapes.SplineItem] = None  # finished spline showing its knots
 
         # ------------------ widget customizations ------------------
         self.ui.comboBox_LineStyle.addItems(["Solid", "Dash", "DashDot", "Dot"])
@@ -54,16 +61,19 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.graphicsView_canvas = graphics_view.CustomGraphicsView(parent=self.ui.frame_left)
         self.graphicsView_canvas.mouse_pos_signal.connect(self.show_mouse_pos)
-        self.graphicsView_canvas.change_cursor_signal.connect(self.change_cursor)
         self.graphicsView_canvas.draw_line_signal.connect(self.draw_line)
         self.graphicsView_canvas.draw_circle_signal.connect(self.draw_circle)
         self.graphicsView_canvas.draw_rect_signal.connect(self.draw_rectangle)
         self.graphicsView_canvas.draw_curve_signal.connect(self.draw_curve)
         self.graphicsView_canvas.draw_text_signal.connect(self.draw_text)
         self.graphicsView_canvas.draw_polyline_signal.connect(self.draw_polyline)
+        self.graphicsView_canvas.finish_shape_signal.connect(self.finish_shape)
+        self.graphicsView_canvas.spline_signal.connect(self.spline_event)
+        self.graphicsView_canvas.draw_freehand_signal.connect(self.draw_freehand)
         self.graphicsView_canvas.toggle_temp_drawing.connect(self.toggle_temp_drawing)
         self.graphicsView_canvas.draw_selected_item_rect.connect(self.draw_selected_item_rect)
         self.graphicsView_canvas.item_pasted_signal.connect(self.add_item_to_drawing_list)
+        self.graphicsView_canvas.item_placement_changed_signal.connect(self.item_placement_changed)
         self.graphicsView_canvas.clear_selection_rect.connect(self.clear_selection_rect)
         self.graphicsView_canvas.show_status_bar_message_signal.connect(self.show_status_bar_message)
 
@@ -85,7 +95,6 @@ class MainWindow(QtWidgets.QMainWindow):
         self.change_font_size(self.current_font.pointSize())
         self.ui.horizontalSlider_penSize.setValue(self.point_size)
         self.ui.horizontalSlider_fontSize.setValue(self.current_font.pointSize())
-        self.temp_drawing_pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
         # ====================== actions ======================
         self.ui.actionLoad_Image.triggered.connect(self.load_image)
         self.ui.actionLoad_SVG.triggered.connect(self.load_svg)
@@ -94,9 +103,28 @@ class MainWindow(QtWidgets.QMainWindow):
         self.ui.actionNew.triggered.connect(self.new_action_triggered)
         self.ui.actionExit.triggered.connect(self.exit_action_triggered)
         self.ui.actionSave.triggered.connect(self.save_image)
+        # native project files
+        self.actionOpen_Project = QtWidgets.QAction(self)
+        self.actionOpen_Project.setText("Open Project")
+        self.actionOpen_Project.setShortcut("Ctrl+Shift+O")
+        self.actionOpen_Project.triggered.connect(self.open_project_dialog)
+        self.actionSave_Project = QtWidgets.QAction(self)
+        self.actionSave_Project.setText("Save Project")
+        self.actionSave_Project.setShortcut("Ctrl+Shift+S")
+        self.actionSave_Project.triggered.connect(self.save_project_triggered)
+        self.actionSave_Project_As = QtWidgets.QAction(self)
+        self.actionSave_Project_As.setText("Save Project As...")
+        self.actionSave_Project_As.triggered.connect(self.save_project_dialog)
+        self.ui.menuFile.insertActions(self.ui.actionExit, [self.actionOpen_Project, self.actionSave_Project,
+                                                            self.actionSave_Project_As])
         # Ctrl+Z shortcut
         self.ui.actionUndo.setShortcut("Ctrl+Z")
         self.ui.actionUndo.triggered.connect(self.undo_item)
+        self.actionRedo = QtWidgets.QAction(self)
+        self.actionRedo.setText("Redo")
+        self.actionRedo.setShortcut("Ctrl+Shift+Z")
+        self.actionRedo.triggered.connect(self.redo_item)
+        self.ui.menuImage.addAction(self.actionRedo)
 
         # action full screen
         self.actionFull_Screen = QtWidgets.QAction(self)
@@ -112,6 +140,22 @@ class MainWindow(QtWidgets.QMainWindow):
         self.actionAuto_Configure.triggered.connect(partial(self.autoconfigure_canvas_size, True))
         self.ui.menuFile.addAction(self.actionAuto_Configure)
 
+        # action record input (for replaying editing sessions in latency tests)
+        self.actionRecord_Input = QtWidgets.QAction(self)
+        self.actionRecord_Input.setText("Record Input Session")
+        self.actionRecord_Input.setCheckable(True)
+        self.actionRecord_Input.triggered.connect(self.toggle_input_recording)
+        self.ui.menuFile.addAction(self.actionRecord_Input)
+        self.input_recording_file = None
+
+        # action record trace (chrome trace json of the spans in UI.tracing)
+        self.actionRecord_Trace = QtWidgets.QAction(self)
+        self.actionRecord_Trace.setText("Record Performance Trace")
+        self.actionRecord_Trace.setCheckable(True)
+        self.actionRecord_Trace.triggered.connect(self.toggle_trace_recording)
+        self.ui.menuFile.addAction(self.actionRecord_Trace)
+        self.trace_file = None
+
         # Help menu
         self.ui.actionAbout.triggered.connect(self.show_about_dialog)
 
@@ -121,7 +165,27 @@ class MainWindow(QtWidgets.QMainWindow):
         self.actionShow_Grid.setCheckable(True)
         self.actionShow_Grid.triggered.connect(self.toggle_grid)
         self.ui.menuImage.addAction(self.actionShow_Grid)
-        self.grid_size = 10
+        self.actionGrid_Size = QtWidgets.QAction(self)
+        self.actionGrid_Size.setText("Grid Size...")
+        self.actionGrid_Size.triggered.connect(self.change_grid_size)
+        self.ui.menuImage.addAction(self.actionGrid_Size)
+        self.actionFreehand_Tolerance = QtWidgets.QAction(self)
+        self.actionFreehand_Tolerance.setText("Freehand Tolerance...")
+        self.actionFreehand_Tolerance.triggered.connect(self.change_freehand_tolerance)
+        self.ui.menuImage.addAction(self.actionFreehand_Tolerance)
+
+        # action show performance overlay
+        self.actionShow_Performance = QtWidgets.QAction(self)
+        self.actionShow_Performance.setText("Show Performance Overlay")
+        self.actionShow_Performance.setCheckable(True)
+        self.actionShow_Performance.triggered.connect(self.graphicsView_canvas.set_hud_visible)
+        self.ui.menuImage.addAction(self.actionShow_Performance)
+        self.actionProxy_Editing = QtWidgets.QAction(self)
+        self.actionProxy_Editing.setText("Proxy Editing (Export Onto Original)")
+        self.actionProxy_Editing.setCheckable(True)
+        self.actionProxy_Editing.triggered.connect(self.set_proxy_editing)
+        self.ui.menuImage.addAction(self.actionProxy_Editing)
+        self.graphicsView_canvas.hud_counters["undo"] = lambda: len(self.history)
 
         # ====================== button signals ======================
         self.ui.radioButton_line.clicked.connect(self.select_line)
@@ -129,6 +193,14 @@ class MainWindow(QtWidgets.QMainWindow):
         self.ui.radioButton_square.clicked.connect(self.select_rectangle)
         self.ui.radioButton_curve.clicked.connect(self.select_curve)
         self.ui.radioButton_polyline.clicked.connect(self.select_polyline)
+        self.radioButton_freehand = QtWidgets.QRadioButton("Freehand", self.ui.groupBox_shapes)
+        self.ui.gridLayout.addWidget(self.radioButton_freehand, 3, 1, 1, 1)
+        self.radioButton_freehand.clicked.connect(self.select_freehand)
+        self.radioButton_spline = QtWidgets.QRadioButton("Spline", self.ui.groupBox_shapes)
+        self.ui.gridLayout.addWidget(self.radioButton_spline, 4, 0, 1, 1)
+        self.radioButton_spline.clicked.connect(self.select_spline)
+        self.ui.groupBox_shapes.setMinimumHeight(150)  # room for the added row
+        self.ui.groupBox_shapes.setMaximumHeight(150)
 
         self.ui.pushButton_text_inp_pos.clicked.connect(self.set_text_input_pos)
         self.ui.fontComboBox_text.currentFontChanged.connect(self.font_changed)
@@ -138,17 +210,40 @@ class MainWindow(QtWidgets.QMainWindow):
         self.ui.horizontalSlider_penSize.valueChanged[int].connect(self.change_pen_size)
         self.ui.horizontalSlider_fontSize.valueChanged[int].connect(self.change_font_size)
 
+        # ====================== background saving ======================
+        self._save_thread: typing.Union[None, QtCore.QThread] = None
+        self._save_worker: typing.Union[None, export.SaveWorker] = None
+        self.save_progress_bar = QtWidgets.QProgressBar(self)
+        self.save_progress_bar.setMaximumWidth(200)
+        self.save_progress_bar.hide()
+        self.save_cancel_button = QtWidgets.QPushButton("Cancel", self)
+        self.save_cancel_button.clicked.connect(self.cancel_save)
+        self.save_cancel_button.hide()
+        self.ui.statusbar.addPermanentWidget(self.save_progress_bar)
+        self.ui.statusbar.addPermanentWidget(self.save_cancel_button)
+
         # ====================== graphics scene ======================
         self._scene = QtWidgets.QGraphicsScene(self.graphicsView_canvas)
         self.graphicsView_canvas.setScene(self._scene)
-        self.lines = []
-        self.circles = []
-        self.rects = []
-        self.texts = []
-        self.curves = []
-        self.points_grid = []
+        self.preview = preview.PreviewEngine(self._scene)
+        self.selection_index = self.graphicsView_canvas.selection_index
+        self.history = history.History(self._scene, self.selection_index, parent=self)
+        self.image_loader = image_loader.shared_loader()
+        self.image_loader.image_loaded.connect(self._image_loaded)
+        self.image_loader.load_failed.connect(self._image_load_failed)
+        self.journal: typing.Union[None, journal.Journal] = None  # edits of the open project file
+        self._svg_import_thread: typing.Union[None, QtCore.QThread] = None
+        self._svg_import_worker: typing.Union[None, svg_import.SvgImportWorker] = None
+        self._svg_import_progress: typing.Union[None, QtWidgets.QProgressDialog] = None
+        self._svg_import_items: typing.List[QtWidgets.QGraphicsItem] = []
+        self._svg_import_index: typing.Union[None, SuspendedIndex] = None  # scene index is off while importing
         self.autoconfigure_canvas_size()
-        self.activate_mouse_check_timer()
+
+        # recording can also be switched on from the start, to capture sessions in production
+        if os.environ.get("IMAGEEDIT_RECORD_INPUT"):
+            self.start_input_recording(os.environ["IMAGEEDIT_RECORD_INPUT"])
+        if os.environ.get("IMAGEEDIT_TRACE"):
+            self.start_trace_recording(os.environ["IMAGEEDIT_TRACE"])
 
     # ====================== menu actions ======================
     def autoconfigure_canvas_size(self, manual_trigger=False):
@@ -162,7 +257,7 @@ class MainWindow(QtWidgets.QMainWindow):
             view_port_size = self.graphicsView_canvas.viewport().size()
             # get scene size
             self._scene.setSceneRect(QtCore.QRectF(self.graphicsView_canvas.viewport().rect()))
-            print(f"view port size & scene size: {view_port_size}")
+            tracer.instant("autoconfigure_canvas_size", width=view_port_size.width(), height=view_port_size.height())
             self.save_config({"max_viewport_size": [view_port_size.width(), view_port_size.height()]})
         self.graphicsView_canvas.setHorizontalScrollBarPolicy(Qt.ScrollBarAsNeeded)
         self.graphicsView_canvas.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
@@ -174,24 +269,126 @@ class MainWindow(QtWidgets.QMainWindow):
             self.showFullScreen()
 
     def toggle_grid(self):
-        if self.actionShow_Grid.isChecked():
-            # _bg_brush = QtGui.QBrush(QtGui.QPixmap(self.grid_image))
-            _bg_brush = QtGui.QBrush()
-            _bg_brush.setColor(QtGui.QColor('#999'))
-            _bg_brush.setStyle(Qt.CrossPattern)
-            self._scene.setBackgroundBrush(_bg_brush)
-            self.graphicsView_canvas.is_grid_on(False)
-
-        else:
-            self._scene.setBackgroundBrush(Qt.white)
-            self.graphicsView_canvas.is_grid_on(True)
-        self._scene.update()
+        # drawn by the view, not part of the scene (nor of exports)
+        self.graphicsView_canvas.set_grid_visible(self.actionShow_Grid.isChecked())
+
+    @property
+    def grid_size(self) -> float:
+        return self.graphicsView_canvas.grid_size
+
+    def change_grid_size(self):
+        size, accepted = QtWidgets.QInputDialog.getInt(self, "Grid Size", "Grid spacing (scene units):",
+                                                       round(self.grid_size), 2, 1000)
+        if accepted:
+            self.graphicsView_canvas.set_grid_size(size)
+
+    def change_freehand_tolerance(self):
+        tolerance, accepted = QtWidgets.QInputDialog.getDouble(
+            self, "Freehand Tolerance", "Largest deviation of a simplified stroke (view pixels):",
+            self.graphicsView_canvas.freehand_tolerance, 0.1, 50, 1)
+        if accepted:
+            self.graphicsView_canvas.freehand_tolerance = tolerance
 
     def load_image(self):
-        file_name, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Open Image", "", "Image Files (*.png *.jpg *.bmp)")
+        file_names, _ = QtWidgets.QFileDialog.getOpenFileNames(self, "Open Image", "",
+                                                               "Image Files (*.png *.jpg *.jpeg *.bmp)")
+        for file_name in file_names:  # decoded in parallel, each one shows up when ready
+            self.load_image_file(file_name)
+
+    def load_image_file(self, file_name: str):
+        """
+        decode an image in the background, images larger than the viewport come in as a preview first
+        """
+        viewport = self.graphicsView_canvas.viewport()
+        self.image_loader.load(file_name, viewport.size() * viewport.devicePixelRatioF())
+        self.show_status_bar_message(f"Loading {os.path.basename(file_name)}...")
+
+    def _image_loaded(self, decoded: image_loader.DecodedImage):
+        pixmap_item = tiled_image.decoded_image_item(decoded)
+        self._scene.addItem(pixmap_item)
+        self.selection_index.insert(pixmap_item)
+        self.history.add_items([pixmap_item])
+        size = decoded.full_size
+        self.show_status_bar_message(f"Loaded {os.path.basename(decoded.file_name)} ({size.width()}x{size.height()}"
+                                     f"{', preview' if decoded.is_preview else ''})")
+
+    def _image_load_failed(self, args: typing.Tuple[str, str]):
+        file_name, error = args
+        self.show_status_bar_message(f"Could not load {file_name}: {error}")
+
+    def open_project_dialog(self):
+        file_name, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Open Project", "",
+                                                             f"Projects (*{project_format.EXTENSION})")
         if file_name:
-            self._scene.addPixmap(QtGui.QPixmap(file_name))
-        self._scene.update()
+            self.open_project(file_name)
+
+    def open_project(self, file_name: str) -> bool:
+        self.close_journal()  # the journal may belong to this very file
+        try:
+            project = project_format.load_project(file_name)
+            recovered = journal.replay(file_name, project)
+        except (OSError, project_format.ProjectFormatError, journal.JournalError) as e:
+            self.show_status_bar_message(f"Could not open {file_name}: {e}")
+            return False
+        self.reset()
+        with BulkInsert(self._scene) as bulk:
+            bulk.extend(recovered.items)
+        self.selection_index.insert_many(recovered.items)
+        self.history.load_items(recovered.item_ids, recovered.items)
+        self._scene.setSceneRect(self._scene.sceneRect().united(project.scene_rect))
+        message = f"Opened {file_name} ({len(recovered.items)} items"
+        if recovered.edits:
+            message += f", {recovered.edits} journaled edits"
+        self.show_status_bar_message(message + ")")
+        if self.start_journal(file_name, project.journal_id, recovered.valid_bytes) and not project.journal_id:
+            self.journal.compact()  # older file without ids, journaling starts from a snapshot that has them
+        return True
+
+    def start_journal(self, file_name: str, journal_id: int, valid_bytes: int = 0) -> bool:
+        try:
+            self.journal = journal.Journal(file_name, self.history, journal_id, valid_bytes, parent=self)
+        except OSError as e:
+            self.show_status_bar_message(f"Edits of {file_name} can not be journaled: {e}")
+            return False
+        self.journal.failed.connect(self.show_status_bar_message)
+        return True
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal.deleteLater()
+            self.journal = None
+
+    def save_project_triggered(self):
+        self.graphicsView_canvas.finish_shape()
+        if self.journal is None:
+            self.save_project_dialog()
+            return
+        with tracer.span("save_project_journal"):
+            self.journal.sync()  # the project file plus its journal hold the document, only the edits get written
+        self.show_status_bar_message(f"Saved {self.journal.project_file}")
+
+    def save_project_dialog(self):
+        file_name, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save Project", "",
+                                                             f"Projects (*{project_format.EXTENSION})")
+        if file_name:
+            if not os.path.splitext(file_name)[1]:
+                file_name += project_format.EXTENSION
+            self.save_project(file_name)
+
+    def save_project(self, file_name: str) -> bool:
+        self.graphicsView_canvas.finish_shape()
+        self.close_journal()
+        snapshot, item_ids = journal.capture(self.history)
+        journal_id = journal.new_journal_id()
+        try:
+            project_format.save_project(file_name, snapshot, item_ids=item_ids, journal_id=journal_id)
+        except OSError as e:
+            self.show_status_bar_message(f"Could not save {file_name}: {e}")
+            return False
+        self.show_status_bar_message(f"Saved {file_name}")
+        self.start_journal(file_name, journal_id)
+        return True
 
     def save_image(self):
         file_name, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save Image", "",
@@ -202,27 +399,130 @@ class MainWindow(QtWidgets.QMainWindow):
             if ext == "":
                 file_name += ".png"  # default extension (when user doesn't specify extension)
             if ext.lower() == ".svg":
-                svg_generator = QtSvg.QSvgGenerator()
-                svg_generator.setFileName(file_name)
-                _canvas_size = self.graphicsView_canvas.viewport().size()
-                svg_generator.setSize(_canvas_size)
-
-                painter = QtGui.QPainter()
-                painter.begin(svg_generator)
-                self._scene.render(painter)
-                painter.end()
+                self.export_svg(file_name)
                 return
-            print(file_name)
-            self.graphicsView_canvas.grab().save(file_name)
+            if image_loader.proxy_editing():
+                snapshot = self.snapshot_scene()
+                base_record = self.proxy_base_record(snapshot)
+                if base_record is not None:  # the output is the original, in its own pixel size
+                    if self.check_export_size(file_name, base_record.size.toSize()):
+                        self._start_save(file_name, snapshot, base_record=base_record)
+                    return
+            export_dialog = exportDialog.ExportDialog(export.scene_export_rect(self._scene), self)
+            if export_dialog.exec() == QtWidgets.QDialog.Accepted:
+                options = export_dialog.options()
+                if self.check_export_size(file_name, QtCore.QSize(options.width, options.height)):
+                    self.export_image(file_name, options)
+
+    def check_export_size(self, file_name: str, size: QtCore.QSize) -> bool:
+        """
+        :return: False (after telling the user) when the format of `file_name` can not be written at that size
+        """
+        try:
+            export.check_size(file_name, size.width(), size.height())
+        except export.ExportError as e:
+            self.show_status_bar_message(str(e))
+            return False
+        return True
+
+    def export_image(self, file_name: str, options: export.ExportOptions):
+        """
+        render the whole scene off-screen (tile by tile) into a raster image, in the background
+        """
+        self._start_save(file_name, options=options)
+
+    def export_svg(self, file_name: str):
+        self._start_save(file_name, svg_size=self.graphicsView_canvas.viewport().size())
+
+    def set_proxy_editing(self, enabled: bool):
+        """
+        images stay screen sized proxies while editing, raster exports are drawn onto the original file
+        """
+        image_loader.set_proxy_editing(enabled)
+        self._scene.update()
+
+    @staticmethod
+    def proxy_base_record(snapshot: scene_snapshot.SceneSnapshot) -> typing.Union[None, scene_snapshot.ItemRecord]:
+        """
+        :return: record of the largest proxy image with an original file, None if there is none
+        """
+        proxies = [record for record in snapshot.records
+                   if record.kind == scene_snapshot.PIXMAP and record.size is not None and record.source
+                   and os.path.isfile(record.source)]
+        return max(proxies, key=lambda record: record.size.width() * record.size.height(), default=None)
+
+    def snapshot_scene(self) -> scene_snapshot.SceneSnapshot:
+        """
+        :return: immutable copy of the document (without selection and preview helpers, or the polyline / spline
+                 still being drawn)
+        """
+        return scene_snapshot.SceneSnapshot.capture(self._scene, exclude=(self.selected_rect_item, self.preview.item,
+                                                                          self._polyline, self._spline))
+
+    def _start_save(self, file_name: str, snapshot: scene_snapshot.SceneSnapshot = None, **kwargs):
+        if self._save_thread is not None:
+            self.show_status_bar_message("A save is already running")
+            return
+        self._save_thread = QtCore.QThread(self)
+        self._save_worker = export.SaveWorker(snapshot or self.snapshot_scene(), file_name, **kwargs)
+        self._save_worker.moveToThread(self._save_thread)
+        self._save_thread.started.connect(self._save_worker.run)
+        self._save_worker.progress.connect(self._save_progress)
+        self._save_worker.finished.connect(self._save_finished)
+
+        self.save_progress_bar.setRange(0, 0)  # busy until the first progress report
+        self.save_progress_bar.show()
+        self.save_cancel_button.show()
+        self.ui.statusbar.showMessage(f"Saving {file_name}...")
+        self._save_thread.start()
+
+    @QtCore.pyqtSlot(int, int)
+    def _save_progress(self, done: int, total: int):
+        self.save_progress_bar.setRange(0, total)
+        self.save_progress_bar.setValue(done)
+
+    def cancel_save(self):
+        if self._save_worker is not None:
+            self._save_worker.cancel()
+
+    @QtCore.pyqtSlot(bool, str, str)
+    def _save_finished(self, saved: bool, file_name: str, error: str):
+        cancelled = self._save_worker.is_cancelled()
+        self._save_thread.quit()
+        self._save_thread.wait()
+        self._save_worker.deleteLater()
+        self._save_thread.deleteLater()
+        self._save_thread = None
+        self._save_worker = None
+        self.save_progress_bar.hide()
+        self.save_cancel_button.hide()
+        if saved:
+            self.show_status_bar_message(f"Saved {file_name}")
+        elif cancelled:
+            self.show_status_bar_message("Save cancelled")
+        elif error:
+            self.show_status_bar_message(f"Could not save {file_name}: {error}")
+        else:
+            self.show_status_bar_message(f"Could not save {file_name}")
 
+    @traced("reset")
     def reset(self):
+        self.close_journal()
+        self.preview.forget()
+        self._polyline = None
+        self._spline = None
+        self._knot_edit = None
+        self._hovered_spline = None
+        self.graphicsView_canvas.is_first_line = True
+        self.graphicsView_canvas.cancel_item_move()
+        self.selection_index.clear()
+        self.history.clear()
         self._scene.clear()
         self._scene.update()
 
     def toggle_temp_drawing(self, action: bool):
+        # the preview item is kept on release, the draw call following the release commits it
         self.temp_drawing_activated = action
-        if not action and self.temp_drawing_item:
-            self.remove_item_from_scene(self.temp_drawing_item)
 
     def new_action_triggered(self):
         self.reset()
@@ -236,6 +536,56 @@ class MainWindow(QtWidgets.QMainWindow):
     def exit_action_triggered(self):
         self.close()
 
+    def toggle_input_recording(self):
+        if self.actionRecord_Input.isChecked():
+            file_name, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Record Input Session", "",
+                                                                 "Input Recordings (*.inrec)")
+            if file_name:
+                self.start_input_recording(file_name)
+            else:
+                self.actionRecord_Input.setChecked(False)
+        else:
+            self.stop_input_recording()
+
+    def start_input_recording(self, file_name: str):
+        self.input_recording_file = file_name
+        self.graphicsView_canvas.start_input_recording()
+        self.actionRecord_Input.setChecked(True)
+        self.show_status_bar_message(f"Recording input to {file_name}")
+
+    def toggle_trace_recording(self):
+        if self.actionRecord_Trace.isChecked():
+            file_name, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Record Performance Trace", "",
+                                                                 "Chrome Trace (*.json)")
+            if file_name:
+                self.start_trace_recording(file_name)
+            else:
+                self.actionRecord_Trace.setChecked(False)
+        else:
+            self.stop_trace_recording()
+
+    def start_trace_recording(self, file_name: str):
+        self.trace_file = file_name
+        tracer.enable()
+        self.actionRecord_Trace.setChecked(True)
+        self.show_status_bar_message(f"Tracing to {file_name}")
+
+    def stop_trace_recording(self):
+        if tracer.enabled and self.trace_file:
+            tracer.disable()
+            tracer.export_chrome_trace(self.trace_file)
+            self.show_status_bar_message(f"Saved {tracer.event_count()} trace events to {self.trace_file}")
+        self.trace_file = None
+        self.actionRecord_Trace.setChecked(False)
+
+    def stop_input_recording(self):
+        recorder = self.graphicsView_canvas.stop_input_recording()
+        if recorder and self.input_recording_file:
+            recorder.save(self.input_recording_file)
+            self.show_status_bar_message(f"Saved {len(recorder.records)} input events to {self.input_recording_file}")
+        self.input_recording_file = None
+        self.actionRecord_Input.setChecked(False)
+
     def font_changed(self, font: QtGui.QFont):
         self.current_font = font
 
@@ -290,191 +640,232 @@ class MainWindow(QtWidgets.QMainWindow):
         self.current_shape = "polyline"
         self.graphicsView_canvas.set_current_item(self.current_shape)
 
+    def select_freehand(self):
+        self.current_shape = "freehand"
+        self.graphicsView_canvas.set_current_item(self.current_shape)
+
+    def select_spline(self):
+        self.current_shape = "spline"
+        self.graphicsView_canvas.set_current_item(self.current_shape)
+
     def add_item_to_drawing_list(self, item: QtWidgets.QGraphicsItem):
         """
         gets used when a new item is pasted in the scene
         :param item:
         :return:
         """
-        self.drawing_items_list.append(item)
+        self.history.add_items([item])
 
-    @staticmethod
-    def remove_item_from_scene(item: QtWidgets.QGraphicsItem):
+    def item_placement_changed(self, args):
+        item, old_placement, merge_key = args
+        self.history.item_placement_changed(item, history.Placement(*old_placement), merge_key)
+
+    def remove_item_from_scene(self, item: QtWidgets.QGraphicsItem):
+        self.selection_index.remove(item)
         _scene = item.scene()
         if _scene:
             _scene.removeItem(item)
 
     @QtCore.pyqtSlot()
     def undo_item(self):  # action on Ctrl+Z
-        if self.drawing_items_list:
-            self.remove_item_from_scene(self.drawing_items_list[-1])
-            self.drawing_items_list.pop()
+        self.clear_selection_rect()
+        self.graphicsView_canvas.cancel_item_move()
+        self.history.undo()
+
+    @QtCore.pyqtSlot()
+    def redo_item(self):  # action on Ctrl+Shift+Z
+        self.clear_selection_rect()
+        self.graphicsView_canvas.cancel_item_move()
+        self.history.redo()
 
     def select_delete(self):
         if self.selected_item:
-            self.remove_item_from_scene(self.selected_item)
-            if self.selected_item in self.drawing_items_list:
-                self.drawing_items_list.remove(self.selected_item)
+            self.graphicsView_canvas.cancel_item_move()
+            self.history.remove_items([self.selected_item])
             self.selected_item = None
             self.remove_item_from_scene(self.selected_rect_item)
             self.selected_item = None
             self.selected_rect_item = None
 
-    @staticmethod
-    def draw_when_grid_on(grid_size, act_pos1):
-        if (act_pos1 % grid_size) < grid_size / 2:
-            counted_pos = (act_pos1 // grid_size) * grid_size
-        else:
-            counted_pos = (act_pos1 // grid_size) * grid_size + grid_size
-        return counted_pos
+    def _temp_drawing_pen(self) -> QtGui.QPen:
+        # temp drawing pen with red color and dotted line
+        return style_cache.pen("#ea353e", self.point_size, Qt.DotLine)
 
-    def draw_line(self, args):
-        start_pos, end_pos = args
+    def _drawing_pen(self) -> QtGui.QPen:
+        if self.temp_drawing_activated:
+            return self._temp_drawing_pen()
+        return style_cache.pen(self.current_pen_color, self.point_size, self.line_style)
+
+    def _drag_coordinates(self, start_pos: QtCore.QPointF, end_pos: QtCore.QPointF):
+        coordinates = (start_pos.x(), start_pos.y(), end_pos.x(), end_pos.y())
         if self.actionShow_Grid.isChecked():
-            start_pos_x = self.draw_when_grid_on(self.grid_size, start_pos.x())
-            start_pos_y = self.draw_when_grid_on(self.grid_size, start_pos.y())
-            end_pos_x = self.draw_when_grid_on(self.grid_size, end_pos.x())
-            end_pos_y = self.draw_when_grid_on(self.grid_size, end_pos.y())
-            _pen = QtGui.QPen(self.current_pen_color, self.point_size, self.line_style)
-            if self.temp_drawing_activated and self.temp_drawing_item:
-                self.remove_item_from_scene(self.temp_drawing_item)
-                _pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
-
-            graphics_item = self._scene.addLine(start_pos_x, start_pos_y, end_pos_x, end_pos_y,
-                                                pen=_pen)
-
-            if self.temp_drawing_activated:
-                self.temp_drawing_item = graphics_item
-            else:
-                self.drawing_items_list.append(graphics_item)
+            coordinates = tuple(snapping.snap(coordinates, self.grid_size).tolist())
+        return coordinates
 
-            self._scene.update()
-        else:
-            _pen = QtGui.QPen(self.current_pen_color, self.point_size, self.line_style)
-            if self.temp_drawing_activated and self.temp_drawing_item:
-                self.remove_item_from_scene(self.temp_drawing_item)
-                _pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
-
-            graphics_item = self._scene.addLine(start_pos.x(), start_pos.y(), end_pos.x(), end_pos.y(),
-                                                pen=_pen)
-            if self.temp_drawing_activated:
-                self.temp_drawing_item = graphics_item
-            else:
-                self.drawing_items_list.append(graphics_item)
-            self._scene.update()
+    def _finish_drawing_item(self, graphics_item: QtWidgets.QGraphicsItem):
+        """
+        while dragging the preview item is only updated in place, once the drag is released
+        the same item gets committed to the scene
+        """
+        if not self.temp_drawing_activated:
+            self.preview.commit()
+            self.selection_index.insert(graphics_item)
+            self.history.add_items([graphics_item])
+            tracer.counter("undo steps", len(self.history))
+
+    @traced("draw_line")
+    def draw_line(self, args):
+        start_pos, end_pos = args
+        graphics_item = self.preview.line(*self._drag_coordinates(start_pos, end_pos), self._drawing_pen())
+        self._finish_drawing_item(graphics_item)
 
+    @traced("draw_polyline")
     def draw_polyline(self, args):
+        """
+        the preview shows the next segment while dragging, on release its end point is appended to the polyline
+        item in place, the polyline is committed as a whole by `finish_polyline`
+        """
         start_pos, end_pos = args
+        if self._polyline is not None:
+            start_pos = self._polyline.last_point()
+        start_x, start_y, end_x, end_y = self._drag_coordinates(start_pos, end_pos)
+        if self.temp_drawing_activated:
+            self.preview.line(start_x, start_y, end_x, end_y, self._drawing_pen())
+            return
+        self.preview.discard()
+        if self._polyline is None:
+            self._polyline = shapes.PolylineItem()
+            self._polyline.setPen(self._drawing_pen())
+            self._polyline.append(QtCore.QPointF(start_x, start_y))
+            self._scene.addItem(self._polyline)
+            self.graphicsView_canvas.is_first_line = False
+        self._polyline.append(QtCore.QPointF(end_x, end_y))
+
+    @traced("draw_freehand")
+    def draw_freehand(self, stroke: freehand.FreehandStroke):
+        """
+        shows the raw stroke while drawing, on release the smoothed path of the finished stroke gets committed
+        """
+        graphics_item = self.preview.path(stroke.path, self._drawing_pen())
+        if self.temp_drawing_activated:
+            return
+        if stroke.vertex_count < 2:  # a click without moving draws nothing
+            self.preview.discard()
+            return
+        self._finish_drawing_item(graphics_item)
+        tracer.counter("freehand samples", stroke.sample_count)
+        tracer.counter("freehand vertices", stroke.vertex_count)
+        self.show_status_bar_message(f"Freehand stroke: {stroke.sample_count} samples, "
+                                     f"{stroke.vertex_count} vertices")
+
+    def finish_shape(self):
+        self.finish_polyline()
+        self.finish_spline()
+        self._hover_spline(None)
+
+    @traced("spline_event")
+    def spline_event(self, args):
+        """
+        spline tool: a click adds a knot, the last knot follows the pointer until the spline is finished (right
+        click), dragging a knot of the spline being drawn, or of a finished spline, moves that knot
+        """
+        kind, pos = args
         if self.actionShow_Grid.isChecked():
-            start_pos_x = self.draw_when_grid_on(self.grid_size, start_pos.x())
-            start_pos_y = self.draw_when_grid_on(self.grid_size, start_pos.y())
-            end_pos_x = self.draw_when_grid_on(self.grid_size, end_pos.x())
-            end_pos_y = self.draw_when_grid_on(self.grid_size, end_pos.y())
-            if self.graphicsView_canvas.is_first_line:
-                _pen = QtGui.QPen(self.current_pen_color, self.point_size, self.line_style)
-                if self.temp_drawing_activated and self.temp_drawing_item:
-                    self.remove_item_from_scene(self.temp_drawing_item)
-                    _pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
-                graphics_item = self._scene.addLine(start_pos_x, start_pos_y, end_pos_x, end_pos_y,
-                                                    pen=_pen)
-                if self.temp_drawing_activated:
-                    self.temp_drawing_item = graphics_item
-                else:
-                    self.drawing_items_list.append(graphics_item)
-                    self.graphicsView_canvas.is_first_line = False
+            pos = snapping.snap_point(pos, self.grid_size)
+        if kind == graphics_view.SPLINE_PRESS:
+            knot = self._knot_at(pos)
+            if knot is not None:
+                spline, index = knot
+                old = None if spline is self._spline else scene_snapshot.snapshot_item(spline)
+                self._knot_edit = (spline, index, old)
+                spline.show_knots = True
+            elif self._spline is None:
+                self._spline = shapes.SplineItem([(pos.x(), pos.y())] * 2)
+                self._spline.setPen(style_cache.pen(self.current_pen_color, self.point_size, self.line_style))
+                self._spline.show_knots = True
+                self._scene.addItem(self._spline)
             else:
-                _pen = QtGui.QPen(self.current_pen_color, self.point_size, self.line_style)
-                if self.temp_drawing_activated and self.temp_drawing_item:
-                    self.remove_item_from_scene(self.temp_drawing_item)
-                    _pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
-
-                graphics_item = self._scene.addLine(start_pos_x, start_pos_y, end_pos_x, end_pos_y,
-                                                    pen=_pen)
-                if self.temp_drawing_activated:
-                    self.temp_drawing_item = graphics_item
-                else:
-                    self.drawing_items_list.append(graphics_item)
-                    self.graphicsView_canvas.is_first_line = False
-        else:
-            if self.graphicsView_canvas.is_first_line:
-                _pen = QtGui.QPen(self.current_pen_color, self.point_size, self.line_style)
-                if self.temp_drawing_activated and self.temp_drawing_item:
-                    self.remove_item_from_scene(self.temp_drawing_item)
-                    _pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
-                graphics_item = self._scene.addLine(start_pos.x(), start_pos.y(), end_pos.x(), end_pos.y(),
-                                                    pen=_pen)
-                if self.temp_drawing_activated:
-                    self.temp_drawing_item = graphics_item
-                else:
-                    self.drawing_items_list.append(graphics_item)
-                    self.graphicsView_canvas.is_first_line = False
+                self._spline.append_knot(pos)
+        elif kind == graphics_view.SPLINE_MOVE:
+            if self._knot_edit is not None:
+                spline, index, _ = self._knot_edit
+                spline.move_knot(index, spline.mapFromScene(pos))
+            elif self._spline is not None:
+                self._spline.move_knot(len(self._spline) - 1, pos)
             else:
-                _pen = QtGui.QPen(self.current_pen_color, self.point_size, self.line_style)
-                if self.temp_drawing_activated and self.temp_drawing_item:
-                    self.remove_item_from_scene(self.temp_drawing_item)
-                    _pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
-
-                graphics_item = self._scene.addLine(start_pos.x(), start_pos.y(), end_pos.x(), end_pos.y(),
-                                                    pen=_pen)
-                if self.temp_drawing_activated:
-                    self.temp_drawing_item = graphics_item
-                else:
-                    self.drawing_items_list.append(graphics_item)
-                    self.graphicsView_canvas.is_first_line = False
-        self._scene.update()
+                item = self.graphicsView_canvas.item_at(pos)
+                self._hover_spline(item if isinstance(item, shapes.SplineItem) else None)
+        elif self._knot_edit is not None:  # release
+            spline, _, old = self._knot_edit
+            self._knot_edit = None
+            if old is not None:  # knot of a finished spline, the edit is one undo step
+                self.history.item_reshaped(spline, old)
+                tracer.counter("undo steps", len(self.history))
+
+    def _knot_at(self, pos: QtCore.QPointF) -> typing.Union[None, typing.Tuple[shapes.SplineItem, int]]:
+        """
+        knot under the pointer, of the spline being drawn (not its last knot, that one is the pointer) or else of
+        a finished spline
+        """
+        radius = self.graphicsView_canvas.scene_length(2 * self.graphicsView_canvas.pick_radius)
+        if self._spline is not None:
+            index = self._spline.knot_at(pos, radius, len(self._spline) - 1)
+            return None if index is None else (self._spline, index)
+        item = self.graphicsView_canvas.item_at(pos)
+        if isinstance(item, shapes.SplineItem):
+            index = item.knot_at(item.mapFromScene(pos), radius)
+            if index is not None:
+                return item, index
+        return None
+
+    def _hover_spline(self, spline: typing.Union[None, shapes.SplineItem]):
+        if spline is self._hovered_spline:
+            return
+        if self._hovered_spline is not None:
+            self._hovered_spline.show_knots = False
+        self._hovered_spline = spline
+        if spline is not None:
+            spline.show_knots = True
+
+    def finish_spline(self):
+        """
+        commit the spline being drawn as one item, without the knot that followed the pointer
+        """
+        spline, self._spline = self._spline, None
+        self._knot_edit = None
+        if spline is None:
+            return
+        if len(spline) <= 2:  # only the first knot was placed
+            self._scene.removeItem(spline)
+            return
+        spline.remove_last_knot()
+        spline.show_knots = False
+        self.selection_index.insert(spline)
+        self.history.add_items([spline])
+        tracer.counter("undo steps", len(self.history))
 
+    def finish_polyline(self):
+        """
+        commit the polyline being drawn as one item (one undo step)
+        """
+        polyline, self._polyline = self._polyline, None
+        if polyline is None:
+            return
+        self.selection_index.insert(polyline)
+        self.history.add_items([polyline])
+        tracer.counter("undo steps", len(self.history))
+
+    @traced("draw_circle")
     def draw_circle(self, args):
         start_pos, end_pos = args
-        start_pos: QtCore.QPoint
-        end_pos: QtCore.QPoint
-        if self.actionShow_Grid.isChecked():
-            start_pos_x = self.draw_when_grid_on(self.grid_size, start_pos.x())
-            start_pos_y = self.draw_when_grid_on(self.grid_size, start_pos.y())
-            end_pos_x = self.draw_when_grid_on(self.grid_size, end_pos.x())
-            end_pos_y = self.draw_when_grid_on(self.grid_size, end_pos.y())
-            center_x = (start_pos_x + end_pos_x) / 2
-            center_y = (start_pos_y + end_pos_y) / 2
-            radius = self.distance_grid(start_pos_x, start_pos_y, end_pos_x, end_pos_y) / 2
-            center_pos = QtCore.QPointF(center_x, center_y)
-            inner_circle_radius = radius
-
-            tl2 = QtCore.QPointF(center_pos.x() - inner_circle_radius, center_pos.y() - inner_circle_radius)
-            br2 = QtCore.QPointF(center_pos.x() + inner_circle_radius, center_pos.y() + inner_circle_radius)
-
-            _pen = QtGui.QPen(self.current_pen_color, self.point_size, self.line_style)
-            _rect = QtCore.QRectF(tl2, br2)
-            if self.temp_drawing_activated and self.temp_drawing_item:
-                self.remove_item_from_scene(self.temp_drawing_item)
-                _pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
-
-            graphics_item = self._scene.addEllipse(_rect, _pen)
-            if self.temp_drawing_activated:
-                self.temp_drawing_item = graphics_item
-            else:
-                self.drawing_items_list.append(graphics_item)
-            self._scene.update()
-        else:
-            center_x = (start_pos.x() + end_pos.x()) / 2
-            center_y = (start_pos.y() + end_pos.y()) / 2
-            radius = self.distance(start_pos, end_pos) / 2
-            center_pos = QtCore.QPointF(center_x, center_y)
-            inner_circle_radius = radius
-
-            tl2 = QtCore.QPointF(center_pos.x() - inner_circle_radius, center_pos.y() - inner_circle_radius)
-            br2 = QtCore.QPointF(center_pos.x() + inner_circle_radius, center_pos.y() + inner_circle_radius)
-
-            _pen = QtGui.QPen(self.current_pen_color, self.point_size, self.line_style)
-            _rect = QtCore.QRectF(tl2, br2)
-            if self.temp_drawing_activated and self.temp_drawing_item:
-                self.remove_item_from_scene(self.temp_drawing_item)
-                _pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
-
-            graphics_item = self._scene.addEllipse(_rect, _pen)
-            if self.temp_drawing_activated:
-                self.temp_drawing_item = graphics_item
-            else:
-                self.drawing_items_list.append(graphics_item)
-            self._scene.update()
+        start_pos_x, start_pos_y, end_pos_x, end_pos_y = self._drag_coordinates(start_pos, end_pos)
+        center_pos = QtCore.QPointF((start_pos_x + end_pos_x) / 2, (start_pos_y + end_pos_y) / 2)
+        radius = self.distance_grid(start_pos_x, start_pos_y, end_pos_x, end_pos_y) / 2
+
+        tl2 = QtCore.QPointF(center_pos.x() - radius, center_pos.y() - radius)
+        br2 = QtCore.QPointF(center_pos.x() + radius, center_pos.y() + radius)
+        graphics_item = self.preview.ellipse(QtCore.QRectF(tl2, br2), self._drawing_pen())
+        self._finish_drawing_item(graphics_item)
 
     def draw_selected_item_rect(self, args):
         rect_f: QtCore.QRectF = args[0]  # bounding rect
@@ -495,117 +886,45 @@ class MainWindow(QtWidgets.QMainWindow):
             self.selected_rect_item = None
             self.selected_item = None
 
+    @traced("draw_rectangle")
     def draw_rectangle(self, args):
         start_pos, end_pos = args
-        if self.actionShow_Grid.isChecked():
-            start_pos_x = self.draw_when_grid_on(self.grid_size, start_pos.x())
-            start_pos_y = self.draw_when_grid_on(self.grid_size, start_pos.y())
-            end_pos_x = self.draw_when_grid_on(self.grid_size, end_pos.x())
-            end_pos_y = self.draw_when_grid_on(self.grid_size, end_pos.y())
-            _rectF = QtCore.QRectF(start_pos_x, start_pos_y, end_pos_x - start_pos_x, end_pos_y - start_pos_y)
-            _pen = QtGui.QPen(self.current_pen_color, self.point_size, self.line_style)
-            if self.temp_drawing_activated and self.temp_drawing_item:
-                self.remove_item_from_scene(self.temp_drawing_item)
-                _pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
-
-            graphics_item = self._scene.addRect(_rectF, pen=_pen)
-            if self.temp_drawing_activated:
-                self.temp_drawing_item = graphics_item
-            else:
-                self.drawing_items_list.append(graphics_item)
-            self._scene.update()
-        else:
-            _rectF = QtCore.QRectF(start_pos, end_pos)
-            _pen = QtGui.QPen(self.current_pen_color, self.point_size, self.line_style)
-            if self.temp_drawing_activated and self.temp_drawing_item:
-                self.remove_item_from_scene(self.temp_drawing_item)
-                _pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
-
-            graphics_item = self._scene.addRect(_rectF, pen=_pen)
-            if self.temp_drawing_activated:
-                self.temp_drawing_item = graphics_item
-            else:
-                self.drawing_items_list.append(graphics_item)
-            self._scene.update()
+        start_pos_x, start_pos_y, end_pos_x, end_pos_y = self._drag_coordinates(start_pos, end_pos)
+        _rectF = QtCore.QRectF(start_pos_x, start_pos_y, end_pos_x - start_pos_x, end_pos_y - start_pos_y)
+        graphics_item = self.preview.rect(_rectF, self._drawing_pen())
+        self._finish_drawing_item(graphics_item)
 
+    @traced("draw_curve")
     def draw_curve(self, args):
         curve_points: Tuple[QtCore.QPoint] = args
         if self.actionShow_Grid.isChecked():
-            if len(curve_points) == 2:
-                print(curve_points[0].x())
-                self.points_grid.append(self.draw_when_grid_on(self.grid_size, curve_points[0].x()))
-                self.points_grid.append(self.draw_when_grid_on(self.grid_size, curve_points[0].y()))
-                self.points_grid.append(self.draw_when_grid_on(self.grid_size, curve_points[1].x()))
-                self.points_grid.append(self.draw_when_grid_on(self.grid_size, curve_points[1].y()))
-                _pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
-                graphics_item = self._scene.addLine(self.points_grid[0], self.points_grid[1], self.points_grid[2],
-                                                    self.points_grid[3], pen=_pen)
-                self.temp_drawing_item = graphics_item
-                self._scene.update()
-
-            elif len(curve_points) == 3:
-                self.points_grid.insert(4, self.draw_when_grid_on(self.grid_size, curve_points[2].x()))
-                self.points_grid.insert(5, self.draw_when_grid_on(self.grid_size, curve_points[2].y()))
-                print("1. ", len(self.points_grid))
-                if len(self.points_grid) > 6:
-                    print("2. ", len(self.points_grid))
-                    print(self.points_grid)
-                    del self.points_grid[6:]
-                self.remove_item_from_scene(self.temp_drawing_item)
-                _pen = QtGui.QPen(self.current_pen_color, self.point_size, self.line_style)
-                if self.temp_drawing_activated and self.temp_drawing_item:
-                    self.remove_item_from_scene(self.temp_drawing_item)
-                    _pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
-                graphics_item = self._scene.addPath(self.create_curve_grid(self.points_grid), _pen)
-                if self.temp_drawing_activated:
-                    self.temp_drawing_item = graphics_item
-                else:
-                    self.drawing_items_list.append(graphics_item)
-                    self.points_grid.clear()
-                    print(self.points_grid)
-        else:
-            if len(curve_points) == 2:
-                _pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
-                graphics_item = self._scene.addLine(curve_points[0].x(), curve_points[0].y(), curve_points[1].x(),
-                                                    curve_points[1].y(), pen=_pen)
-                self.temp_drawing_item = graphics_item
-                self._scene.update()
-
-            elif len(curve_points) == 3:
-                self.remove_item_from_scene(self.temp_drawing_item)
-                _pen = QtGui.QPen(self.current_pen_color, self.point_size, self.line_style)
-                if self.temp_drawing_activated and self.temp_drawing_item:
-                    self.remove_item_from_scene(self.temp_drawing_item)
-                    _pen = QtGui.QPen(QtGui.QColor("#ea353e"), self.point_size, Qt.DotLine)
-                graphics_item = self._scene.addPath(self.create_curve(*curve_points), _pen)
-                if self.temp_drawing_activated:
-                    self.temp_drawing_item = graphics_item
-                else:
-                    self.drawing_items_list.append(graphics_item)
-                    self.points_grid.clear()
-                    print(self.points_grid)
-        self._scene.update()
+            curve_points = snapping.to_qpoints(snapping.snap_points(curve_points, self.grid_size))
+        if len(curve_points) == 2:
+            # guide line between the two end points, stays as preview until the control point is placed
+            line = (curve_points[0].x(), curve_points[0].y(), curve_points[1].x(), curve_points[1].y())
+            self.preview.line(*line, self._temp_drawing_pen())
+
+        elif len(curve_points) == 3:
+            path = self.create_curve(*curve_points)
+            graphics_item = self.preview.path(path, self._drawing_pen())
+            self._finish_drawing_item(graphics_item)
 
     @staticmethod
+    @traced("create_curve")
     def create_curve(*points):
         path = QtGui.QPainterPath()
         path.moveTo(points[0])
         path.cubicTo(points[0], points[2], points[1])
-        print(*points)
-        return path
-
-    def create_curve_grid(self, points):
-        path = QtGui.QPainterPath()
-        path.moveTo(points[0], points[1])
-        path.cubicTo(points[0], points[1], points[4], points[5], points[2], points[3])
-        print(*points)
         return path
 
+    @traced("draw_text")
     def draw_text(self, args):
         text, text_pos = args
         text_item = self._scene.addText(text, self.current_font)
         text_item.setPos(text_pos.x(), text_pos.y())
         text_item.setDefaultTextColor(self.current_pen_color)
+        self.selection_index.insert(text_item)
+        self.history.add_items([text_item])
         self.ui.pushButton_text_inp_pos.setChecked(False)
 
     def set_text_input_pos(self):
@@ -621,21 +940,17 @@ class MainWindow(QtWidgets.QMainWindow):
         self.current_mouse_pos = mouse_pos
         self.ui.label_pointer.setText(f"x: {mouse_pos.x()}, y: {mouse_pos.y()}")
 
-    def change_cursor(self, cursor_type: QtCore.Qt.CursorShape):
-        self.setCursor(QtGui.QCursor(cursor_type))
-        self.graphicsView_canvas.setCursor(QtGui.QCursor(cursor_type))
-
-    def custom_mouse_pos_check(self) -> None:
-        if self.graphicsView_canvas.underMouse():
-            pass
-        else:
-            self.change_cursor(QtCore.Qt.ArrowCursor)
-
     def keyPressEvent(self, event: QtGui.QKeyEvent) -> None:
         if event.key() == QtCore.Qt.Key_Delete:
             self.select_delete()
         super(MainWindow, self).keyPressEvent(event)
 
+    def closeEvent(self, event: QtGui.QCloseEvent) -> None:
+        self.close_journal()
+        self.stop_input_recording()
+        self.stop_trace_recording()
+        super(MainWindow, self).closeEvent(event)
+
     def resizeEvent(self, event: QtGui.QResizeEvent) -> None:
         # if scene has fixed size, handling resizeEvent is not required for accurate scaling
         # self._scene.setSceneRect(0, 0, self.graphicsView_canvas.viewport().width(),
@@ -682,131 +997,99 @@ class MainWindow(QtWidgets.QMainWindow):
     def load_svg(self):
         file_name, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Open Image", "", "Image Files (*.svg)")
         if file_name:
-            svg = SVG.parse(file_name)
-            print(list(svg.elements()))  # the whole list of svg elements
-            print(svg[2])  # list of elements we need
-            used_elements = svg[2]
-            used_elements_len = len(used_elements)
-            print(used_elements_len)
-
-            for i in range(0, used_elements_len):  # starting from 3, because the first rect is useless
-                fn = used_elements[i]
-                if fn:  # if it is not empty
-
-                    # using list comprehension
-                    listToStr = ' '.join([str(elem) for elem in fn])
-
-                    print(listToStr)
-                    separator = listToStr.find("(")
-                    element = listToStr[:separator]
-                    separator = listToStr.find(" ")
-                    is_path = listToStr[:separator]
-                    if element == 'Polyline':
-                        start_x = fn[0].points[0].x
-                        start_y = fn[0].points[0].y
-                        end_x = fn[0].points[1].x
-                        end_y = fn[0].points[1].y
-                        color = fn.values['stroke']
-                        pen_size = int(round(float(fn.values['stroke-width'])))
-                        self.lines.append([start_x, start_y, end_x, end_y, color, pen_size])
-                    elif element == 'Circle' or element == 'Ellipse':
-                        cx = fn[0].cx
-                        cy = fn[0].cy
-                        r = fn[0].implicit_r
-                        color = fn.values['stroke']
-                        pen_size = int(round(float(fn.values['stroke-width'])))
-                        self.circles.append([cx, cy, r, color, pen_size])
-                    elif element == 'Rect':
-                        separator1 = listToStr.find("fill='") + 6
-                        separator2 = listToStr.find("f'") - 1
-                        separator3 = listToStr.find("x=")
-                        # print(separator3)
-                        error = listToStr[separator1:separator2]
-                        # print(error)
-                        if separator3 == -1:
-                            print("grid")
-                            pass
-                        else:
-                            x = fn[0].x
-                            y = fn[0].y
-                            width = fn[0].width
-                            height = fn[0].height
-                            color = fn.values['stroke']
-                            pen_size = int(round(float(fn.values['stroke-width'])))
-                            self.rects.append([x, y, width, height, color, pen_size])
-
-                    elif element == 'Text':
-                        x = fn[0].transform.e
-                        y = fn[0].transform.f
-                        text = fn[0].text
-                        font_family = fn[0].font_family
-                        color = fn.values['stroke']
-                        font_size = int(fn[0].font_size)
-                        self.texts.append([text, x, y, font_family, font_size, color])
-
-                    if is_path == "M":
-                        points = fn[0]._segments[1]
-                        start_x = points.start.x
-                        start_y = points.start.y
-                        middle_x = points.control2.x
-                        middle_y = points.control2.y
-                        end_x = points.end.x
-                        end_y = points.end.y
-                        color = fn.values['stroke']
-                        pen_size = int(round(float(fn.values['stroke-width'])))
-                        self.curves.append([start_x, start_y, middle_x, middle_y, end_x, end_y, color, pen_size])
-                else:
-                    print("empty")
-        self.draw_svg(self.lines, self.circles, self.rects, self.texts, self.curves)
-
-    def draw_svg(self, lines, circles, rects, texts, curves):
-        for i in range(len(self.lines)):
-            line = lines[i]
-            print(line)
-            _pen = QtGui.QPen(QtGui.QColor(line[4]), (line[5]))
-            self._scene.addLine(line[0], line[1], line[2], line[3], pen=_pen)
-            print("line added")
-
-        for i in range(len(self.circles)):
-            circle = circles[i]
-            print(circle)
-            _pen = QtGui.QPen(QtGui.QColor(circle[3]), (circle[4]))
-            self._scene.addEllipse(circle[0] - circle[2], circle[1] - circle[2], circle[2] * 2, circle[2] * 2, pen=_pen)
-            print("circle added")
-
-        for i in range(len(self.rects)):
-            rect = rects[i]
-            print(rect)
-            _pen = QtGui.QPen(QtGui.QColor(rect[4]), (rect[5]))
-            self._scene.addRect(rect[0], rect[1], rect[2], rect[3], pen=_pen)
-            print("rect added")
-        for i in range(len(self.texts)):
-            text = texts[i]
-            font = QtGui.QFont(text[3], text[4])
-            text_item = self._scene.addText(text[0], font)
-            text_item.setPos(text[1], text[2])
-        for i in range(len(self.curves)):
-            curve = curves[i]
-            path = QtGui.QPainterPath()
-            path.moveTo(curve[0], curve[1])
-            path.cubicTo(curve[0], curve[1], curve[2], curve[3], curve[4], curve[5])
-            _pen = QtGui.QPen(QtGui.QColor(curve[6]), (curve[7]))
-            self._scene.addPath(path, pen=_pen)
-
-        self.lines.clear()
-        self.circles.clear()
-        self.rects.clear()
-        self.texts.clear()
-        self.curves.clear()
-        self._scene.update()
+            self.import_svg(file_name)
 
-    def activate_mouse_check_timer(self):
+    def import_svg(self, file_name: str):
         """
-        activate mouse check timer
+        parse the svg in a worker thread, the elements are added to the scene chunk by chunk as they arrive
         """
-        self.mouse_check_timer = QtCore.QTimer()
-        self.mouse_check_timer.timeout.connect(self.custom_mouse_pos_check)
-        self.mouse_check_timer.start(100)
+        if self._svg_import_thread is not None:
+            self.show_status_bar_message("An SVG import is already running")
+            return
+        tracer.instant("load_svg", file=file_name)
+        self._svg_import_items = []
+        self._svg_import_progress = QtWidgets.QProgressDialog("Importing SVG...", "Cancel", 0, 100, self)
+        self._svg_import_progress.setWindowTitle("Load SVG")
+        self._svg_import_progress.setWindowModality(Qt.WindowModal)
+        self._svg_import_progress.setMinimumDuration(0)
+        self._svg_import_progress.setAutoClose(False)
+        self._svg_import_progress.setAutoReset(False)
+
+        self._svg_import_thread = QtCore.QThread(self)
+        self._svg_import_worker = svg_import.SvgImportWorker(file_name)
+        self._svg_import_worker.moveToThread(self._svg_import_thread)
+        self._svg_import_thread.started.connect(self._svg_import_worker.run)
+        self._svg_import_worker.chunk_ready.connect(self._svg_chunk_ready)
+        self._svg_import_worker.progress.connect(self._svg_import_progress.setValue)
+        self._svg_import_worker.status.connect(self._svg_import_progress.setLabelText)
+        self._svg_import_worker.failed.connect(self.show_status_bar_message)
+        self._svg_import_worker.finished.connect(self._svg_import_finished)
+        # direct: the worker thread is busy in run(), a queued call would only be delivered once the import is done
+        self._svg_import_progress.canceled.connect(self._svg_import_worker.cancel, Qt.DirectConnection)
+        self._svg_import_index = SuspendedIndex(self._scene)  # chunks are inserted without rebuilding the index
+        self._svg_import_thread.start()
+
+    @QtCore.pyqtSlot(object)
+    def _svg_chunk_ready(self, chunk: svg_import.SvgChunk):
+        if not self._svg_import_worker.is_cancelled():
+            self._svg_import_items.extend(self.draw_svg(*chunk))
+            tracer.counter("svg imported items", len(self._svg_import_items))
+        self._svg_import_worker.chunk_consumed()
+
+    @QtCore.pyqtSlot(bool)
+    def _svg_import_finished(self, completed: bool):
+        if not completed or self._svg_import_worker.is_cancelled():
+            # roll back the partially imported document
+            for item in self._svg_import_items:
+                self.remove_item_from_scene(item)
+        else:
+            self.history.add_items(self._svg_import_items)
+            self.show_status_bar_message(f"Imported {len(self._svg_import_items)} SVG elements")
+        self._svg_import_index.restore()
+        self._svg_import_index = None
+        self._svg_import_items = []
+        self._svg_import_progress.close()
+        self._svg_import_thread.quit()
+        self._svg_import_thread.wait()
+        self._svg_import_worker.deleteLater()
+        self._svg_import_thread.deleteLater()
+        self._svg_import_progress.deleteLater()
+        self._svg_import_thread = None
+        self._svg_import_worker = None
+        self._svg_import_progress = None
+
+    @traced("draw_svg")
+    def draw_svg(self, lines, circles, rects, texts, curves) -> typing.List[QtWidgets.QGraphicsItem]:
+        with BulkInsert(self._scene) as bulk:
+            for line in lines:
+                line_item = QtWidgets.QGraphicsLineItem(line[0], line[1], line[2], line[3])
+                line_item.setPen(style_cache.pen(line[4], line[5]))
+                bulk.add(line_item)
+
+            for circle in circles:
+                circle_item = QtWidgets.QGraphicsEllipseItem(circle[0] - circle[2], circle[1] - circle[2],
+                                                             circle[2] * 2, circle[2] * 2)
+                circle_item.setPen(style_cache.pen(circle[3], circle[4]))
+                bulk.add(circle_item)
+
+            for rect in rects:
+                rect_item = QtWidgets.QGraphicsRectItem(rect[0], rect[1], rect[2], rect[3])
+                rect_item.setPen(style_cache.pen(rect[4], rect[5]))
+                bulk.add(rect_item)
+
+            for text in texts:
+                text_item = QtWidgets.QGraphicsTextItem(text[0])
+                text_item.setFont(QtGui.QFont(text[3], text[4]))
+                text_item.setDefaultTextColor(QtGui.QColor(text[5]))
+                text_item.setPos(text[1], text[2])
+                bulk.add(text_item)
+
+            for curve in curves:  # whole svg paths, one item per element
+                curve_item = QtWidgets.QGraphicsPathItem(curve[0])
+                curve_item.setPen(style_cache.pen(curve[1], curve[2]))
+                bulk.add(curve_item)
+        self.selection_index.insert_many(bulk.inserted_items)
+        return bulk.inserted_items
 
 
 if __name__ == '__main__':
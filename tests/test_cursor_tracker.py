@@ -0,0 +1,38 @@
+from PyQt5 import QtCore, QtGui, QtTest, QtWidgets
+from PyQt5.QtCore import Qt
+
+
+def move_mouse(widget: QtWidgets.QWidget, x: int, y: int):
+    event = QtGui.QMouseEvent(QtCore.QEvent.MouseMove, QtCore.QPointF(x, y), Qt.NoButton, Qt.NoButton,
+                              Qt.NoModifier)
+    QtWidgets.QApplication.sendEvent(widget, event)
+
+
+def test_no_set_cursor_calls_while_idle(window):
+    view = window.graphicsView_canvas
+    tracker = view.cursor_tracker
+    move_mouse(view.viewport(), 40, 40)
+    QtTest.QTest.qWait(100)  # coalesced moves are processed on the next frame
+    calls = tracker.set_cursor_calls
+    QtTest.QTest.qWait(500)
+    assert tracker.set_cursor_calls == calls
+
+
+def test_set_cursor_only_on_shape_change(window):
+    view = window.graphicsView_canvas
+    view.coalesce_mouse_moves = False
+    tracker = view.cursor_tracker
+    window.draw_svg([[100, 100, 300, 100, "#333333", 4]], [], [], [], [])
+    move_mouse(view.viewport(), 20, 20)
+    calls = tracker.set_cursor_calls
+    for x in range(20, 60):  # empty canvas, the cross cursor stays
+        move_mouse(view.viewport(), x, 20)
+    assert tracker.set_cursor_calls == calls
+    line = view.mapFromScene(QtCore.QPointF(200, 100))
+    move_mouse(view.viewport(), line.x(), line.y())
+    move_mouse(view.viewport(), line.x() + 1, line.y())
+    assert tracker.shape == Qt.PointingHandCursor
+    assert tracker.set_cursor_calls == calls + 1
+    move_mouse(view.viewport(), 20, 20)
+    assert tracker.shape == Qt.CrossCursor
+    assert tracker.set_cursor_calls == calls + 2
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+from PyQt5 import QtGui, QtWidgets
+from PyQt5.QtCore import Qt
+
+from UI import export
+
+
+@pytest.fixture
+def scene(app):
+    scene = QtWidgets.QGraphicsScene(0, 0, 400, 300)
+    scene.addLine(0, 150, 400, 150, QtGui.QPen(Qt.red, 6))
+    scene.addRect(50, 50, 100, 60, QtGui.QPen(Qt.blue, 4))
+    yield scene
+    scene.clear()
+
+
+@pytest.mark.parametrize("extension", [".png", ".bmp", ".jpg"])
+def test_export_formats(scene, tmp_path, extension):
+    file_name = os.path.join(tmp_path, "out" + extension)
+    options = export.ExportOptions(401, 301, tile_size=64)  # odd width, bmp rows are padded
+    assert export.export_scene_image(scene, file_name, options)
+    image = QtGui.QImage(file_name)
+    assert image.size() == QtGui.QImage(401, 301, QtGui.QImage.Format_RGB32).size()
+    assert QtGui.QColor(image.pixel(200, 150)).red() > 200  # the red line, rows in top to bottom order
+    assert QtGui.QColor(image.pixel(200, 150)).blue() < 60
+    assert QtGui.QColor(image.pixel(200, 20)).lightness() > 240
+
+
+def test_streamed_formats_match(scene, tmp_path):
+    images = []
+    for extension in (".png", ".bmp"):
+        file_name = os.path.join(tmp_path, "out" + extension)
+        assert export.export_scene_image(scene, file_name, export.ExportOptions(333, 250, tile_size=50))
+        images.append(QtGui.QImage(file_name).convertToFormat(QtGui.QImage.Format_RGB32))
+    assert images[0] == images[1]
+
+
+def test_stitched_formats_are_limited(scene, tmp_path):
+    file_name = os.path.join(tmp_path, "huge.jpg")
+    with open(file_name, "wb") as f:
+        f.write(b"previous export")
+    with pytest.raises(export.ExportError):
+        export.export_scene_image(scene, file_name, export.ExportOptions(20000, 20000))
+    with open(file_name, "rb") as f:
+        assert f.read() == b"previous export"  # refused before the file is touched
+    export.check_size(os.path.join(tmp_path, "huge.png"), 20000, 20000)
+    export.check_size(os.path.join(tmp_path, "huge.bmp"), 20000, 20000)
+
+
+def test_cancelled_export_removes_file(scene, tmp_path):
+    file_name = os.path.join(tmp_path, "out.bmp")
+    assert not export.export_scene_image(scene, file_name, export.ExportOptions(400, 300, tile_size=10),
+                                         is_cancelled=lambda: True)
+    assert not os.path.exists(file_name)
@@ -0,0 +1,23 @@
+import pytest
+from PyQt5 import QtCore, QtGui
+
+from UI import grid
+
+
+@pytest.mark.parametrize("size, scale_x, scale_y", [(0, 1, 1), (10, 0, 1), (10, 1, 0), (10, float("inf"), 1)])
+def test_degenerate_spacing_draws_no_grid(app, size, scale_x, scale_y):
+    painter_grid = grid.GridPainter(size)
+    assert painter_grid.tile(scale_x, scale_y) is None
+    image = QtGui.QImage(64, 64, QtGui.QImage.Format_ARGB32_Premultiplied)
+    image.fill(0)
+    painter = QtGui.QPainter(image)
+    painter.scale(scale_x, scale_y)
+    painter_grid.paint(painter, QtCore.QRectF(0, 0, 64, 64))  # returns instead of looping forever
+    painter.end()
+    assert painter_grid.tiles_built == 0
+
+
+def test_dense_grid_skips_lines(app):
+    tile, spacing_x, spacing_y = grid.GridPainter(10).tile(0.1, 0.25)
+    assert (spacing_x, spacing_y) == (grid.MIN_SPACING, 5.0)
+    assert not tile.isNull()
@@ -0,0 +1,76 @@
+import os
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import Qt
+
+from UI import history, journal, project_format, scene_snapshot
+
+
+def path_item(x: float) -> QtWidgets.QGraphicsPathItem:
+    path = QtGui.QPainterPath(QtCore.QPointF(x, 0))
+    path.cubicTo(x + 10, 40, x + 30, -40, x + 40, 0)
+    item = QtWidgets.QGraphicsPathItem(path)
+    item.setPen(QtGui.QPen(Qt.black, 2))
+    return item
+
+
+def open_journal(file_name: str, document: history.History) -> journal.Journal:
+    snapshot, item_ids = journal.capture(document)
+    journal_id = journal.new_journal_id()
+    project_format.save_project(file_name, snapshot, item_ids=item_ids, journal_id=journal_id)
+    return journal.Journal(file_name, document, journal_id)
+
+
+def test_reshaped_items_keep_their_stacking_order(app, tmp_path):
+    scene = QtWidgets.QGraphicsScene(0, 0, 400, 300)
+    document = history.History(scene)
+    items = [path_item(x) for x in (0, 50, 100)]
+    for item in items:
+        scene.addItem(item)
+    document.add_items(items)
+    file_name = str(tmp_path / "drawing.iep")
+    edits = open_journal(file_name, document)
+
+    middle = items[1]
+    old = scene_snapshot.snapshot_item(middle)
+    reshaped = QtGui.QPainterPath(QtCore.QPointF(50, 0))
+    reshaped.lineTo(90, 80)
+    middle.setPath(reshaped)
+    document.item_reshaped(middle, old)
+    document.undo()
+    document.redo()
+    edits.close()
+
+    assert list(document.items) == [1, 2, 3]
+    assert scene.items(order=Qt.AscendingOrder) == list(document.items.values())
+    project = project_format.load_project(file_name)
+    recovered = journal.replay(file_name, project)
+    assert recovered.edits == 1  # reshape, undo and redo fold into one record
+    assert recovered.item_ids == [1, 2, 3]
+    assert recovered.items[1].path().boundingRect() == reshaped.boundingRect()
+    scene.clear()
+
+
+def test_added_images_reference_their_file_until_compaction(app, tmp_path):
+    pixels = os.urandom(256 * 256 * 4)  # noise, the png stays large
+    image = QtGui.QImage(pixels, 256, 256, QtGui.QImage.Format_RGB32)
+    source = str(tmp_path / "photo.png")
+    assert image.save(source)
+    scene = QtWidgets.QGraphicsScene(0, 0, 400, 300)
+    document = history.History(scene)
+    file_name = str(tmp_path / "drawing.iep")
+    edits = open_journal(file_name, document)
+
+    item = scene.addPixmap(QtGui.QPixmap.fromImage(image))
+    item.setData(Qt.UserRole, source)
+    document.add_items([item])
+    edits.sync()
+    assert os.path.getsize(journal.journal_file(file_name)) < 4096 < os.path.getsize(source)
+    recovered = journal.replay(file_name, project_format.load_project(file_name))
+    assert recovered.items[0].pixmap().toImage().convertToFormat(image.format()) == image
+
+    edits.compact()
+    edits.close()
+    assert os.path.getsize(file_name) > os.path.getsize(source)  # the saved project holds the image
+    assert project_format.load_project(file_name).items[0].pixmap().size() == image.size()
+    scene.clear()
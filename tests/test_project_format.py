@@ -0,0 +1,38 @@
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import Qt
+
+from UI import project_format, scene_snapshot
+
+
+def round_trip(scene: QtWidgets.QGraphicsScene) -> project_format.Project:
+    return project_format.loads_project(project_format.dumps_project(scene_snapshot.SceneSnapshot.capture(scene)))
+
+
+def test_scene_rect_round_trip(app):
+    scene = QtWidgets.QGraphicsScene(-20, 10, 1000, 800)
+    scene.setBackgroundBrush(QtGui.QColor("#abcdef"))
+    scene.addLine(0, 0, 100, 100, QtGui.QPen(Qt.red, 2))
+    image = QtGui.QImage(64, 48, QtGui.QImage.Format_RGB32)
+    image.fill(Qt.blue)
+    scene.addPixmap(QtGui.QPixmap.fromImage(image)).setPos(30, 40)
+    project = round_trip(scene)
+    assert project.scene_rect == QtCore.QRectF(-20, 10, 1000, 800)
+    assert project.background.color() == QtGui.QColor("#abcdef")
+    assert len(project.items) == 2
+    pixmap = next(item for item in project.items if isinstance(item, QtWidgets.QGraphicsPixmapItem))
+    assert pixmap.pixmap().size() == image.size()
+    assert pixmap.mapToScene(0, 0) == QtCore.QPointF(30, 40)
+    scene.clear()
+
+
+def test_preview_image_keeps_display_size(app, tmp_path):
+    file_name = str(tmp_path / "original.png")
+    original = QtGui.QImage(400, 300, QtGui.QImage.Format_RGB32)
+    original.fill(Qt.green)
+    assert original.save(file_name)
+    record = scene_snapshot.ItemRecord(scene_snapshot.PIXMAP, original.scaled(40, 30), QtGui.QTransform(),
+                                       offset=QtCore.QPointF(), source=file_name, size=QtCore.QSizeF(400, 300))
+    snapshot = scene_snapshot.SceneSnapshot((record,), QtCore.QRectF(0, 0, 640, 480), QtGui.QBrush())
+    project = project_format.loads_project(project_format.dumps_project(snapshot))
+    assert project.scene_rect == QtCore.QRectF(0, 0, 640, 480)
+    assert project.items[0].boundingRect().size() == QtCore.QSizeF(400, 300)
@@ -0,0 +1,48 @@
+"""
+Replays a recorded editing session (tests/data/editing_session.inrec: 25 line drags with hover moves in between,
+then picking, rotating, dragging, copying and pasting ten of the lines) through the real canvas handlers.
+
+The latency budgets are far above the times of a current build on a laptop, they catch hot path regressions (per
+item work, re-created scene items, full scene repaints per event), not noise. IMAGEEDIT_LATENCY_BUDGET_SCALE
+scales them for slow machines.
+"""
+import os
+import random
+
+from UI import input_recorder
+
+SESSION = os.path.join(os.path.dirname(__file__), "data", "editing_session.inrec")
+SESSION_ITEMS = 34  # document items after replaying the session onto an empty canvas
+BACKGROUND_ITEMS = 1000
+EVENT_BUDGET_MS = 4.0  # p99 handling time of every event kind
+FRAME_BUDGET_MS = 16.0  # p99 render time, one frame at 60 Hz
+BUDGET_SCALE = float(os.environ.get("IMAGEEDIT_LATENCY_BUDGET_SCALE", 1))
+
+
+def fill_scene(window, count: int):
+    rnd = random.Random(count)
+    lines = []
+    for _ in range(count):
+        x, y = rnd.uniform(0, 1500), rnd.uniform(0, 900)
+        lines.append([x, y, x + rnd.uniform(-30, 30), y + rnd.uniform(-30, 30), "#333333", 1])
+    window.draw_svg(lines, [], [], [], [])
+
+
+def replay(window, render: bool) -> input_recorder.ReplayStats:
+    window.select_line()
+    return input_recorder.InputReplayer(window.graphicsView_canvas).replay(input_recorder.load_records(SESSION),
+                                                                           render=render)
+
+
+def test_replay_reproduces_session(window):
+    replay(window, render=False)
+    assert len(window.history.items) == SESSION_ITEMS
+
+
+def test_replay_latency_within_budget(window):
+    fill_scene(window, BACKGROUND_ITEMS)
+    summary = replay(window, render=True).summary()
+    assert summary["mouse_move"]["count"] > 1000
+    over_budget = {name: stats["p99_ms"] for name, stats in summary.items()
+                   if stats["p99_ms"] > (FRAME_BUDGET_MS if name == "frame" else EVENT_BUDGET_MS) * BUDGET_SCALE}
+    assert not over_budget, f"p99 latency (ms) over budget: {over_budget}"
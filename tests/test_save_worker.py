@@ -0,0 +1,63 @@
+import os
+import time
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import Qt
+
+from UI import export, graphics_view, scene_snapshot
+
+
+def wait_for(predicate, timeout: float = 60):
+    started = time.perf_counter()
+    while not predicate():
+        assert time.perf_counter() - started < timeout, "timed out"
+        QtWidgets.QApplication.processEvents(QtCore.QEventLoop.AllEvents, 10)
+
+
+def save(window, file_name: str, **kwargs) -> str:
+    window._start_save(file_name, **kwargs)
+    wait_for(lambda: window._save_thread is None)
+    return window.ui.statusbar.currentMessage()
+
+
+def draw(window):
+    line = window._scene.addLine(10, 10, 300, 200, QtGui.QPen(Qt.red, 4))
+    window.history.add_items([line])
+
+
+def test_save_image(window, tmp_path):
+    draw(window)
+    file_name = os.path.join(tmp_path, "out.png")
+    assert save(window, file_name, options=export.ExportOptions(320, 240)) == f"Saved {file_name}"
+    assert QtGui.QImage(file_name).width() == 320
+
+
+def test_save_svg(window, tmp_path):
+    draw(window)
+    file_name = os.path.join(tmp_path, "out.svg")
+    assert save(window, file_name, svg_size=QtCore.QSize(320, 240)) == f"Saved {file_name}"
+    with open(file_name) as f:
+        assert "<svg" in f.read()
+
+
+def test_save_errors_are_reported(window, tmp_path):
+    draw(window)
+    for file_name, kwargs in ((os.path.join(tmp_path, "missing", "out.png"), {"options": export.ExportOptions(32, 24)}),
+                              (os.path.join(tmp_path, "huge.jpg"), {"options": export.ExportOptions(20000, 20000)}),
+                              (os.path.join(tmp_path, "missing", "out.svg"), {"svg_size": QtCore.QSize(32, 24)})):
+        message = save(window, file_name, **kwargs)
+        assert message.startswith(f"Could not save {file_name}: "), message
+        assert not os.path.exists(file_name)
+
+
+def test_snapshot_skips_shapes_being_drawn(window):
+    draw(window)
+    window.select_polyline()
+    window.draw_polyline((QtCore.QPointF(10, 10), QtCore.QPointF(50, 50)))
+    assert window._polyline is not None
+    assert [record.kind for record in window.snapshot_scene().records] == [scene_snapshot.LINE]
+    window.select_spline()  # finishes the polyline
+    for kind in (graphics_view.SPLINE_PRESS, graphics_view.SPLINE_RELEASE, graphics_view.SPLINE_MOVE):
+        window.spline_event((kind, QtCore.QPointF(100, 100)))
+    assert window._spline is not None
+    assert [record.kind for record in window.snapshot_scene().records] == [scene_snapshot.LINE, scene_snapshot.PATH]
@@ -0,0 +1,80 @@
+import pytest
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import Qt
+
+from UI import export, scene_snapshot
+
+
+@pytest.fixture
+def scene(app):
+    scene = QtWidgets.QGraphicsScene(0, 0, 400, 300)
+    scene.setBackgroundBrush(QtGui.QColor("#eef"))
+    scene.addLine(0, 150, 400, 150, QtGui.QPen(Qt.red, 6))
+    scene.addRect(50, 50, 100, 60, QtGui.QPen(Qt.blue, 4), QtGui.QBrush(Qt.yellow))
+    scene.addEllipse(200, 30, 80, 50, QtGui.QPen(Qt.darkGreen, 3)).setRotation(20)
+    path = QtGui.QPainterPath(QtCore.QPointF(10, 250))
+    path.cubicTo(60, 180, 120, 320, 180, 250)
+    scene.addPath(path, QtGui.QPen(Qt.black, 2))
+    text = scene.addText("Hello export", QtGui.QFont("DejaVu Sans", 14))
+    text.setPos(220, 200)
+    text.setDefaultTextColor(QtGui.QColor("#c0c"))
+    image = QtGui.QImage(40, 30, QtGui.QImage.Format_RGB32)
+    image.fill(Qt.cyan)
+    pixmap = scene.addPixmap(QtGui.QPixmap.fromImage(image))
+    pixmap.setPos(300, 230)
+    pixmap.setScale(1.5)
+    pixmap.setTransformationMode(Qt.SmoothTransformation)  # as the images of the canvas
+    yield scene
+    scene.clear()
+
+
+def render(scene, size: QtCore.QSize, source: QtCore.QRectF) -> QtGui.QImage:
+    image = QtGui.QImage(size, QtGui.QImage.Format_ARGB32_Premultiplied)
+    image.fill(Qt.white)
+    painter = QtGui.QPainter(image)
+    painter.setRenderHints(QtGui.QPainter.Antialiasing | QtGui.QPainter.SmoothPixmapTransform)
+    scene.render(painter, QtCore.QRectF(image.rect()), source, Qt.IgnoreAspectRatio)
+    painter.end()
+    return image
+
+
+@pytest.mark.parametrize("source", [QtCore.QRectF(0, 0, 400, 300), QtCore.QRectF(180, 120, 100, 100)])
+def test_renderer_matches_scene(scene, source):
+    renderer = scene_snapshot.SnapshotRenderer(scene_snapshot.SceneSnapshot.capture(scene))
+    size = QtCore.QSize(800, 600)
+    assert render(renderer, size, source) == render(scene, size, source)
+
+
+def test_renderer_culls_records(scene):
+    renderer = scene_snapshot.SnapshotRenderer(scene_snapshot.SceneSnapshot.capture(scene))
+    assert len(renderer.items(QtCore.QRectF(0, 0, 400, 300))) == len(scene.items())
+    assert [record.kind for record in renderer.items(QtCore.QRectF(60, 60, 10, 10))] == [scene_snapshot.RECT]
+    assert not renderer.items(QtCore.QRectF(390, 10, 5, 5))
+    assert renderer.itemsBoundingRect().contains(scene.itemsBoundingRect())
+
+
+def test_export_from_snapshot(scene, tmp_path):
+    renderer = scene_snapshot.SnapshotRenderer(scene_snapshot.SceneSnapshot.capture(scene))
+    options = export.ExportOptions(600, 450, tile_size=64, source_rect=export.scene_export_rect(scene))
+    images = []
+    for name, source in (("scene.png", scene), ("snapshot.png", renderer)):
+        file_name = str(tmp_path / name)
+        assert export.export_scene_image(source, file_name, options)
+        images.append(QtGui.QImage(file_name))
+    assert images[0] == images[1]
+
+
+def test_renderer_decodes_full_resolution(app, tmp_path):
+    file_name = str(tmp_path / "original.png")
+    original = QtGui.QImage(800, 600, QtGui.QImage.Format_RGB32)
+    original.fill(Qt.green)
+    assert original.save(file_name)
+    preview = original.scaled(80, 60)
+    record = scene_snapshot.ItemRecord(scene_snapshot.PIXMAP, preview, QtGui.QTransform(), offset=QtCore.QPointF(),
+                                       source=file_name, size=QtCore.QSizeF(800, 600))
+    snapshot = scene_snapshot.SceneSnapshot((record,), QtCore.QRectF(0, 0, 800, 600), QtGui.QBrush())
+    renderer = scene_snapshot.SnapshotRenderer(snapshot)
+    render(renderer, QtCore.QSize(80, 60), snapshot.scene_rect)  # the preview is enough
+    assert not renderer._images
+    render(renderer, QtCore.QSize(800, 600), snapshot.scene_rect)
+    assert renderer._images[0].size() == original.size()
@@ -0,0 +1,82 @@
+import os
+import time
+
+from PyQt5 import QtWidgets
+
+from UI import svg_import
+from benchmarks.run_benchmarks import write_synthetic_svg
+
+
+def wait_for(predicate, timeout: float = 60):
+    started = time.perf_counter()
+    while not predicate():
+        assert time.perf_counter() - started < timeout, "timed out"
+        QtWidgets.QApplication.processEvents()
+
+
+def test_cancel_rolls_back_import(window, tmp_path):
+    file_name = os.path.join(tmp_path, "large.svg")
+    write_synthetic_svg(file_name, 20000)
+    window.import_svg(file_name)
+    worker = window._svg_import_worker
+    wait_for(lambda: window._svg_import_items)  # the first chunk is in the scene
+    window._svg_import_progress.findChild(QtWidgets.QPushButton).click()  # the dialog's Cancel button
+    assert worker.is_cancelled()  # right away, not once the worker is done
+    wait_for(lambda: window._svg_import_thread is None)
+    assert not window._scene.items()
+    assert not window.history.can_undo()
+
+
+def test_import_completes(window, tmp_path):
+    file_name = os.path.join(tmp_path, "small.svg")
+    write_synthetic_svg(file_name, 100)
+    window.import_svg(file_name)
+    wait_for(lambda: window._svg_import_thread is None)
+    assert len(window._scene.items()) == 100
+    assert window.history.can_undo()
+
+
+def test_import_builds_the_scene_index_once(window, tmp_path, monkeypatch):
+    file_name = os.path.join(tmp_path, "chunked.svg")
+    write_synthetic_svg(file_name, 6000)  # three chunks
+    scene = window._scene
+    index_methods = []
+    set_index_method = scene.setItemIndexMethod
+
+    def record_index_method(method):
+        index_methods.append(method)
+        set_index_method(method)
+
+    monkeypatch.setattr(scene, "setItemIndexMethod", record_index_method)
+    window.import_svg(file_name)
+    wait_for(lambda: window._svg_import_thread is None)
+    assert len(scene.items()) == 6000
+    assert index_methods.count(QtWidgets.QGraphicsScene.BspTreeIndex) == 1
+    assert scene.itemIndexMethod() == QtWidgets.QGraphicsScene.BspTreeIndex
+
+
+def test_progress_of_element_pass_is_estimated_from_the_start_tags(app, tmp_path):
+    file_name = os.path.join(tmp_path, "progress.svg")
+    write_synthetic_svg(file_name, 1000)
+    worker = svg_import.SvgImportWorker(file_name, chunk_size=100)
+    elements, progress = [], []
+    worker.chunk_ready.connect(lambda chunk: (elements.append(len(chunk)), worker.chunk_consumed()))
+    worker.progress.connect(progress.append)
+    worker.run()  # in this thread, chunks are consumed right away
+    assert sum(elements) == 1000
+    assert progress == sorted(progress) and progress[-1] == 100
+    assert 90 <= progress[-2] <= 99  # the last chunk before the end
+
+
+def test_texts_keep_their_color(window, tmp_path):
+    file_name = os.path.join(tmp_path, "texts.svg")
+    with open(file_name, "w") as f:
+        f.write('<svg xmlns="http://www.w3.org/2000/svg" width="200" height="100">\n'
+                '<text x="10" y="20" fill="#ff0000" font-size="12">filled</text>\n'
+                '<text x="10" y="40" font-size="12">default</text>\n'
+                '<text x="10" y="60" fill="none" stroke="#00ff00" font-size="12">outlined</text>\n'
+                '</svg>\n')
+    window.import_svg(file_name)
+    wait_for(lambda: window._svg_import_thread is None)
+    colors = {item.toPlainText(): item.defaultTextColor().name() for item in window._scene.items()}
+    assert colors == {"filled": "#ff0000", "default": "#000000", "outlined": "#00ff00"}
@@ -0,0 +1,80 @@
+import os
+import struct
+
+import pytest
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtCore import Qt
+
+from UI import image_loader, tiled_image
+
+
+def write_oriented_jpeg(file_name: str, image: QtGui.QImage, orientation: int):
+    """
+    save a jpeg with an exif orientation tag, Qt applies the transformation to the pixels instead of tagging
+    """
+    buffer = QtCore.QBuffer()
+    buffer.open(QtCore.QIODevice.WriteOnly)
+    assert image.save(buffer, "JPG", 95)
+    data = bytes(buffer.data())
+    tiff = b"II*\x00" + struct.pack("<IH", 8, 1) + struct.pack("<HHIHH", 0x0112, 3, 1, orientation, 0) + \
+        struct.pack("<I", 0)
+    app1 = b"Exif\x00\x00" + tiff
+    position = 2 + (2 + struct.unpack(">H", data[4:6])[0] if data[2:4] == b"\xff\xe0" else 0)  # after JFIF
+    with open(file_name, "wb") as f:
+        f.write(data[:position] + b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 + data[position:])
+
+
+@pytest.mark.parametrize("orientation", [2, 3, 6, 8])  # mirrored, 180°, 90° and 270°
+def test_pyramid_of_exif_oriented_image(app, tmp_path, monkeypatch, orientation):
+    stored = QtGui.QImage(600, 300, QtGui.QImage.Format_RGB32)
+    stored.fill(Qt.white)
+    painter = QtGui.QPainter(stored)
+    painter.fillRect(0, 0, 300, 150, Qt.red)
+    painter.fillRect(300, 150, 300, 150, Qt.blue)
+    painter.end()
+    file_name = str(tmp_path / "oriented.jpg")
+    write_oriented_jpeg(file_name, stored, orientation)
+    assert QtGui.QImageReader(file_name).transformation() != QtGui.QImageIOHandler.TransformationNone
+    monkeypatch.setattr(tiled_image, "BUILD_MEMORY", 4 * 600 * tiled_image.TILE_SIZE)  # would band by tile rows
+
+    decoded = image_loader.decode_image(file_name, QtCore.QSize(64, 64))
+    pyramid = tiled_image.TilePyramid(file_name, decoded.full_size, use_disk_cache=False)
+    pyramid.build()
+    reader = QtGui.QImageReader(file_name)
+    reader.setAutoTransform(True)
+    expected = reader.read().convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+    assert expected.size() == decoded.full_size
+    columns, rows = pyramid.grid(0)
+    for ty in range(rows):
+        for tx in range(columns):
+            tile = pyramid.store.get((0, tx, ty))
+            rect = QtCore.QRect(tx * tiled_image.TILE_SIZE, ty * tiled_image.TILE_SIZE, tile.width(), tile.height())
+            assert tile == expected.copy(rect)
+
+
+def test_disk_cache_removes_least_recently_opened_pyramids(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(tiled_image, "_open_directories", set())
+    tile = QtGui.QImage(tiled_image.TILE_SIZE, tiled_image.TILE_SIZE, QtGui.QImage.Format_RGB32)
+    tile.fill(Qt.gray)
+    tile_bytes = tiled_image._TILE_HEADER.size + 4 * tile.width() * tile.height()
+    cache_dir = str(tmp_path / "tiles")
+
+    def open_store(name: str, mtime: int) -> tiled_image.DiskTileStore:
+        source = tmp_path / name
+        source.write_bytes(name.encode())
+        store = tiled_image.DiskTileStore(str(source), cache_dir)
+        store.put((0, 0, 0), tile)
+        store.mark_complete()
+        os.utime(store.directory, ns=(mtime, mtime))
+        return store
+
+    monkeypatch.setattr(tiled_image, "DISK_CACHE_BYTES", 2 * tile_bytes)
+    older, old = open_store("a.png", 1_000_000_000), open_store("b.png", 2_000_000_000)
+    tiled_image._open_directories.clear()  # a later session
+    current = open_store("c.png", 0)  # the oldest, but open
+    assert not os.path.exists(older.directory)
+    assert os.path.exists(old.directory)
+    assert current.get((0, 0, 0)) == tile.convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+    tiled_image.trim_disk_cache(cache_dir, 0)
+    assert not os.path.exists(old.directory)
+    assert os.path.exists(current.directory)